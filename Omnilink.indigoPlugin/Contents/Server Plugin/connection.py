@@ -17,21 +17,64 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """Connection management for Leviton/HAI Omni plugin for IndigoServer"""
 
+from collections import namedtuple, OrderedDict
 import datetime
 import logging
+import os
 import Queue as queue
+import socket
+import struct
 import subprocess
 import threading
 import time
 
 from py4j.java_gateway import JavaGateway, CallbackServerParameters
-from py4j.protocol import Py4JError, Py4JJavaError
+from py4j.protocol import Py4JError, Py4JJavaError, Py4JNetworkError
+
+from diagnostics import LatencyStats
+from gatewaypool import GatewayPool
+import omni_messages
 
 log = logging.getLogger(__name__)
 
 # Seconds until retrying a non-responding address
 _TIME_BETWEEN_RETRIES = datetime.timedelta(seconds=60)
 
+# Seconds to wait for the Java runtime to finish starting
+_JAVA_WAIT = 30
+
+_JAVA = "jre/bin/java"
+_CLASSPATH = "java/lib/py4j/py4j0.9.1.jar:java/build/jar/OmniForPy.jar"
+_MAIN_CLASS = "me.gazally.main.MainEntryPoint"
+
+# Java settings for a small heap and a quick start. The JIT's first tier
+# is plenty for a program which mostly waits for network traffic.
+_JAVA_TUNING = ["-Xms8m", "-Xmx64m", "-Xss512k", "-XX:+UseSerialGC",
+                "-XX:TieredStopAtLevel=1"]
+
+# Seconds a sidecar Java runtime keeps running without hearing from the
+# plugin, and seconds between renewals of that lease
+_LEASE = 120
+_LEASE_RENEWAL = 30
+
+# Gateway connections to open when Java starts, and seconds an unused
+# one is kept open
+_POOL_PREWARM = 2
+_POOL_IDLE = 60
+
+# Seconds a notification worker waits for something to do before
+# checking whether it should quit
+_WORKER_POLL = 1
+
+# Bytes read from a notification stream at a time
+_STREAM_BUFFER = 8192
+
+# Most jomnilinkII debug records to fetch in one call
+_DEBUG_BATCH = 500
+
+DebugRecord = namedtuple("DebugRecord", ["time", "thread", "category",
+                                         "text"])
+
 
 class ConnectionError(RuntimeError):
     """Error raised when the connection to the Omni system is down.
@@ -51,38 +94,116 @@ class Connection(object):
 
     Class methods:
     startup(timeout) -- launch the Java subprocess and create the py4j gateway
+    start_java(timeout) -- do startup on a background thread, if it hasn't
+                           been done already
+    wait_for_java -- start_java, and wait for it to finish
+    gateway_stats -- describe the use of the gateway connection pool
     shutdown -- close the gateway and kill the subprocess and any instance
-                   threads
+                   threads, or leave the subprocess running if it is a
+                   sidecar
+    renew_lease -- keep a sidecar subprocess from quitting
+    set_debug -- turn jomnilinkII's debug output on or off
+    drain_debug_log -- fetch a batch of jomnilinkII's debug output
+    release -- let Java free the objects behind py4j proxies right away
 
     Public instance properties:
     omni -- a Connection object from jomnilinkII
     jomnilinkII -- the jomnilinkII Java library
+    session -- counts the jomnilinkII Connection objects made so far, so
+               that information which can only change while the link is
+               down can be cached until it changes
 
     Public instance methods:
     is_connected -- returns True if the jomnilinkII Connection object exists
                     and claims to be connected
-    update -- if the jomnilinkII Connection object says it is no longer
-              connected, try to make a new one. This will be done in a separate
-              thread so that timeouts from failed network communication don't
-              block other work.
+    set_keep_alive -- change the liveness probe settings of the
+                      jomnilinkII Connection object
+    set_subscriptions -- tell the jomnilinkII Connection object which
+                         notifications to pass along
+    controller_commands -- send a batch of commands in one call to Java
+    hold_command -- keep a command which couldn't be sent while the
+                    controller is disconnected, to send on reconnection
+    copy_status -- copy a status message out of Java and release it
+    update -- handle the notifications that have arrived, unless a worker
+              thread is doing that. If the jomnilinkII Connection object
+              says it is no longer connected, try to make a new one. This
+              will be done in a separate thread so that timeouts from
+              failed network communication don't block other work.
     close --  Use when you are done with an instance to tell it to shut down
               a reconnection thread, if it has one.
 
     """
     javaproc = None
     gateway = None
-    java_running = False
+    pool = None
     threads = []
 
+    # Most connections to the Java gateway, and seconds to wait for one
+    # when they are all busy. Take effect the next time Java is started.
+    pool_size = 8
+    pool_wait = 5
+
+    # Path of the Java class data sharing archive, which is created the
+    # first time it is needed. None to not use one.
+    class_archive = None
+
+    # Set when the background Java startup has finished, whether or not
+    # it worked. If on_java_ready is set, it is called on the startup
+    # thread with the stdout and stderr pipes of the Java subprocess.
+    java_ready = threading.Event()
+    java_thread = None
+    on_java_ready = None
+    # Set by shutdown, which also sets java_ready so nothing keeps
+    # waiting for Java
+    quitting = False
+    _java_lock = threading.Lock()
+
+    # If sidecar is set, Java is started in its own session with output
+    # going to sidecar_log, and is left running at shutdown, so that the
+    # next run of the plugin can attach to it and take over its
+    # connections to the controllers. It quits by itself if its lease
+    # isn't renewed. Takes effect the next time Java is started.
+    sidecar = False
+    sidecar_log = None
+    java_is_sidecar = False
+    _lease_renewed = 0
+
+    # If set, notifications from the controllers are sent over a socket
+    # of their own as raw messages and decoded here, instead of being
+    # decoded by jomnilinkII and passed along with py4j callbacks.
+    # Takes effect on the next connection to a controller.
+    stream_notifications = False
+
+    # If set, each connection handles its notifications in order on a
+    # thread of its own, so that a controller whose handlers block
+    # doesn't hold up the others. Otherwise they are all handled by
+    # update. Takes effect on new Connection objects.
+    workers = False
+
+    # Seconds from the arrival of each notification until its handlers
+    # are called, by url
+    lag_stats = LatencyStats()
+
+    # Liveness probe settings in seconds, see set_keep_alive
+    keep_alive_interval = 10
+    keep_alive_timeout = 5
+
     def __init__(self, ip, port, encoding, notifications):
         """ Create a connection to the Omni controller at ip:port using
         the encryption key given by the encoding parameter.
         The notifications parameter should be a dictionary containing
-        four lists of functions to call back. The keys are "status",
-        "event", "disconnect" and "reconnect", and the first two are used
-        to pass along messages coming from the controller and the second
-        two to send notifications when the communication link to the controller
-        goes down or is brought back up.
+        five lists of functions to call back. The keys are "status",
+        "event", "system_status", "disconnect" and "reconnect". The first
+        two are used to pass along messages coming from the controller,
+        the third to pass along the answers to keep-alive pings, and the
+        last two to send notifications when the communication link to the
+        controller goes down or is brought back up. The lists are
+        shared, not copied, so functions added to them later get called
+        too.
+
+        If the Java runtime isn't ready yet, this starts it and returns
+        without waiting. The connection is then made in the background
+        and announced with a reconnect notification.
 
         """
         self.ip, self.port, self.encoding = ip, port, encoding
@@ -91,29 +212,104 @@ class Connection(object):
         self.notification_queue = queue.Queue(maxsize=0)
 
         self.callbacks = {
-            "status":    [self.status_callback] + notifications["status"],
-            "event":     [self.event_callback] + notifications["event"],
-            "reconnect": ([self.reconnect_callback] +
-                          notifications["reconnect"]),
-            "disconnect": ([self.disconnect_callback] +
-                           notifications["disconnect"])}
+            "status":    self.status_callback,
+            "event":     self.event_callback,
+            "system_status": self.system_status_callback,
+            "reconnect": self.reconnect_callback,
+            "disconnect": self.disconnect_callback}
+        self.notifications = notifications
 
         self._omni = None
+        self.stream = None
+        self.subscriptions = None
+        self.status_classes = {}
         self._timestamp = datetime.datetime.now()
+        self.time_to_detect = None
+        self.session = 0
+        self.reattached = False
+        self.worker = None
+        # True until the first attempt to connect in the background is over
+        self.starting = False
 
-        if self.gateway is None or not self.encoding:
+        # key is a target such as ("unit", 5), value is HeldCommand
+        self.held = OrderedDict()
+        self._held_lock = threading.Lock()
+
+        if not self.encoding:
+            return
+        if self.workers:
+            self._start_worker()
+        if self.gateway is None:
+            # Don't hold up the caller while Java starts
+            self._setup_first_connection()
             return
 
         log.debug("Initiating connection with Omni system at {0}".format(
             self.url))
         try:
             self._omni = self._get_omni_link()
+            self.session += 1
+            if self.reattached:
+                # Catch up on what happened while nobody was listening
+                self.notification_queue.put(
+                    NotificationEvent("reconnect", self._omni))
         except Py4JError as e:
             log.error("Unable to establish connection with Omni system" +
                       self.message_from_java_error(e))
             log.debug("", exc_info=True)
             self._setup_retry()
 
+    def _start_worker(self):
+        self.worker = threading.Thread(target=self.work_loop,
+                                       name="Notifications " + self.url)
+        self.worker.setDaemon(True)
+        self.worker.start()
+        self.threads.append(self.worker)
+
+    def work_loop(self):
+        """ Handle notifications as they arrive, until told to quit. An
+        error in a handler is logged and doesn't stop the loop. """
+        t = threading.currentThread()
+        while not getattr(t, "time_to_quit", False):
+            try:
+                notify = self.notification_queue.get(timeout=_WORKER_POLL)
+            except queue.Empty:
+                continue
+            try:
+                self._dispatch(notify)
+            except Exception:
+                log.error("Error while handling {0} notification from "
+                          "{1}".format(notify.event_type, self.url),
+                          exc_info=True)
+
+    def _setup_first_connection(self):
+        self.starting = True
+        t = threading.Thread(target=self.first_connection,
+                             name="Connect " + self.url)
+        t.start()
+        self.threads.append(t)
+
+    def first_connection(self):
+        """ Start the Java runtime if that hasn't been done, wait for it,
+        and then connect to the controller, passing the jomnilinkII
+        Connection object along with a reconnect notification. If any of
+        that fails, keep trying. """
+        try:
+            if self.wait_for_java():
+                log.debug("Initiating connection with Omni system "
+                          "at {0}".format(self.url))
+                omni = self._get_omni_link()
+                self.notification_queue.put(
+                    NotificationEvent("reconnect", omni))
+                return
+        except Py4JError as e:
+            log.error("Unable to establish connection with Omni system" +
+                      self.message_from_java_error(e))
+            log.debug("", exc_info=True)
+        finally:
+            self.starting = False
+        self.retry_connection_loop()
+
     def _setup_retry(self):
         t = threading.Thread(target=self.retry_connection_loop,
                              name="Reconnect")
@@ -127,6 +323,8 @@ class Connection(object):
             if (datetime.datetime.now() >
                     self._timestamp + _TIME_BETWEEN_RETRIES):
                 self._timestamp = datetime.datetime.now()
+                if not self.wait_for_java():
+                    continue
                 log.debug("Attempting to reconnect to Omni system "
                           "at {0}".format(self.url))
                 try:
@@ -154,20 +352,204 @@ class Connection(object):
         return message
 
     def _get_omni_link(self):
-        """ Create and set up one of jomnilinkII's connection objects """
+        """ Create and set up one of jomnilinkII's connection objects, or
+        take over the one a sidecar Java runtime already has open """
         jomnilinkII = self.gateway.jvm.com.digitaldan.jomnilinkII
 
-        omni = jomnilinkII.Connection(self.ip, self.port, self.encoding)
-        omni.setDebug(True)
+        omni = None
+        if self.java_is_sidecar:
+            omni = self.gateway.entry_point.existingConnection(
+                self.ip, self.port, self.encoding)
+        self.reattached = omni is not None
+        if self.reattached:
+            log.debug("Reattaching to connection with " + self.url)
+            omni.removeAllListeners()
+        else:
+            omni = jomnilinkII.Connection(self.ip, self.port, self.encoding)
+            if self.java_is_sidecar:
+                self.gateway.entry_point.register(self.ip, self.port,
+                                                  self.encoding, omni)
+        self._apply_keep_alive(omni)
+        self._apply_subscriptions(omni)
 
+        Message = jomnilinkII.Message
+        self.status_classes = {
+            Message.OBJ_TYPE_ZONE: omni_messages.ZoneStatus,
+            Message.OBJ_TYPE_UNIT: omni_messages.UnitStatus,
+            Message.OBJ_TYPE_AREA: omni_messages.AreaStatus}
         omni.addNotificationListener(NotificationListener(
-            self.notification_queue))
+            self.notification_queue, self.status_classes))
         omni.addDisconnectListener(DisconnectListener(self.notification_queue))
+        if self.stream_notifications:
+            self._open_stream(omni)
         omni.enableNotifications()
 
         log.debug("Successful connection to Omni system at " + self.url)
         return omni
 
+    def _open_stream(self, omni):
+        """ Have jomnilinkII send notifications over a socket. If that
+        doesn't work, they keep coming with callbacks. """
+        self._close_stream()
+        try:
+            port = self.gateway.entry_point.openNotificationStream(omni)
+            self.stream = NotificationStream(port, self.notification_queue)
+        except (Py4JError, socket.error):
+            log.debug("Unable to open notification stream for " + self.url,
+                      exc_info=True)
+
+    def _close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def controller_commands(self, commands):
+        """ Send a list of (command name, parameter 1, parameter 2)
+        tuples to the controller with one call to Java, which sends them
+        in order. Command names are those of the constants in jomnilinkII's
+        CommandMessage. Return a list with None for each command the
+        controller acknowledged and an error message for each it didn't.
+        May raise ConnectionError or Py4JError if the batch couldn't be
+        sent at all.
+        """
+        if not commands:
+            return []
+        batch = "\n".join("{0} {1} {2}".format(name, p1, p2)
+                          for name, p1, p2 in commands)
+        results = self.gateway.entry_point.controllerCommands(self.omni,
+                                                              batch)
+        return [r or None for r in results.split("\n")]
+
+    def hold_command(self, target, cmd_name, p1, p2, ttl):
+        """ Keep a command which couldn't be sent because the controller
+        is disconnected, and send it when the connection comes back,
+        unless ttl seconds pass first. target is anything hashable naming
+        what the command is for, such as ("unit", 5). A newer command for
+        the same target replaces an older one, and goes to the back of
+        the line. Return False if ttl is 0, so nothing was kept.
+        """
+        if ttl <= 0:
+            return False
+        with self._held_lock:
+            self.held.pop(target, None)
+            self.held[target] = HeldCommand(cmd_name, p1, p2,
+                                            time.time() + ttl)
+        log.debug("Holding {0} {1} {2} for {3} until reconnected".format(
+            cmd_name, p1, p2, self.url))
+        return True
+
+    def _send_held(self):
+        """ Send the held commands which haven't expired, in order, with
+        one call to Java if it can do that and one call each if not. Keep
+        the ones which can't be sent for the next reconnection. """
+        now = time.time()
+        with self._held_lock:
+            held, self.held = self.held, OrderedDict()
+        expired = [c for c in held.values() if c.expires <= now]
+        if expired:
+            log.error("Dropped {0} commands for {1} which were held "
+                      "too long".format(len(expired), self.url))
+        held = OrderedDict((target, c) for target, c in held.items()
+                           if c.expires > now)
+        if not held:
+            return
+        try:
+            results = self.controller_commands(
+                [(c.cmd_name, c.p1, c.p2) for c in held.values()])
+        except (Py4JNetworkError, ConnectionError):
+            log.debug("Unable to send held commands to " + self.url,
+                      exc_info=True)
+            results = []
+        except Py4JError:
+            # Perhaps the Java side is too old to have controllerCommands
+            log.debug("Unable to send held commands to {0} in a batch, "
+                      "sending them one at a time".format(self.url),
+                      exc_info=True)
+            results = self._send_each(held.values())
+        if results:
+            log.debug("Sent {0} held commands to {1}".format(len(results),
+                                                             self.url))
+        for c, result in zip(held.values(), results):
+            if result is not None:
+                log.error("Held command {0} {1} {2} to {3} failed: "
+                          "{4}".format(c.cmd_name, c.p1, c.p2, self.url,
+                                       result))
+        if len(results) < len(held):
+            # Keep the rest for the next reconnection
+            unsent = OrderedDict(held.items()[len(results):])
+            with self._held_lock:
+                for target, c in self.held.items():
+                    unsent.pop(target, None)
+                    unsent[target] = c
+                self.held = unsent
+
+    def _send_each(self, commands):
+        """ Send HeldCommands with a call to Java for each, stopping if
+        the connection fails. Return a list of results like
+        controller_commands does, for the ones that were sent. """
+        results = []
+        for c in commands:
+            try:
+                cmd = getattr(self.jomnilinkII.MessageTypes.CommandMessage,
+                              c.cmd_name)
+                self.omni.controllerCommand(cmd, c.p1, c.p2)
+                results.append(None)
+            except (Py4JNetworkError, ConnectionError):
+                break
+            except Py4JError as e:
+                results.append(unicode(e))
+        return results
+
+    def set_keep_alive(self, interval, timeout):
+        """ Set the number of seconds of silence from the controller after
+        which it gets sent a probe, and the number of seconds to wait for
+        an answer before deciding the connection is dead. An interval of
+        0 turns probing off.
+        """
+        self.keep_alive_interval, self.keep_alive_timeout = interval, timeout
+        if self._omni is not None:
+            self._apply_keep_alive(self._omni)
+
+    def _apply_keep_alive(self, omni):
+        try:
+            omni.setKeepAlive(int(self.keep_alive_interval * 1000),
+                              int(self.keep_alive_timeout * 1000))
+        except Py4JError:
+            log.debug("Unable to set keep-alive probe for " + self.url,
+                      exc_info=True)
+
+    def set_subscriptions(self, subscriptions):
+        """ Have jomnilinkII drop the notifications that nobody wants
+        before they cost a trip to Python. subscriptions is a dictionary
+        whose keys are object types, with lists of (first, last) tuples
+        of object number ranges for values, plus the key "events" set to
+        True if other event notifications are wanted. None means to pass
+        everything along.
+        """
+        self.subscriptions = subscriptions
+        if self._omni is not None:
+            self._apply_subscriptions(self._omni)
+
+    def _apply_subscriptions(self, omni):
+        if self.subscriptions is None:
+            return
+        try:
+            omni.setNotificationFilter(self.filter_spec(self.subscriptions))
+        except Py4JError:
+            log.debug("Unable to set notification filter for " + self.url,
+                      exc_info=True)
+
+    @staticmethod
+    def filter_spec(subscriptions):
+        """ Format subscriptions the way jomnilinkII's NotificationFilter
+        wants them, for example "events;1:1-8,12-12;2:1-40". """
+        parts = ["events"] if subscriptions.get("events") else []
+        for obj_type, ranges in sorted(subscriptions.items()):
+            if obj_type != "events" and ranges:
+                parts.append("{0}:{1}".format(obj_type, ",".join(
+                    "{0}-{1}".format(first, last) for first, last in ranges)))
+        return ";".join(parts)
+
     # ----- Callbacks for notification events ----- #
 
     def status_callback(self, _, status):
@@ -177,14 +559,28 @@ class Connection(object):
     def event_callback(self, _, other):
         log.debug("Received otherEventNotification from " + self.url)
 
+    def system_status_callback(self, _, status):
+        log.debug("Received system status from " + self.url)
+
     def reconnect_callback(self, _, omni):
         log.debug("Sending reconnect notifications")
         self._omni = omni
+        self.session += 1
+        self._send_held()
 
     def disconnect_callback(self, _, e):
         log.error("Lost communication with {0}: {1}".format(self.url,
                   e.getMessage()))
+        try:
+            if self._omni is not None:
+                silence = self._omni.silenceAtDisconnect()
+                self.time_to_detect = silence / 1000.0
+                log.debug("Loss of communication detected {0:.1f} seconds "
+                          "after the last message".format(self.time_to_detect))
+        except Py4JError:
+            log.debug("", exc_info=True)
         self._omni = None
+        self._close_stream()
         self._setup_retry()
 
     # ----- Update connections and process notifications ----- #
@@ -197,22 +593,30 @@ class Connection(object):
             return
 
         try:
-            while True:
-                notify = self.notification_queue.get_nowait()
-                for c in self.callbacks[notify.event_type]:
-                    c(self, notify.data)
-                self.notification_queue.task_done()
+            while self.worker is None:
+                self._dispatch(self.notification_queue.get_nowait())
         except queue.Empty:
             pass
 
         if self.is_connected():
             self._timestamp = datetime.datetime.now()
 
+    def _dispatch(self, notify):
+        self.lag_stats.record(self.url, time.time() - notify.time)
+        try:
+            self.callbacks[notify.event_type](self, notify.data)
+            for c in self.notifications[notify.event_type]:
+                c(self, notify.data)
+        finally:
+            self.notification_queue.task_done()
+
     # ----- Properties to access jomnilinkII and its Connection object ----- #
 
     @property
     def jomnilinkII(self):
-        if self.is_connected():
+        # The gateway goes away at shutdown, perhaps while an event log
+        # sync is still running
+        if self.gateway is not None and self.is_connected():
             return self.gateway.jvm.com.digitaldan.jomnilinkII
         else:
             raise ConnectionError
@@ -225,111 +629,393 @@ class Connection(object):
         else:
             raise ConnectionError
 
+    # ----- Copying and releasing Java objects ----- #
+
+    def copy_status(self, status_msg):
+        """ Given an ObjectStatus message from jomnilinkII, return a copy
+        of it made out of omni_messages objects, and release the Java
+        objects. """
+        status, read = omni_messages.copy_object_status(status_msg,
+                                                        self.status_classes)
+        self.release(*read)
+        return status
+
+    @classmethod
+    def release(cls, *objects):
+        """ Tell Java it can forget the objects behind some py4j proxies
+        now, instead of when Python gets around to garbage collecting
+        the proxies. Don't use the proxies afterwards. """
+        if cls.gateway is None:
+            return
+        for obj in objects:
+            try:
+                cls.gateway.detach(obj)
+            except (Py4JError, AttributeError):
+                log.debug("Unable to release Java object", exc_info=True)
+
     # ----- Class methods to start up and shut down the java gateway ----- #
 
     @classmethod
     def startup(cls, timeout=5):
         """ Try to launch the java runtime containing jomnilinkII and
         build a py4j gateway to communicate with it. If successful,
-        return stdout and stderr pipes from the Java subprocess. If
-        not, log an error message and return None,None.
+        return stdout and stderr pipes from the Java subprocess, which
+        are None for a sidecar. If not, log an error message and return
+        None,None.
         """
-        if cls.javaproc is None:
+        if cls.gateway is None:
             try:
                 cls._connect_to_java(timeout)
-            except (OSError, ConnectionError, Py4JError):
+            except (OSError, IOError, ConnectionError, Py4JError):
                 log.error("Unable to communicate with jomnilinkII library")
                 log.debug("", exc_info=True)
+                cls._stop_java()
                 return None, None
 
+        if cls.javaproc is None:
+            return None, None
         return cls.javaproc.stdout, cls.javaproc.stderr
 
     @classmethod
-    def _connect_to_java(cls, timeout):
-        cls.javaproc = subprocess.Popen(
-            ["jre/bin/java",
-             "-classpath",
-             "java/lib/py4j/py4j0.9.1.jar:java/build/jar/OmniForPy.jar",
-             "me.gazally.main.MainEntryPoint"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        log.debug("Java Runtime started")
+    def start_java(cls, timeout=5):
+        """ Run startup on a background thread, unless that has already
+        been done, so that the plugin doesn't wait for the Java runtime
+        until something needs it. """
+        with cls._java_lock:
+            if cls.java_thread is not None:
+                return
+            cls.java_ready.clear()
+            cls.java_thread = threading.Thread(target=cls._java_startup,
+                                               name="Java Startup",
+                                               args=(timeout,))
+            cls.java_thread.setDaemon(True)
+        cls.java_thread.start()
 
-        cls._start_output_detection_thread()
-        for i in range(timeout * 10):
-            time.sleep(0.1)
-            if cls.java_running:
-                log.debug("Java Gateway Server started")
-                break
-        else:
-            raise ConnectionError("Failed to detect output from Java runtime")
+    @classmethod
+    def _java_startup(cls, timeout):
+        try:
+            stdout, stderr = cls.startup(timeout)
+            if cls.gateway is not None and cls.on_java_ready is not None:
+                cls.on_java_ready(stdout, stderr)
+        except Exception:
+            log.error("Error while starting Java", exc_info=True)
+        finally:
+            if cls.gateway is None:
+                # Let the next connection that needs Java try again
+                with cls._java_lock:
+                    cls.java_thread = None
+            cls.java_ready.set()
+
+    @classmethod
+    def wait_for_java(cls, timeout=_JAVA_WAIT):
+        """ Start the Java runtime if that hasn't been done, and wait
+        until it's ready. Return True if the gateway to it is working.
+        Return False right away once shutdown has begun.
+        """
+        if cls.quitting:
+            return False
+        cls.start_java()
+        cls.java_ready.wait(timeout)
+        return cls.gateway is not None and not cls.quitting
+
+    @classmethod
+    def _connect_to_java(cls, timeout):
+        cls.pool = GatewayPool(max_size=cls.pool_size, wait=cls.pool_wait,
+                               idle_timeout=_POOL_IDLE)
         cls.gateway = JavaGateway(
+            gateway_client=cls.pool,
             start_callback_server=True,
             callback_server_parameters=CallbackServerParameters())
+        if cls.sidecar and cls._ping():
+            log.debug("Attached to Java Gateway Server already running")
+        else:
+            cls._launch_java()
+            cls._wait_for_gateway(timeout)
+            log.debug("Java Gateway Server started")
+        cls.pool.prewarm(_POOL_PREWARM)
+        cls.java_is_sidecar = cls.sidecar
+        cls._lease_renewed = 0
+        cls.renew_lease()
 
     @classmethod
-    def _start_output_detection_thread(cls):
-        """ Connect the stdout pipes of our java subprocess to a thread that
-        will set self.java_running to True when a line of output is read.
-        """
-        t = threading.Thread(target=cls._wait_for_output,
-                             name="Java Startup")
-        t.setDaemon(True)
-        t.start()
+    def _launch_java(cls):
+        command = ([_JAVA] + cls._java_options() +
+                   ["-classpath", _CLASSPATH, _MAIN_CLASS])
+        if cls.sidecar:
+            # Its own session keeps it out of the signals Indigo sends to
+            # the plugin's process group when the plugin is stopped.
+            with open(cls.sidecar_log or os.devnull, "a") as output:
+                cls.javaproc = subprocess.Popen(
+                    command + ["--lease", str(_LEASE)],
+                    stdout=output, stderr=subprocess.STDOUT,
+                    close_fds=True, preexec_fn=os.setsid)
+        else:
+            cls.javaproc = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        log.debug("Java Runtime started")
 
     @classmethod
-    def _wait_for_output(cls):
-        """ Wait for a line of text to appear on the output pipe of the
-        subprocess. Set self.java_running to True if a line is read.
-        """
-        line = cls.javaproc.stdout.readline()  # blocks here if no input
-        if line:
-            cls.java_running = True
+    def _ping(cls):
+        """ Return True if the gateway answers. An OmniForPy.jar built
+        before ping was added answers with an error, which will do. """
+        try:
+            cls.gateway.entry_point.ping()
+            return True
+        except Py4JNetworkError:
+            return False
+        except Py4JError:
+            log.debug("Gateway answered ping with an error", exc_info=True)
+            return True
+
+    @classmethod
+    def _wait_for_gateway(cls, timeout):
+        """ The Java side opens the gateway port once it has loaded the
+        jomnilinkII classes, so keep trying to reach it, backing off from
+        10 ms to 200 ms between tries, until it answers, the subprocess
+        quits, or timeout seconds have gone by. """
+        deadline = time.time() + timeout
+        delay = 0.01
+        while not cls._ping():
+            if cls.javaproc.poll() is not None:
+                raise ConnectionError("Java runtime exited")
+            if time.time() > deadline:
+                raise ConnectionError("Java gateway server did not start")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    @classmethod
+    def _java_options(cls):
+        options = list(_JAVA_TUNING)
+        if cls.class_archive is not None and cls._make_class_archive():
+            options.extend(["-Xshare:auto",
+                            "-XX:SharedArchiveFile=" + cls.class_archive])
+        return options
+
+    @classmethod
+    def _make_class_archive(cls):
+        """ Have Java dump its class data sharing archive to
+        class_archive, unless it's already there. Return True if it is
+        there afterwards. """
+        if os.path.exists(cls.class_archive):
+            return True
+        log.debug("Creating Java class data sharing archive " +
+                  cls.class_archive)
+        try:
+            proc = subprocess.Popen(
+                [_JAVA, "-Xshare:dump",
+                 "-XX:SharedArchiveFile=" + cls.class_archive],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = proc.communicate()
+        except OSError:
+            log.debug("Unable to run Java", exc_info=True)
+            return False
+        if proc.returncode != 0 or not os.path.exists(cls.class_archive):
+            log.debug("Unable to create class data sharing archive: " + err)
+            return False
+        return True
+
+    @classmethod
+    def renew_lease(cls):
+        """ Keep a sidecar Java runtime from quitting for another _LEASE
+        seconds. Call this often, it only talks to Java once every
+        _LEASE_RENEWAL seconds. """
+        if not cls.java_is_sidecar or cls.gateway is None:
+            return
+        now = time.time()
+        if now - cls._lease_renewed < _LEASE_RENEWAL:
+            return
+        try:
+            cls.gateway.entry_point.renewLease(_LEASE)
+            cls._lease_renewed = now
+        except Py4JError:
+            log.debug("Unable to renew Java sidecar lease", exc_info=True)
+
+    @classmethod
+    def gateway_stats(cls):
+        """ Return lines describing the use of the gateway connection
+        pool. """
+        if cls.pool is None:
+            return []
+        return cls.pool.stats()
+
+    @classmethod
+    def set_debug(cls, enabled):
+        """ Turn jomnilinkII's debug output on or off. While it is off the
+        library doesn't format any of it. """
+        if cls.gateway is None:
+            return
+        try:
+            cls.gateway.entry_point.setDebug(enabled)
+        except Py4JError:
+            log.debug("Unable to set jomnilinkII debugging", exc_info=True)
+
+    @classmethod
+    def drain_debug_log(cls, max_records=_DEBUG_BATCH):
+        """ Fetch up to max_records of jomnilinkII's debug output in one
+        call, and return them as a list of DebugRecords. """
+        if cls.gateway is None:
+            return []
+        try:
+            text = cls.gateway.entry_point.drainDebugLog(max_records)
+        except Py4JError:
+            log.debug("Unable to fetch jomnilinkII debug output",
+                      exc_info=True)
+            return []
+        records = []
+        for line in text.splitlines():
+            fields = line.split("\t", 3)
+            if len(fields) == 4:
+                records.append(DebugRecord(
+                    datetime.datetime.fromtimestamp(int(fields[0]) / 1000.0),
+                    *fields[1:]))
+        return records
 
     @classmethod
     def shutdown(cls):
         """ Tidy up """
         for t in cls.threads:
             t.time_to_quit = True
+        cls.quitting = True
+        cls.java_ready.set()
         for t in cls.threads:
             t.join()
+        if cls.java_thread is not None:
+            cls.java_thread.join(_JAVA_WAIT)
+        cls._stop_java(detach=cls.java_is_sidecar)
 
+    @classmethod
+    def _stop_java(cls, detach=False):
+        """ Close the gateway and stop the Java runtime, or if detach is
+        set, close the gateway and leave the Java runtime and its
+        connections to the controllers for the next run of the plugin. """
         try:
-            if cls.gateway is not None:
+            if cls.gateway is not None and detach:
+                # Java would otherwise keep calling listeners that are gone
+                cls.gateway.entry_point.detach()
+                cls.gateway.close()
+            elif cls.gateway is not None:
                 cls.gateway.shutdown()
-            if cls.javaproc is not None:
+            if cls.javaproc is not None and not detach:
                 cls.javaproc.terminate()
         except:
             log.error("Error shutting down Java gateway")
             log.debug("", exc_info=True)
         cls.gateway = None
+        cls.pool = None
         cls.javaproc = None
+        cls.java_is_sidecar = False
+
+
+class HeldCommand(object):
+    """ A command waiting for a disconnected controller to come back.
+    expires is the time.time() after which it is no longer worth sending.
+    """
+    def __init__(self, cmd_name, p1, p2, expires):
+        self.cmd_name, self.p1, self.p2 = cmd_name, p1, p2
+        self.expires = expires
 
 
 class NotificationEvent(object):
     def __init__(self, event_type, data):
         self.event_type, self.data = event_type, data
+        self.time = time.time()
+
+
+class NotificationStream(object):
+    """ Read the raw notification messages which Java sends over a
+    socket of their own, each preceded by its length in two bytes,
+    decode them and put them in a queue as NotificationEvents.
+
+    Public methods:
+    close -- disconnect, which makes Java go back to callbacks
+    """
+    def __init__(self, port, queue):
+        self.queue = queue
+        self.sock = socket.create_connection(("127.0.0.1", port), 5)
+        self.sock.settimeout(None)
+        self.thread = threading.Thread(target=self.read_loop,
+                                       name="Notification Stream")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def read_loop(self):
+        stream = self.sock.makefile("rb", _STREAM_BUFFER)
+        try:
+            while True:
+                header = stream.read(2)
+                if len(header) < 2:
+                    break
+                length, = struct.unpack(">H", header)
+                message = stream.read(length)
+                if len(message) < length:
+                    break
+                try:
+                    decoded = omni_messages.decode(message)
+                except (struct.error, ValueError):
+                    log.debug("Unable to decode notification " +
+                              message.encode("hex"))
+                    continue
+                if decoded is not None:
+                    self.queue.put(NotificationEvent(*decoded))
+        except socket.error:
+            log.debug("Notification stream failed", exc_info=True)
+        finally:
+            stream.close()
+        log.debug("Notification stream closed")
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
 
 
 class NotificationListener(object):
     """ Implementation matching requirements for NotificationListener
-    in the jomnilinkII library. Puts notifications received on a queue
-    so that they can be processed in the main thread.
+    in the jomnilinkII library. Copies the notifications received into
+    omni_messages objects, releases the Java ones, and puts the copies
+    on a queue so that they can be processed in the main thread.
     """
-    def __init__(self, queue):
+    def __init__(self, queue, status_classes):
         self.queue = queue
+        self.status_classes = status_classes
 
     def objectStausNotification(self, status):  # it's a jomnilinkII typo
         """ Called back from the jomnilinkII library when a
         Object Status Notification message is received from the Omni
         system.
         """
-        self.queue.put(NotificationEvent("status", status))
+        self._put("status", omni_messages.copy_object_status,
+                  status, self.status_classes)
 
     def otherEventNotification(self, other):
         """ Called back from the jomnilinkII library when an Other
         Event Notification message is received from the Omni system.
         """
-        self.queue.put(NotificationEvent("event", other))
+        self._put("event", omni_messages.copy_other_events, other)
+
+    def systemStatusNotification(self, status):
+        """ Called back from the jomnilinkII library with the System
+        Status message the Omni system sent in answer to a keep-alive ping.
+        """
+        self._put("system_status", omni_messages.copy_system_status, status)
+
+    def _put(self, event_type, copier, *args):
+        try:
+            copy, read = copier(*args)
+        except Py4JNetworkError as e:
+            # Most likely the gateway pool is exhausted, and the
+            # notification is lost
+            log.error("Dropped {0} notification: {1}".format(event_type, e))
+            log.debug("", exc_info=True)
+            return
+        except Py4JError:
+            log.debug("Unable to copy {0} notification".format(event_type),
+                      exc_info=True)
+            return
+        Connection.release(*read)
+        self.queue.put(NotificationEvent(event_type, copy))
 
     class Java:  # py4j looks for this
         implements = ['com.digitaldan.jomnilinkII.NotificationListener']
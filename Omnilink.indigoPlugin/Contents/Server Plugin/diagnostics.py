@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Timing statistics and counters for Leviton/HAI Omni plugin for
+IndigoServer """
+
+from collections import defaultdict, deque
+import threading
+import time
+
+# How many of the most recent durations to keep for each key
+_SAMPLES = 1000
+
+
+class LatencyStats(object):
+    """ Count calls and keep recent durations, by key, so that
+    percentiles can be reported. Safe to share between threads.
+
+    Public methods:
+        record -- add a duration
+        timed -- wrap a function so that its calls get recorded
+        percentiles -- recent durations at the given percentiles
+        report -- lines of text summarizing everything recorded
+        clear -- forget everything
+    """
+    def __init__(self, samples=_SAMPLES, clock=time.time):
+        self.clock = clock
+        self.max_samples = samples
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counts = defaultdict(int)
+            self.totals = defaultdict(float)
+            self.samples = defaultdict(
+                lambda: deque(maxlen=self.max_samples))
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.counts[key] += 1
+            self.totals[key] += seconds
+            self.samples[key].append(seconds)
+
+    def timed(self, key, func):
+        """ Return a function which calls func and records how long
+        it took under key, even if it raises. """
+        def wrapper(*args, **kwargs):
+            start = self.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(key, self.clock() - start)
+        return wrapper
+
+    def percentiles(self, key, percents=(50, 90, 99)):
+        """ Return a list of the recent durations recorded for key at
+        each of the given percentiles, using the nearest rank. """
+        with self.lock:
+            ordered = sorted(self.samples.get(key, ()))
+        if not ordered:
+            return [None for p in percents]
+        return [ordered[min(len(ordered) - 1,
+                            int(len(ordered) * p / 100.0))]
+                for p in percents]
+
+    def report(self):
+        """ Return a list of lines describing each key, the ones which
+        have taken the most time in total first. """
+        lines = []
+        with self.lock:
+            for key in sorted(self.counts, key=lambda k: -self.totals[k]):
+                p50, p90, p99 = self.percentiles(key)
+                lines.append("{0}: {1} calls, {2:.1f} ms total, "
+                             "{3:.1f}/{4:.1f}/{5:.1f} ms at 50/90/99%".format(
+                                 format_key(key), self.counts[key],
+                                 self.totals[key] * 1000, p50 * 1000,
+                                 p90 * 1000, p99 * 1000))
+        return lines
+
+
+class Counters(object):
+    """ Counts of things that happened and high water marks, by name.
+    Callers that share one between threads should hold a lock while
+    updating it.
+
+    Public methods:
+        add -- count something
+        peak -- keep the highest value seen
+        report -- lines of text listing everything
+    """
+    def __init__(self):
+        self.values = defaultdict(int)
+
+    def add(self, name, count=1):
+        self.values[name] += count
+
+    def peak(self, name, value):
+        self.values[name] = max(self.values[name], value)
+
+    def __getitem__(self, name):
+        return self.values.get(name, 0)
+
+    def report(self):
+        return ["{0}: {1}".format(name, self.values[name])
+                for name in sorted(self.values)]
+
+
+def format_key(key):
+    if isinstance(key, tuple):
+        return ".".join(unicode(k) for k in key)
+    return unicode(key)
@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Local copy of Omni controller event logs for Omni plugin for
+IndigoServer """
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+# Most events to read from a controller in one sync. Omni controllers
+# keep a few hundred.
+_MAX_SYNC = 1000
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+EventRecord = namedtuple("EventRecord", ["number", "time", "event_type",
+                                         "parameter1", "parameter2"])
+
+
+class EventLogClosed(Exception):
+    """ Raised by EventLog methods called after close """
+    pass
+
+
+class EventLog(object):
+    """ Keep a copy of the event logs of Omni controllers in a SQLite
+    file, so that the history can be read without querying the controller
+    one event at a time. The controller is only asked for events newer than
+    the last one seen.
+
+    May be used from more than one thread.
+
+    Public methods:
+        sync -- fetch new events from a controller
+        last_events -- the most recent events
+        zone_events -- the events involving one zone
+        arming_history -- arming and disarming events
+        close -- close the database, after which the other methods raise
+                 EventLogClosed
+    """
+    zone_event_types = [4, 5, 128, 129, 133, 139]
+    arming_event_types = range(48, 48 + 7)
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    number INTEGER NOT NULL,
+                    time TEXT,
+                    event_type INTEGER NOT NULL,
+                    parameter1 INTEGER NOT NULL,
+                    parameter2 INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS events_by_type
+                    ON events (url, event_type, parameter2);
+                CREATE TABLE IF NOT EXISTS high_water_marks (
+                    url TEXT PRIMARY KEY,
+                    number INTEGER NOT NULL);
+                """)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def _check_open(self):
+        """ Call with the lock held """
+        if self.db is None:
+            raise EventLogClosed()
+
+    def high_water_mark(self, url):
+        """ Return the number of the newest event seen from a controller,
+        or None if there isn't one. """
+        with self.lock:
+            self._check_open()
+            row = self.db.execute(
+                "SELECT number FROM high_water_marks WHERE url = ?",
+                (url,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, url, omni, M):
+        """ Read the events newer than the high water mark from a
+        controller, given a jomnilinkII Connection object and the
+        jomnilinkII Message class, and save them. Return the number of new
+        events. May raise Py4JError, or EventLogClosed if the log is closed
+        while syncing.
+        """
+        last = self.high_water_mark(url)
+        now = datetime.now()
+        new = []
+        seen = set()
+        num = 0
+        while len(new) < _MAX_SYNC:
+            m = omni.uploadEventLogData(num, -1)
+            if m.getMessageType() != M.MESG_TYPE_EVENT_LOG_DATA:
+                break
+            num = m.getEventNumber()
+            if num == last or num in seen:
+                break
+            seen.add(num)
+            new.append(self.record_from_message(m, now))
+
+        if new:
+            log.debug("Saving {0} new events from {1}".format(len(new), url))
+            with self.lock:
+                self._check_open()
+                self.db.executemany(
+                    "INSERT INTO events (url, number, time, event_type, "
+                    "parameter1, parameter2) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(url, r.number,
+                      r.time.strftime(_TIME_FORMAT) if r.time else None,
+                      r.event_type, r.parameter1, r.parameter2)
+                     for r in reversed(new)])
+                self.db.execute(
+                    "INSERT OR REPLACE INTO high_water_marks (url, number) "
+                    "VALUES (?, ?)", (url, new[0].number))
+                self.db.commit()
+        return len(new)
+
+    @staticmethod
+    def record_from_message(m, now):
+        """ Make an EventRecord from a jomnilinkII EventLogData message.
+        The controller doesn't say what year an event happened, so
+        assume it was within the last year.
+        """
+        time = None
+        if m.isTimeDataValid():
+            for year in (now.year, now.year - 1):
+                try:
+                    time = datetime(year, m.getMonth(), m.getDay(),
+                                    m.getHour(), m.getMinute())
+                except ValueError:
+                    continue
+                if time <= now + timedelta(days=1):
+                    break
+        return EventRecord(m.getEventNumber(), time, m.getEventType(),
+                           m.getParameter1(), m.getParameter2())
+
+    def last_events(self, url, limit):
+        """ Return a list of the most recent EventRecords, newest first """
+        return self._query("url = ?", (url,), limit)
+
+    def zone_events(self, url, zone, limit=None):
+        """ Return a list of the EventRecords involving a zone, newest
+        first """
+        return self._query(
+            "url = ? AND event_type IN ({0}) AND parameter2 = ?".format(
+                ", ".join("?" * len(self.zone_event_types))),
+            [url] + self.zone_event_types + [zone], limit)
+
+    def arming_history(self, url, limit=None):
+        """ Return a list of the EventRecords for arming and disarming,
+        newest first """
+        return self._query(
+            "url = ? AND event_type BETWEEN ? AND ?",
+            (url, self.arming_event_types[0], self.arming_event_types[-1]),
+            limit)
+
+    def _query(self, where, args, limit):
+        sql = ("SELECT number, time, event_type, parameter1, parameter2 "
+               "FROM events WHERE " + where + " ORDER BY id DESC")
+        if limit is not None:
+            sql += " LIMIT {0:d}".format(limit)
+        with self.lock:
+            self._check_open()
+            rows = self.db.execute(sql, args).fetchall()
+        return [EventRecord(number,
+                            (datetime.strptime(time, _TIME_FORMAT)
+                             if time else None),
+                            event_type, p1, p2)
+                for number, time, event_type, p1, p2 in rows]
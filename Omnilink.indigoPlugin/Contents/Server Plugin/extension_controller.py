@@ -21,19 +21,37 @@ from __future__ import unicode_literals
 from collections import namedtuple, defaultdict
 from datetime import time, datetime
 from distutils.version import StrictVersion
+import json
 import logging
+import threading
 
 import indigo
 from py4j.protocol import Py4JError
 
 from connection import ConnectionError
+from eventlog import EventLog, EventLogClosed
 import extensions
 
 log = logging.getLogger(__name__)
 
-_VERSION = "0.3.0"
+_VERSION = "0.3.1"
+
+# Key in pluginPrefs for the saved controller profiles
+_PROFILES_PREF = "controllerProfiles"
+
+# Seconds between full refreshes of controller device states. In between,
+# states are kept up to date from event notifications.
+_REFRESH_INTERVAL = 3600
+
+# Seconds between checks for new entries in the controller's event log,
+# and the limits the scheduler may adjust that between.
+_EVENT_LOG_INTERVAL = 300
+_MIN_EVENT_LOG_INTERVAL = 60
+_MAX_EVENT_LOG_INTERVAL = 900
+
+# Number of events to show in the Event Log report
+_EVENT_LOG_REPORT_LENGTH = 20
 
-# to do -- update the battery reading periodically (like once a day)
 # action - set time in controller automatically
 # to do - UIDisplayStateId should be based on troubles not connection
 # action - acknowledge troubles
@@ -71,11 +89,31 @@ class ControllerExtension(extensions.PluginExtension):
 
         self.reports = {"System Information": self.say_system_information,
                         "System Troubles": self.say_system_troubles,
+                        "System Features": self.say_system_features,
                         "System Capacities": self.say_system_capacities,
                         "Event Log": self.say_event_log}
 
         self.controller_info = {}
 
+        # key is url, value is tuple of connection session
+        # and ControllerProfile
+        self._profiles = {}
+
+        # for each device, the states last written to it
+        self.device_states = {}
+        # for each device, its scheduled refresh and event log jobs
+        self.jobs = {}
+
+        # local copy of the controllers' event logs, see event_log
+        self._event_log = None
+        # set by shutdown, so the event log isn't reopened after it
+        self.closed = False
+        # key is url, value is a Lock held while syncing its event log
+        self.sync_locks = {}
+        # key is url, value is the last thread started to sync it
+        self.sync_threads = {}
+        self.lock = threading.Lock()
+
     # ----- Device Start and Stop Methods ----- #
 
     def deviceStartComm(self, device):
@@ -86,13 +124,28 @@ class ControllerExtension(extensions.PluginExtension):
             self.device_ids.append(device.id)
             self.triggers[device.id] = defaultdict(list)
             self.update_device_version(device)
+            self.device_states[device.id] = {}
             self.update_device_status(device)
+            self.update_last_checked_code(device)
+            url = device.pluginProps["url"]
+            self.start_event_log_sync(url)
+            scheduler = self.plugin.scheduler
+            self.jobs[device.id] = [
+                scheduler.add(url, "controller", 0, 0, _REFRESH_INTERVAL,
+                              self.scheduled_refresh),
+                scheduler.add(url, "event log", 0, 0, _EVENT_LOG_INTERVAL,
+                              self.scheduled_sync_event_log,
+                              min_interval=_MIN_EVENT_LOG_INTERVAL,
+                              max_interval=_MAX_EVENT_LOG_INTERVAL)]
 
     def deviceStopComm(self, device):
         if device.id in self.device_ids:
             log.debug('Stopping device "{0}"'.format(device.name))
             self.device_ids.remove(device.id)
             del self.triggers[device.id]
+            self.device_states.pop(device.id, None)
+            for job in self.jobs.pop(device.id, []):
+                self.plugin.scheduler.remove(job)
 
     # ----- Maintenance of device states ----- #
 
@@ -118,29 +171,39 @@ class ControllerExtension(extensions.PluginExtension):
 
     def update_device_status(self, device):
         """ Ask the controller for information and set the
-        device states accordingly, and clear the last checked
-        security code.
+        device states accordingly.
         """
         connection = self.plugin.make_connection(device.pluginProps["url"])
         try:
             info = self.get_controller_info(connection)
-            device.updateStateOnServer("connected", True)
-            device.updateStateOnServer("model", info.model)
-            device.updateStateOnServer("firmwareVersion", info.firmware)
-            device.updateStateOnServer("batteryReading", info.battery_reading)
-
-            self.update_last_checked_code(device)
-
-            for t, value in info.troubles.items():
-                device.updateStateOnServer(t, value)
+            states = {"connected": True,
+                      "model": info.model,
+                      "firmwareVersion": info.firmware}
+            states.update(self.decode_system_status(info.status))
+            states.update(info.troubles)
+            self.update_states(device, states)
             device.setErrorStateOnServer(None)
 
         except (Py4JError, ConnectionError):
-            log.error("Could not get status of Omni Controller")
-            log.debug("", exc_info=True)
-            device.updateStateOnServer("connected", False)
+            if connection.starting:
+                # reconnect_notification will fill in the states
+                log.debug("Omni Controller status deferred until connected")
+            else:
+                log.error("Could not get status of Omni Controller")
+                log.debug("", exc_info=True)
+            self.update_states(device, {"connected": False})
             device.setErrorStateOnServer("not connected")
 
+    def update_states(self, device, states):
+        """ Given a dictionary of state names and values, write the ones
+        which differ from what was last written to the device.
+        """
+        written = self.device_states.setdefault(device.id, {})
+        for key, value in states.items():
+            if key not in written or written[key] != value:
+                device.updateStateOnServer(key, value)
+                written[key] = value
+
     authority = {0: "Invalid",
                  1: "Master",
                  2: "Manager",
@@ -179,18 +242,85 @@ class ControllerExtension(extensions.PluginExtension):
         and SystemTroubles.java for explanations of the data coming from
         jomnilinkII.
         """
-        info = connection.omni.reqSystemInformation()
-        model, firmware = self.decode_system_info(info)
+        profile = self.profile(connection)
+        model, firmware = profile.model, profile.firmware
 
         status = connection.omni.reqSystemStatus()
-        battery_reading = status.getBatteryReading()
 
         troubles = connection.omni.reqSystemTroubles()
         trouble_states = self.decode_troubles(troubles)
 
         return namedtuple(
-            "Info", ["model", "firmware", "battery_reading", "troubles"])(
-                model, firmware, battery_reading, trouble_states)
+            "Info", ["model", "firmware", "status", "troubles"])(
+                model, firmware, status, trouble_states)
+
+    def profile(self, connection):
+        """ Return the ControllerProfile for a connection. It is only
+        fetched once per connection session, and the saved copy in
+        pluginPrefs is reused unless the model or firmware has changed.
+        May raise Py4JError or ConnectionError.
+        """
+        url = connection.url
+        session, profile = self._profiles.get(url, (None, None))
+        if profile is not None and session == connection.session:
+            return profile
+
+        info = connection.omni.reqSystemInformation()
+        model, firmware = self.decode_system_info(info)
+        profiles = self.load_profiles()
+        profile = profiles.get(url)
+        if (profile is None or profile.model != model or
+                profile.firmware != firmware):
+            log.debug("Fetching capabilities of controller at " + url)
+            profile = ControllerProfile.fetch(connection, model, firmware,
+                                              info.getPhone())
+            profiles[url] = profile
+            self.plugin.pluginPrefs[_PROFILES_PREF] = json.dumps(
+                dict((k, v.to_dict()) for k, v in profiles.items()))
+
+        self._profiles[url] = (connection.session, profile)
+        return profile
+
+    def load_profiles(self):
+        """ Return a dictionary of the ControllerProfiles saved in
+        pluginPrefs, indexed by url. """
+        try:
+            saved = json.loads(self.plugin.pluginPrefs.get(_PROFILES_PREF,
+                                                           "{}"))
+            return dict((k, ControllerProfile.from_dict(v))
+                        for k, v in saved.items())
+        except (ValueError, TypeError, KeyError, AttributeError):
+            log.debug("Discarding saved controller profiles", exc_info=True)
+            return {}
+
+    def decode_system_status(self, status):
+        """ Return a dictionary of the device states which come from a
+        SystemStatus message: battery reading, areas in alarm and the
+        controller's clock.
+        """
+        return {"batteryReading": status.getBatteryReading(),
+                "areasInAlarm": self.decode_alarm_areas(status),
+                "systemTime": self.decode_system_time(status)}
+
+    def decode_alarm_areas(self, status):
+        alarms = status.getAlarms()
+        if alarms:
+            return ", ".join((str(key) for key in sorted(alarms.keys())))
+        return "None"
+
+    def decode_system_time(self, status):
+        if not status.isTimeDateValid():
+            return "not set"
+        try:
+            dt = datetime(2000 + status.getYear(),  # year 2100 bug
+                          status.getMonth(),
+                          status.getDay(),
+                          status.getHour(),
+                          status.getMinute(),
+                          status.getSecond())
+        except ValueError:
+            return "invalid"
+        return dt.strftime("%Y-%m-%d %H:%M:%S")
 
     def decode_system_info(self, info):
         model = self.models.get(info.getModel(), "Unknown")
@@ -244,9 +374,77 @@ class ControllerExtension(extensions.PluginExtension):
         newdev.subModel = "Controller"
         newdev.replaceOnServer()
 
-    def update(self):
-        # periodically inquire about battery reading
-        pass
+    def scheduled_refresh(self, url, obj_type, first, last):
+        """ Scheduler callback to refresh the controller device on a slow
+        schedule, in case the event notifications missed something.
+        """
+        for dev_id in self.device_ids:
+            dev = indigo.devices[dev_id]
+            if dev.pluginProps["url"] != url:
+                continue
+            connection = self.plugin.make_connection(url)
+            if connection.is_connected():
+                log.debug("Scheduled refresh of device {0}".format(dev_id))
+                self.update_device_status(dev)
+        return []
+
+    # ----- Local copy of the event log ----- #
+
+    @property
+    def event_log(self):
+        """ The EventLog, opened the first time it is needed. Raises
+        EventLogClosed after shutdown. """
+        if self.closed:
+            raise EventLogClosed()
+        if self._event_log is None:
+            self._event_log = EventLog(self.plugin.data_path(
+                "eventlog.sqlite"))
+        return self._event_log
+
+    def sync_event_log(self, url, wait=True):
+        """ Copy any new entries in a controller's event log into the
+        local copy. Return the number of new entries. If wait is False
+        and another thread is already syncing the same controller, return
+        0 without waiting for it. """
+        with self.lock:
+            lock = self.sync_locks.setdefault(url, threading.Lock())
+        if not lock.acquire(wait):
+            return 0
+        try:
+            connection = self.plugin.make_connection(url)
+            return self.event_log.sync(url, connection.omni,
+                                       connection.jomnilinkII.Message)
+        except (Py4JError, ConnectionError):
+            log.debug("Unable to read event log from " + url, exc_info=True)
+            return 0
+        except EventLogClosed:
+            log.debug("Event log closed while syncing " + url)
+            return 0
+        finally:
+            lock.release()
+
+    def start_event_log_sync(self, url, report=False):
+        """ Sync a controller's event log on a thread of its own, because
+        the first sync can take hundreds of round trips to the
+        controller. If report is set, write the new events to the Indigo
+        log too. """
+        target = self.report_missed_events if report else self.sync_event_log
+        thread = threading.Thread(target=target, args=(url,),
+                                  name="Event log " + url)
+        thread.daemon = True
+        self.sync_threads[url] = thread
+        thread.start()
+
+    def scheduled_sync_event_log(self, url, obj_type, first, last):
+        """ Scheduler callback to keep the local copy of the event log
+        up to date. """
+        return [0] if self.sync_event_log(url, wait=False) else []
+
+    def shutdown(self):
+        self.closed = True
+        if self._event_log is not None:
+            self._event_log.close()
+            self._event_log = None
 
     # ----- Callbacks from OMNI Status and events ----- #
 
@@ -259,7 +457,7 @@ class ControllerExtension(extensions.PluginExtension):
                    3: "phoneLineOnHook",
 
                    4: "ACPowerOff",
-                   5: "ACPowerRestored",
+                   5: "ACPowerOn",
 
                    6: "batteryLow",
                    7: "batteryOK",
@@ -272,11 +470,33 @@ class ControllerExtension(extensions.PluginExtension):
                    12: "energyCostHigh",
                    13: "energyCostCritical"}
 
+    # device state changes implied by each event
+    event_states = {0: {"phoneLine": "Dead", "phoneLineTrouble": True},
+                    1: {"phoneLine": "Ringing", "phoneLineTrouble": False},
+                    2: {"phoneLine": "Off Hook", "phoneLineTrouble": False},
+                    3: {"phoneLine": "On Hook", "phoneLineTrouble": False},
+
+                    4: {"ACPowerTrouble": True},
+                    5: {"ACPowerTrouble": False},
+
+                    6: {"batteryLowTrouble": True},
+                    7: {"batteryLowTrouble": False},
+
+                    8: {"digitalCommunicatorTrouble": True},
+                    9: {"digitalCommunicatorTrouble": False},
+
+                    10: {"energyCost": "Low"},
+                    11: {"energyCost": "Mid"},
+                    12: {"energyCost": "High"},
+                    13: {"energyCost": "Critical"}}
+
     def event_notification(self, connection, other_event_msg):
         """ Callback used by plugin when it receives an Other Event
         Notification from the Omni controller. Decode the events
-        that are pertinent to the controller functionality, and set
-        off any active triggers.
+        that are pertinent to the controller functionality, update
+        the device states they affect and set off any active triggers.
+        If an event can't be interpreted, refresh the device from
+        the controller.
         """
         try:
             dev = self.find_device_from_connection(connection)
@@ -285,22 +505,43 @@ class ControllerExtension(extensions.PluginExtension):
             return
         log.debug('Received "other event" notification for device {0}'.format(
             dev.id))
+        refresh = False
         try:
             notifications = other_event_msg.getNotifications()
             for n in notifications:
                 log.debug("Notification code: " + hex(n))
-                if n & self.notification_mask == self.notification_value:
-                    event_num = n & self.event_mask
-                    if event_num in self.event_types:
-                        event_type = self.event_types[event_num]
-                        log.debug("Processing {0} event for device {1}".format(
-                            event_type, dev.id))
-                        for t in self.triggers[dev.id][event_type]:
-                            indigo.trigger.execute(t)
+                if n & self.notification_mask != self.notification_value:
+                    continue
+                event_num = n & self.event_mask
+                if event_num not in self.event_types:
+                    refresh = True
+                    continue
+                event_type = self.event_types[event_num]
+                log.debug("Processing {0} event for device {1}".format(
+                    event_type, dev.id))
+                self.update_states(dev, self.event_states[event_num])
+                for t in triggers[event_type]:
+                    indigo.trigger.execute(t)
         except Py4JError:
             log.error("Unable to decode event notification", exc_info=True)
+            refresh = True
 
-        self.update_device_status(dev)
+        if refresh:
+            self.update_device_status(dev)
+
+    def system_status_notification(self, connection, status):
+        """ Callback used by plugin when jomnilinkII passes along the answer
+        to a keep-alive ping. Refresh the states that come from it, which
+        costs nothing extra since the controller has already been asked.
+        """
+        try:
+            dev = self.find_device_from_connection(connection)
+        except KeyError:
+            return
+        try:
+            self.update_states(dev, self.decode_system_status(status))
+        except Py4JError:
+            log.error("Unable to decode system status", exc_info=True)
 
     def reconnect_notification(self, connection, omni):
         """ Callback used by plugin when successful reconnection
@@ -308,9 +549,28 @@ class ControllerExtension(extensions.PluginExtension):
         """
         try:
             dev = self.find_device_from_connection(connection)
-            self.update_device_status(dev)
         except KeyError:
             return
+        self.update_device_status(dev)
+        self.start_event_log_sync(connection.url, report=True)
+
+    def report_missed_events(self, url):
+        """ After a reconnect, bring the local copy of the event log up
+        to date and write the events which the controller logged while
+        disconnected to the Indigo log. """
+        try:
+            had_history = self.event_log.high_water_mark(url) is not None
+            count = self.sync_event_log(url)
+            if not (had_history and count):
+                return
+            records = self.event_log.last_events(url, count)
+        except EventLogClosed:
+            return
+        indigo.server.log("Omni controller at {0} logged {1} events while "
+                          "disconnected:".format(url, count))
+        for record in reversed(records):
+            self.say_event_log_entry(
+                record, lambda msg: indigo.server.log("    " + msg))
 
     def disconnect_notification(self, connection, e):
         """ Callback used by plugin when a disconnect message is
@@ -318,11 +578,17 @@ class ControllerExtension(extensions.PluginExtension):
         the error state. """
         try:
             dev = self.find_device_from_connection(connection)
-            dev.updateStateOnServer("connected", False)
+            self.update_states(dev, {"connected": False})
             dev.setErrorStateOnServer("not connected")
         except KeyError:
             return
 
+    def subscriptions(self, url):
+        """ Other event notifications keep the controller device's states
+        up to date and set off its triggers. """
+        return {"events": any(indigo.devices[dev_id].pluginProps["url"] == url
+                              for dev_id in self.device_ids)}
+
     def find_device_from_connection(self, connection):
         """ Given a connection, try to find a device with
         matching url. If not found, raise a KeyError.
@@ -387,9 +653,7 @@ class ControllerExtension(extensions.PluginExtension):
         device = indigo.devices[device_id]
         try:
             c = self.plugin.make_connection(device.pluginProps["url"])
-            M = c.jomnilinkII.Message
-            count = c.omni.reqObjectTypeCapacities(
-                M.OBJ_TYPE_CONSOLE).getCapacity()
+            count = self.profile(c).capacities["consoles"]
             results = results + [(str(i), "Keypad {0}".format(i))
                                  for i in range(1, count + 1)]
         except (Py4JError, ConnectionError):
@@ -543,30 +807,19 @@ class ControllerExtension(extensions.PluginExtension):
     # ----- Write Info on connected controllers to log ----- #
 
     def say_system_information(self, r, connection, say):
-        omni = connection.omni
-        info = omni.reqSystemInformation()
-        model, firmware = self.decode_system_info(info)
-        say("Model:", model)
-        say("Firmware version:", firmware)
-        say("Phone number:", info.getPhone())
+        profile = self.profile(connection)
+        say("Model:", profile.model)
+        say("Firmware version:", profile.firmware)
+        say("Phone number:", profile.phone)
 
-        status = omni.reqSystemStatus()
+        status = connection.omni.reqSystemStatus()
         self.say_system_time(status, say)
         say("Battery reading:", status.getBatteryReading())
-        if status.getAlarms():
-            areas = ", ".join((str(key) for key in status.getAlarms().keys()))
-        else:
-            areas = "None"
-        say("Areas in alarm:", areas)
-
-        formats = omni.reqSystemFormats()
+        say("Areas in alarm:", self.decode_alarm_areas(status))
 
-        say("Temperature Format:",
-            "F" if formats.getTempFormat() == 1 else "C")
-        say("Time Format:",
-            "12 hour" if formats.getTimeformat() == 1 else "24 hour")
-        say("Date Format:",
-            "MMDD" if formats.getDateFormat() == 1 else "DDMM")
+        say("Temperature Format:", profile.formats["temperature"])
+        say("Time Format:", profile.formats["time"])
+        say("Date Format:", profile.formats["date"])
 
     def say_system_time(self, status, say):
         if not status.isTimeDateValid():
@@ -594,63 +847,35 @@ class ControllerExtension(extensions.PluginExtension):
         troubles = [k for k, v in trouble_states.items() if v]
         say(*troubles if troubles else ["None"])
 
-    def say_system_capacities(self, r, connection, say):
-        omni = connection.omni
-        M = connection.jomnilinkII.Message
+    def say_system_features(self, r, connection, say):
+        features = self.profile(connection).features
+        say(*features if features else ["None"])
 
-        say("Max zones:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_ZONE).getCapacity())
-        say("Max units:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_UNIT).getCapacity())
-        say("Max areas:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_AREA).getCapacity())
-        say("Max buttons:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_BUTTON).getCapacity())
-        say("Max codes:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_CODE).getCapacity())
-        say("Max thermostats:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_THERMO).getCapacity())
-        say("Max messages:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_MESG).getCapacity())
-        say("Max audio zones:",
-            omni.reqObjectTypeCapacities(M.OBJ_TYPE_AUDIO_ZONE).getCapacity())
-        say("Max audio sources:",
-            omni.reqObjectTypeCapacities(
-                M.OBJ_TYPE_AUDIO_SOURCE).getCapacity())
+    def say_system_capacities(self, r, connection, say):
+        capacities = self.profile(connection).capacities
+        for name, obj_type in ControllerProfile.capacity_types:
+            say("Max {0}:".format(name), capacities[name])
 
     def say_event_log(self, r, connection, say):
-        omni = connection.omni
-        M = connection.jomnilinkII.Message
-        self.say_event_log_entries(omni, M, 20, say)
-
-    def say_event_log_entries(self, omni, M, limit, say):
-        num = 0
-        count = 0
-        while True:
-            m = omni.uploadEventLogData(num, -1)
-            if (m.getMessageType() != M.MESG_TYPE_EVENT_LOG_DATA or
-                    count > limit):
-                break
-            self.say_event_log_entry(m, say)
-            num = m.getEventNumber()
-            count += 1
-
-    def say_event_log_entry(self, m, say):
+        self.sync_event_log(connection.url)
+        records = self.event_log.last_events(connection.url,
+                                             _EVENT_LOG_REPORT_LENGTH)
+        for record in records:
+            self.say_event_log_entry(record, say)
+
+    def say_event_log_entry(self, record, say):
         time_format = "%b %d %X   "
-        if m.isTimeDataValid():
-            time = datetime(
-                # the 2016 is not printed (but it is a leap year)
-                2016, m.getMonth(), m.getDay(), m.getHour(),
-                m.getMinute()).strftime(time_format)
+        if record.time is not None:
+            time = record.time.strftime(time_format)
         else:
             width = len(datetime.now().strftime(time_format))
             time = "{{0:<{0}}}".format(width).format("Unknown")
 
-        event, pn1, pn2 = self.events.get(m.getEventType(),
+        event, pn1, pn2 = self.events.get(record.event_type,
                                           ("Unknown", "Unused", "Unused"))
         pnames = [pn1, pn2]
-        pvals = [self.modify_parameter(pn1, m.getParameter1()),
-                 self.modify_parameter(pn2, m.getParameter2())]
+        pvals = [self.modify_parameter(pn1, record.parameter1),
+                 self.modify_parameter(pn2, record.parameter2)]
         tups = [(pn, p) for pn, p in zip(pnames, pvals)
                 if pn != "Unused"]
 
@@ -717,3 +942,80 @@ class ControllerExtension(extensions.PluginExtension):
         elif pname == "Type":
             return self.alarm_types.get(p, "Unknown")
         return p
+
+
+class ControllerProfile(object):
+    """ The things about an Omni controller which only change with a
+    firmware update: model, firmware version, phone number, system formats,
+    enabled features and object capacities. Kept in plain Python types so
+    that it can be saved in pluginPrefs.
+
+    Public methods:
+        fetch -- class method, query a controller and build a profile
+        to_dict, from_dict -- convert to and from a JSON-friendly dictionary
+    """
+    capacity_types = [("zones", "OBJ_TYPE_ZONE"),
+                      ("units", "OBJ_TYPE_UNIT"),
+                      ("areas", "OBJ_TYPE_AREA"),
+                      ("buttons", "OBJ_TYPE_BUTTON"),
+                      ("codes", "OBJ_TYPE_CODE"),
+                      ("thermostats", "OBJ_TYPE_THERMO"),
+                      ("messages", "OBJ_TYPE_MESG"),
+                      ("audio zones", "OBJ_TYPE_AUDIO_ZONE"),
+                      ("audio sources", "OBJ_TYPE_AUDIO_SOURCE"),
+                      ("consoles", "OBJ_TYPE_CONSOLE")]
+
+    feature_names = {1: "NuVo Concerto",
+                     2: "NuVo Essentia/Simplese",
+                     3: "NuVo Grand Concerto",
+                     4: "Russound",
+                     5: "HAI Hi-Fi",
+                     6: "Xantech",
+                     7: "Speakercraft",
+                     8: "Proficient"}
+
+    def __init__(self, model, firmware, phone, formats, features,
+                 capacities):
+        self.model, self.firmware, self.phone = model, firmware, phone
+        self.formats = formats
+        self.features = features
+        self.capacities = capacities
+
+    @classmethod
+    def fetch(cls, connection, model, firmware, phone):
+        """ Query the controller for the rest of its profile, given
+        the information already decoded from its SystemInformation.
+        May raise Py4JError or ConnectionError.
+        """
+        omni = connection.omni
+        M = connection.jomnilinkII.Message
+
+        formats = omni.reqSystemFormats()
+        decoded_formats = {
+            "temperature": "F" if formats.getTempFormat() == 1 else "C",
+            "time": "12 hour" if formats.getTimeformat() == 1 else "24 hour",
+            "date": "MMDD" if formats.getDateFormat() == 1 else "DDMM"}
+
+        features = [cls.feature_names.get(f, "Unknown feature {0}".format(f))
+                    for f in omni.reqSystemFeatures().getFeatures()]
+
+        capacities = dict(
+            (name, int(omni.reqObjectTypeCapacities(
+                getattr(M, obj_type)).getCapacity()))
+            for name, obj_type in cls.capacity_types)
+
+        return cls(model, firmware, phone, decoded_formats, features,
+                   capacities)
+
+    def to_dict(self):
+        return {"model": self.model,
+                "firmware": self.firmware,
+                "phone": self.phone,
+                "formats": self.formats,
+                "features": self.features,
+                "capacities": self.capacities}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["model"], d["firmware"], d["phone"], d["formats"],
+                   d["features"], d["capacities"])
@@ -18,8 +18,12 @@
 
 """ Omni Plugin extension for Control Units """
 from __future__ import unicode_literals
-from collections import defaultdict
+from collections import defaultdict, deque
 import logging
+import math
+import re
+import threading
+import time
 
 import indigo
 from py4j.protocol import Py4JError
@@ -27,11 +31,23 @@ from py4j.protocol import Py4JError
 import extensions
 import connection
 from connection import ConnectionError
+from diagnostics import Counters, LatencyStats
+from omni_messages import OBJ_TYPE_UNIT
+from scheduler import number_ranges
 
 log = logging.getLogger(__name__)
 
 _VERSION = "0.3.0"
 
+# Words for the commands understood by parse_unit_commands
+_UNIT_COMMANDS = {"on": "CMD_UNIT_ON", "off": "CMD_UNIT_OFF"}
+_AREA_COMMANDS = {"on": "CMD_UNIT_AREA_ALL_ON", "off": "CMD_UNIT_AREA_ALL_OFF"}
+
+# Seconds to wait for the controller to confirm the state shown for a
+# command in optimistic mode, before putting back the last state it
+# reported
+_CONFIRM_TIMEOUT = 5
+
 
 class ControlUnitExtension(extensions.PluginExtension):
     """Omni plugin extension for Control Units """
@@ -56,11 +72,11 @@ class ControlUnitExtension(extensions.PluginExtension):
                           "omniAudioZoneUnit", "omniAudioSourceUnit"]
 
     def __init__(self):
-        self.type_ids = {"action": [],
+        self.type_ids = {"action": ["sendUnitCommands"],
                          "event": []}
         self.type_ids["device"] = [devtype for devtype, name
                                    in self.device_types.values()]
-        self.callbacks = {}
+        self.callbacks = {"sendUnitCommands": self.sendUnitCommands}
         self.reports = {"Control Units": self.say_unit_info}
 
         # key is device type, list contains device id's
@@ -69,6 +85,20 @@ class ControlUnitExtension(extensions.PluginExtension):
         # key is url, list is UnitInfo instances
         self._unit_info = {}
 
+        # key is device id, value is UnitStatus last received for the unit
+        self.last_status = {}
+
+        # key is device id, list contains PendingCommands, oldest first
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.clock = time.time
+
+        # key is device id, value is the time its unit's timer runs out
+        self.deadlines = {}
+        self.next_countdown = 0
+
+        self.coalescer = CommandCoalescer(self.send_queued)
+
     # ----- Device Start and Stop Methods ----- #
 
     def deviceStartComm(self, device):
@@ -85,6 +115,10 @@ class ControlUnitExtension(extensions.PluginExtension):
         if device.id in self.device_ids[device.deviceTypeId]:
             log.debug('Stopping device "{0}"'.format(device.name))
             self.device_ids[device.deviceTypeId].remove(device.id)
+            self.last_status.pop(device.id, None)
+            self.deadlines.pop(device.id, None)
+            with self.lock:
+                self.pending.pop(device.id, None)
 
     # ----- Device creation methods ----- #
 
@@ -160,36 +194,316 @@ class ControlUnitExtension(extensions.PluginExtension):
         method, text = dispatch[action.deviceAction]
         try:
             unit_num = dev.pluginProps["number"]
-            unit_info = self.unit_info(dev.pluginProps["url"])
-            method(action, dev, unit_num, unit_info)
-            indigo.server.log('sent "{0}" {1} request'.format(dev.name, text))
+            try:
+                unit_info = self.unit_info(dev.pluginProps["url"])
+            except ConnectionError:
+                unit_info = None
+            if method(action, dev, unit_num, unit_info):
+                indigo.server.log('sent "{0}" {1} request'.format(dev.name,
+                                                                  text))
+            else:
+                indigo.server.log('holding "{0}" {1} request until the '
+                                  'controller reconnects'.format(dev.name,
+                                                                 text))
         except (Py4JError, ConnectionError):
             log.error('send "{0}" {1} request failed'.format(dev.name, text))
             log.debug("", exc_info=True)
 
     def turn_on(self, action, dev, unit_num, unit_info):
-        unit_info.send_command("CMD_UNIT_ON", unit_num, 0)
+        return self.send(dev, unit_num, unit_info, "CMD_UNIT_ON", 0,
+                         True, None)
 
     def turn_off(self, action, dev, unit_num, unit_info):
-        unit_info.send_command("CMD_UNIT_OFF", unit_num, 0)
+        return self.send(dev, unit_num, unit_info, "CMD_UNIT_OFF", 0,
+                         False, 0)
 
     def toggle(self, action, dev, unit_num, unit_info):
-        if dev.onState:
-            self.turn_off(action, dev, unit_num, unit_info)
+        on, level = self.expected_state(dev)
+        if on:
+            return self.turn_off(action, dev, unit_num, unit_info)
         else:
-            self.turn_on(action, dev, unit_num, unit_info)
+            return self.turn_on(action, dev, unit_num, unit_info)
 
     def set_brightness(self, action, dev, unit_num, unit_info):
-        unit_info.send_command("CMD_UNIT_PERCENT", unit_num,
-                               action.actionValue)
+        return self.set_level(dev, unit_num, unit_info, action.actionValue)
 
     def brighten_by(self, action, dev, unit_num, unit_info):
-        new_level = min(100, dev.brightness + action.actionValue)
-        unit_info.send_command("CMD_UNIT_PERCENT", unit_num, new_level)
+        on, level = self.expected_state(dev)
+        return self.set_level(dev, unit_num, unit_info,
+                              min(100, level + action.actionValue))
 
     def dim_by(self, action, dev, unit_num, unit_info):
-        new_level = max(0, dev.brightness - action.actionValue)
-        unit_info.send_command("CMD_UNIT_PERCENT", unit_num, new_level)
+        on, level = self.expected_state(dev)
+        return self.set_level(dev, unit_num, unit_info,
+                              max(0, level - action.actionValue))
+
+    def set_level(self, dev, unit_num, unit_info, level):
+        return self.send(dev, unit_num, unit_info, "CMD_UNIT_PERCENT", level,
+                         level > 0, level)
+
+    # ----- Coalescing of unit commands ----- #
+
+    def send(self, dev, unit_num, unit_info, cmd_name, parameter, on, level):
+        """ Send a command to a unit right away, or if a minimum interval
+        between commands to a unit is set, queue it, so that brightness
+        commands sent faster than that collapse into one. on and level
+        are what the command will do to the device, for optimistic mode.
+        If the controller is disconnected, hold the command until it comes
+        back. Return True if the command was sent or queued and False if
+        it is being held. unit_info is None if it couldn't be had because
+        the controller is disconnected.
+        """
+        url = dev.pluginProps["url"]
+        interval = float(self.plugin.pluginPrefs.get("unitCommandInterval",
+                                                     0))
+        self.coalescer.interval = interval
+        key = (url, unit_num)
+        if interval <= 0 and not self.coalescer.queues.get(key):
+            try:
+                if unit_info is None:
+                    raise ConnectionError
+                unit_info.send_command(cmd_name, unit_num, parameter)
+            except ConnectionError:
+                if not self.hold(url, unit_num, cmd_name, parameter):
+                    raise
+                return False
+        else:
+            self.coalescer.add(key, cmd_name, parameter,
+                               cmd_name == "CMD_UNIT_PERCENT")
+            self.coalescer.run()
+        self.expect(dev, on, level)
+        return True
+
+    def send_queued(self, key, cmd_name, parameter):
+        """ Called by the coalescer to send a command that was queued.
+        By now the action has been logged as sent and optimistic mode
+        shows its result, so if it fails, say which devices it was for
+        and take back what they show. """
+        url, unit_num = key
+        try:
+            self.unit_info(url).send_command(cmd_name, unit_num, parameter)
+            return
+        except ConnectionError:
+            if self.hold(url, unit_num, cmd_name, parameter):
+                return
+        except Py4JError:
+            pass
+        devices = [dev for dev in self.devices_from_url(url)
+                   if dev.pluginProps["number"] == unit_num]
+        log.error('Queued {0} {1} for {2} failed to send'.format(
+            cmd_name, parameter,
+            ", ".join('"{0}"'.format(dev.name) for dev in devices) or
+            "unit {0} on {1}".format(unit_num, url)))
+        log.debug("", exc_info=True)
+        for dev in devices:
+            if dev.id in self.pending:
+                self.roll_back(dev)
+
+    def hold(self, url, number, cmd_name, parameter):
+        """ If holding commands is turned on, give a command for a unit,
+        or an area for the area commands, to the connection to send when
+        the controller comes back, and return True. Otherwise return
+        False. """
+        ttl = float(self.plugin.pluginPrefs.get("holdCommandsTime", 0))
+        target = "area" if cmd_name in _AREA_COMMANDS.values() else "unit"
+        connection = self.plugin.make_connection(url)
+        return connection.hold_command((target, number), cmd_name, parameter,
+                                       number, ttl)
+
+    # ----- Optimistic device states ----- #
+
+    def optimistic(self):
+        return self.plugin.pluginPrefs.get("optimisticUnits", False)
+
+    def expect(self, dev, on, level):
+        """ In optimistic mode, show what a command which was just sent
+        will do to a device without waiting to hear from the controller,
+        and remember to check that the controller agrees. level is None
+        if the command doesn't say what the brightness will be. """
+        if not self.optimistic():
+            return
+        with self.lock:
+            self.pending.setdefault(dev.id, []).append(
+                PendingCommand(on, level, self.clock() + _CONFIRM_TIMEOUT))
+        dev.updateStateOnServer("onOffState", on)
+        if (level is not None and
+                dev.deviceTypeId not in self.relay_device_types):
+            dev.updateStateOnServer("brightnessLevel", level)
+
+    def expected_state(self, dev):
+        """ Return a tuple of whether a device will be on and its
+        brightness once the commands sent to it are done, so that
+        relative commands sent in quick succession add up. """
+        with self.lock:
+            pending = list(self.pending.get(dev.id, []))
+        if not pending:
+            return dev.onState, dev.brightness
+        level = dev.brightness
+        for command in pending:
+            if command.level is not None:
+                level = command.level
+        return pending[-1].on, level
+
+    def reconcile(self, dev, status):
+        """ Given a status notification for a device, drop the pending
+        commands it confirms along with the older ones. Once nothing is
+        pending, show what the controller says. Until then, statuses which
+        don't confirm anything are kept to roll back to. """
+        with self.lock:
+            pending = self.pending.get(dev.id)
+            if pending:
+                for i, command in enumerate(pending):
+                    if command.matches(status):
+                        del pending[:i + 1]
+                        break
+                if pending:
+                    self.last_status[dev.id] = status
+                    return
+        self.update_device_from_status(dev, status)
+
+    def update(self):
+        """ Send the queued commands that are due, count down the unit
+        timers, and roll back the devices whose latest pending command
+        wasn't confirmed in time to the last status the controller
+        reported. """
+        self.coalescer.run()
+        self.count_down()
+        if not self.pending:
+            return
+        now = self.clock()
+        with self.lock:
+            expired = [dev_id for dev_id, pending in self.pending.items()
+                       if pending and pending[-1].deadline <= now]
+        for dev_id in expired:
+            self.roll_back(indigo.devices[dev_id])
+
+    def roll_back(self, dev):
+        """ Forget the commands pending for a device and show the last
+        status the controller reported for it, asking for one if there
+        isn't one. """
+        log.debug('Rolling back unconfirmed state of "{0}"'.format(dev.name))
+        # Drop them here, as update_device_status leaves them alone if
+        # it can't reach the controller
+        with self.lock:
+            self.pending.pop(dev.id, None)
+        status = self.last_status.get(dev.id)
+        if status is None:
+            self.update_device_status(dev)
+        else:
+            self.update_device_from_status(dev, status)
+
+    # ----- Unit timers ----- #
+
+    def count_down(self):
+        """ Every so many seconds, as set by the unitTimerGranularity
+        preference, show how much time is left on the timed units, working
+        it out from the last status the controller reported instead of
+        asking it again. 0 turns the countdown off, leaving the time as
+        reported. """
+        granularity = float(self.plugin.pluginPrefs.get(
+            "unitTimerGranularity", 1))
+        now = self.clock()
+        if granularity <= 0 or not self.deadlines or now < self.next_countdown:
+            return
+        self.next_countdown = now + granularity
+        for dev_id, deadline in list(self.deadlines.items()):
+            left = max(0, int(math.ceil(deadline - now)))
+            dev = indigo.devices[dev_id]
+            if dev.states["timeLeftSeconds"] != left:
+                dev.updateStateOnServer("timeLeftSeconds", left)
+            if left == 0:
+                self.deadlines.pop(dev_id, None)
+
+    # ----- Batches of unit commands ----- #
+
+    def validateActionConfigUi(self, values, type_id, action_id):
+        """ called by the Indigo UI to validate the values dictionary
+        for the Send Unit Commands action """
+        errors = indigo.Dict()
+        commands = values.get("commands", "")
+        if "%%" in commands:
+            tup = self.plugin.substitute(commands, validateOnly=True)
+            if not tup[0]:
+                errors["commands"] = tup[1]
+        else:
+            try:
+                if not parse_unit_commands(commands):
+                    errors["commands"] = "Please enter some commands."
+            except ValueError as e:
+                errors["commands"] = unicode(e)
+        return (not errors, values, errors)
+
+    def sendUnitCommands(self, action):
+        """ Callback for the Send Unit Commands action, which sends a list
+        of commands to the units on a controller all at once. """
+        dev = indigo.devices[action.deviceId]
+        try:
+            commands = parse_unit_commands(
+                self.plugin.substitute(action.props.get("commands", "")))
+        except ValueError as e:
+            log.error('Unit commands for "{0}" not sent: {1}'.format(
+                dev.name, e))
+            return
+        url = dev.pluginProps["url"]
+        try:
+            results = self.send_unit_commands(url, commands)
+        except ConnectionError:
+            if not all([self.hold(url, number, cmd_name, parameter)
+                        for number, cmd_name, parameter in commands]):
+                log.error('send "{0}" unit commands request failed'.format(
+                    dev.name))
+                log.debug("", exc_info=True)
+                return
+            indigo.server.log('holding "{0}" {1} unit commands until the '
+                              'controller reconnects'.format(
+                                  dev.name, len(commands)))
+            return
+        except Py4JError:
+            log.error('send "{0}" unit commands request failed'.format(
+                dev.name))
+            log.debug("", exc_info=True)
+            return
+        indigo.server.log('sent "{0}" {1} unit commands'.format(
+            dev.name, len(commands)))
+        for (number, cmd_name, parameter), result in zip(commands, results):
+            if result is not None:
+                log.error("{0} {1} to {2} failed: {3}".format(
+                    cmd_name, parameter, number, result))
+
+    def send_unit_commands(self, url, commands):
+        """ Send a list of (number, command name, parameter) tuples to the
+        controller at url, with one call to Java. Command names are those
+        in jomnilinkII's CommandMessage, such as CMD_UNIT_ON, and the
+        number is a unit number, or an area number for
+        CMD_UNIT_AREA_ALL_ON and CMD_UNIT_AREA_ALL_OFF. Return a list with
+        None for each command the controller acknowledged, and an error
+        message for each it didn't. Raises ConnectionError or Py4JError if
+        the commands couldn't be sent at all.
+        """
+        # Commands still waiting in the coalescer are older than these,
+        # and mustn't be sent after them
+        for number, cmd_name, parameter in commands:
+            if cmd_name not in _AREA_COMMANDS.values():
+                self.coalescer.discard((url, number))
+        connection = self.plugin.make_connection(url)
+        results = connection.controller_commands(
+            [(cmd_name, parameter, number)
+             for number, cmd_name, parameter in commands])
+
+        devices = defaultdict(list)
+        for dev in self.devices_from_url(url):
+            devices[dev.pluginProps["number"]].append(dev)
+        for (number, cmd_name, parameter), result in zip(commands, results):
+            if result is not None:
+                continue
+            for dev in devices[number]:
+                if cmd_name == "CMD_UNIT_ON":
+                    self.expect(dev, True, None)
+                elif cmd_name == "CMD_UNIT_OFF":
+                    self.expect(dev, False, 0)
+                elif cmd_name == "CMD_UNIT_PERCENT":
+                    self.expect(dev, parameter > 0, parameter)
+        return results
 
     def actionControlGeneral(self, action, dev):
         """ Callback from Indigo Server to implement general device actions.
@@ -218,16 +532,41 @@ class ControlUnitExtension(extensions.PluginExtension):
         else:
             for dev in self.devices_from_url(connection.url):
                 if dev.pluginProps["number"] == number:
-                    self.update_device_from_status(dev, status)
+                    self.reconcile(dev, status)
 
     def reconnect_notification(self, connection, omni):
-        for dev in self.devices_from_url(connection.url):
-            self.update_device_status(dev)
+        """ Bring the devices up to date after the connection comes back.
+        Fetch the unit statuses with ranged requests and only write the
+        ones which changed while disconnected. """
+        devices = list(self.devices_from_url(connection.url))
+        statuses = {}
+        try:
+            unit_info = self.unit_info(connection.url)
+            for first, last in number_ranges(
+                    dev.pluginProps["number"] for dev in devices):
+                statuses.update(unit_info.fetch_statuses(first, last))
+        except (ConnectionError, Py4JError):
+            log.debug("Failed to fetch unit statuses after reconnect",
+                      exc_info=True)
+
+        for dev in devices:
+            status = statuses.get(dev.pluginProps["number"])
+            if (status is None or dev.id not in self.last_status or
+                    dev.id in self.pending):
+                self.update_device_status(dev, status)
+            else:
+                if status != self.last_status[dev.id]:
+                    self.update_device_from_status(dev, status)
+                dev.setErrorStateOnServer(None)
 
     def disconnect_notification(self, connection, e):
         for dev in self.devices_from_url(connection.url):
             dev.setErrorStateOnServer("disconnected")
 
+    def subscriptions(self, url):
+        return {OBJ_TYPE_UNIT: [dev.pluginProps["number"]
+                                for dev in self.devices_from_url(url)]}
+
     def devices_from_url(self, url):
         """ Produce an iteration of device objects matching the given url
         by selecting from self.device_ids """
@@ -237,12 +576,15 @@ class ControlUnitExtension(extensions.PluginExtension):
                 if (url == dev.pluginProps["url"]):
                     yield dev
 
-    def update_device_status(self, dev):
+    def update_device_status(self, dev, status=None):
+        """ Set all the states of a device, querying the Omni controller
+        for the unit's status unless it is given. """
         unit_num = dev.pluginProps["number"]
         try:
             unit_info = self.unit_info(dev.pluginProps["url"])
             props = unit_info.unit_props[unit_num]
-            status = unit_info.fetch_status(unit_num)
+            if status is None:
+                status = unit_info.fetch_status(unit_num)
         except (ConnectionError, Py4JError):
             log.debug("Failed to get status of unit {0} from Omni".format(
                 unit_num))
@@ -254,10 +596,21 @@ class ControlUnitExtension(extensions.PluginExtension):
         dev.setErrorStateOnServer(None)
 
     def update_device_from_status(self, dev, status):
-        dev.updateStateOnServer("onOffState", status.status != 0)
+        """ Show a status the controller reported, replacing any
+        optimistic state. """
+        with self.lock:
+            self.pending.pop(dev.id, None)
+        self.last_status[dev.id] = status
+        if status.time > 0:
+            self.deadlines[dev.id] = self.clock() + status.time
+        else:
+            self.deadlines.pop(dev.id, None)
+        on, level = unit_on_level(status.status)
+        dev.updateStateOnServer("onOffState", on)
         dev.updateStateOnServer("timeLeftSeconds", status.time)
-        if dev.deviceTypeId not in self.relay_device_types:
-            dev.updateStateOnServer("brightnessLevel", status.status)
+        if (level is not None and
+                dev.deviceTypeId not in self.relay_device_types):
+            dev.updateStateOnServer("brightnessLevel", level)
 
     def unit_info(self, url):
         """ Handles caching UnitInfo objects by url. Makes a new one if
@@ -275,6 +628,177 @@ class ControlUnitExtension(extensions.PluginExtension):
     def say_unit_info(self, report, connection, say):
         unit_info = self.unit_info(connection.url)
         unit_info.report(say)
+        lines = self.coalescer.report(connection.url)
+        if lines:
+            say("")
+            say("Queued commands:")
+            for line in lines:
+                say(line)
+
+
+def parse_unit_commands(text):
+    """ Parse commands separated by commas or new lines, each one of
+    "5 on" or "5 off" to turn unit 5 on or off, "5 40" or "5 40%" to set
+    its brightness, or "area 1 on" or "area 1 off" to turn all the units
+    in area 1 on or off. Return a list of (number, command name,
+    parameter) tuples for send_unit_commands. Raises ValueError with a
+    message saying what's wrong.
+    """
+    commands = []
+    for entry in re.split(r"[,\n]", text):
+        words = entry.lower().split()
+        try:
+            if not words:
+                continue
+            elif (len(words) == 3 and words[0] == "area" and
+                    words[2] in _AREA_COMMANDS):
+                commands.append((int(words[1]), _AREA_COMMANDS[words[2]], 0))
+            elif len(words) == 2 and words[1] in _UNIT_COMMANDS:
+                commands.append((int(words[0]), _UNIT_COMMANDS[words[1]], 0))
+            elif len(words) == 2 and 0 <= int(words[1].rstrip("%")) <= 100:
+                commands.append((int(words[0]), "CMD_UNIT_PERCENT",
+                                 int(words[1].rstrip("%"))))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError('"{0}" is not a unit command'.format(
+                entry.strip()))
+    return commands
+
+
+class QueuedCommand(object):
+    """ A command waiting in a CommandCoalescer. queued is when the
+    first of the commands it stands for was added. """
+    def __init__(self, cmd_name, parameter, level, queued):
+        self.cmd_name, self.parameter = cmd_name, parameter
+        self.level, self.queued = level, queued
+
+
+class CommandCoalescer(object):
+    """ Queues of commands to units, which send at most one command to
+    each unit every interval seconds. A level command added while the
+    last one waiting for its unit is also a level command replaces that
+    one's parameter, so a burst collapses to its latest target. Other
+    commands wait their turn in order. A unit's queue is dropped once
+    it is empty.
+
+    Public attributes:
+        interval -- minimum seconds between commands to a unit
+        latency -- a diagnostics.LatencyStats of seconds from the first
+                   command a sent one stands for being added until it was
+                   sent, by url
+        counters -- diagnostics.Counters of commands added, collapsed
+                    and sent, by url
+
+    Public methods:
+        add -- queue a command
+        discard -- drop the commands waiting for a unit
+        run -- send the commands that are due. Call this often.
+        report -- lines describing one controller's commands
+    """
+    def __init__(self, send, interval=0, clock=time.time):
+        self.send = send
+        self.interval = interval
+        self.clock = clock
+        self.queues = defaultdict(deque)  # by (url, unit number)
+        self.last_sent = {}
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.latency = LatencyStats()
+        self.counters = defaultdict(Counters)
+
+    def add(self, key, cmd_name, parameter, level):
+        """ Queue a command for a unit, identified by a tuple of url and
+        unit number. send will be called with the key, the command name
+        and the parameter. level is true for commands which set a
+        brightness and can replace each other. """
+        with self.lock:
+            q = self.queues[key]
+            counters = self.counters[key[0]]
+            counters.add("added")
+            if level and q and q[-1].level:
+                q[-1].cmd_name, q[-1].parameter = cmd_name, parameter
+                counters.add("collapsed")
+            else:
+                q.append(QueuedCommand(cmd_name, parameter, level,
+                                       self.clock()))
+
+    def discard(self, key):
+        """ Drop the commands waiting for a unit, identified by a tuple of
+        url and unit number. """
+        with self.lock:
+            q = self.queues.pop(key, None)
+        if q:
+            log.debug("Dropped {0} queued commands for unit {1} on "
+                      "{2}".format(len(q), key[1], key[0]))
+
+    def run(self):
+        """ Send the first queued command of each unit which isn't
+        already being sent to and hasn't been sent to in the last
+        interval seconds. """
+        now = self.clock()
+        due = []
+        with self.lock:
+            for key, q in self.queues.items():
+                if (q and key not in self.busy and
+                        now >= self.last_sent.get(key, now - self.interval) +
+                        self.interval):
+                    due.append((key, q.popleft()))
+                    self.busy.add(key)
+                if not q:
+                    del self.queues[key]
+        for key, command in due:
+            try:
+                self.send(key, command.cmd_name, command.parameter)
+            finally:
+                sent = self.clock()
+                with self.lock:
+                    self.busy.discard(key)
+                    self.last_sent[key] = sent
+                    self.latency.record(key[0], sent - command.queued)
+                    self.counters[key[0]].add("sent")
+
+    def report(self, url):
+        with self.lock:
+            waiting = sum(len(q) for key, q in self.queues.items()
+                          if key[0] == url)
+            if url not in self.counters:
+                return []
+            counters = self.counters[url]
+            p50, p90, p99 = self.latency.percentiles(url)
+            return ["{0} waiting, {1} added, {2} collapsed, {3} sent".format(
+                        waiting, counters["added"], counters["collapsed"],
+                        counters["sent"]),
+                    "Seconds from action to sending: {0:.2f}/{1:.2f}/{2:.2f} "
+                    "at 50/90/99%".format(p50 or 0, p90 or 0, p99 or 0)]
+
+
+class PendingCommand(object):
+    """ A command sent to a unit in optimistic mode, whose result is
+    shown on the device but hasn't been confirmed by the controller.
+    level is None if the command doesn't say what the brightness will be.
+    """
+    def __init__(self, on, level, deadline):
+        self.on, self.level, self.deadline = on, level, deadline
+
+    def matches(self, status):
+        on, level = unit_on_level(status.status)
+        if self.level is not None and level is not None:
+            return level == self.level
+        return on == self.on
+
+
+def unit_on_level(status):
+    """ Decode the status byte the controller reports for a unit into a
+    tuple of whether it's on and its brightness in percent. 0 is off, and
+    100 to 200 are levels of 0 to 100%. The others, such as 1 for on,
+    scenes and dim or brighten steps, don't give a level, so it is None.
+    """
+    if status == 0:
+        return False, 0
+    if 100 <= status <= 200:
+        return status > 100, status - 100
+    return True, None
 
 
 class UnitInfo(object):
@@ -286,6 +810,7 @@ class UnitInfo(object):
         number_and_status_from_notification: return name of unit and UnitStatus
             object deciphered from Omni event notification method
         fetch_status: query Omni for unit status for a unit
+        fetch_statuses: query Omni for the statuses of a range of units
         fetch_props: return a UnitProperties object for one unit
         send_command: send a command
         report: given a print method, write formatted info about all units
@@ -326,9 +851,11 @@ class UnitInfo(object):
                 ObjectProps.FILTER_2_AREA_ALL,
                 ObjectProps.FILTER_3_ANY_LOAD)
             if m.getMessageType() != Message.MESG_TYPE_OBJ_PROP:
+                self.connection.release(m)
                 break
             objnum = m.getNumber()
             results[objnum] = UnitProperties(m)
+            self.connection.release(m)
         return results
 
     def fetch_status(self, objnum):
@@ -341,11 +868,28 @@ class UnitInfo(object):
             raise ConnectionError("Unit {0} is not defined on Omni system")
         jomnilinkII = self.connection.jomnilinkII
         Message = jomnilinkII.Message
-        status_msg = self.connection.omni.reqObjectStatus(
-            Message.OBJ_TYPE_UNIT, objnum, objnum)
+        status_msg = self.connection.copy_status(
+            self.connection.omni.reqObjectStatus(
+                Message.OBJ_TYPE_UNIT, objnum, objnum))
         status = status_msg.getStatuses()[0]
         return UnitStatus(status)
 
+    def fetch_statuses(self, first, last):
+        """ Query the Omni controller for the status of a range of units,
+        using one request, and return a dictionary of UnitStatus objects
+        indexed by unit number. Units which aren't defined on the Omni
+        system are left out.
+        """
+        Message = self.connection.jomnilinkII.Message
+        status_msg = self.connection.copy_status(
+            self.connection.omni.reqObjectStatus(
+                Message.OBJ_TYPE_UNIT, first, last))
+        results = {}
+        for status in status_msg.getStatuses():
+            if status is not None and status.getNumber() in self.unit_props:
+                results[status.getNumber()] = UnitStatus(status)
+        return results
+
     def number_and_status_from_notification(self, status_msg):
         """ Given a status message from the JomniLinkII notification
         listener, determine if it is about a unit. If it is, return the
@@ -427,3 +971,10 @@ class UnitStatus(object):
         Unit Status object. """
         self.status = omni_status.getStatus()
         self.time = omni_status.getTime()
+
+    def __eq__(self, other):
+        return (isinstance(other, UnitStatus) and
+                (self.status, self.time) == (other.status, other.time))
+
+    def __ne__(self, other):
+        return not self == other
@@ -21,17 +21,27 @@ from __future__ import unicode_literals
 
 from distutils.version import StrictVersion
 import logging
+import threading
 
 import indigo
 from py4j.protocol import Py4JError
 
 import extensions
 from connection import ConnectionError
+from omni_messages import OBJ_TYPE_ZONE
+from scheduler import number_ranges
 
 log = logging.getLogger(__name__)
 
 _VERSION = "0.3.0"
 
+# Seconds between polls of zones which don't send status notifications
+# when their loop readings change, and the limits the scheduler may adjust
+# the interval between.
+_POLL_INTERVAL = 300
+_MIN_POLL_INTERVAL = 60
+_MAX_POLL_INTERVAL = 1800
+
 
 class OldVersionError(Exception):
     pass
@@ -51,6 +61,13 @@ class ZoneExtension(extensions.PluginExtension):
         # key is url, value is ZoneInfo instance
         self._zone_info = {}
 
+        # key is device id, value is scheduler job for polled zones.
+        # Notification workers add to it, so it's guarded by lock
+        self.poll_jobs = {}
+        self.lock = threading.Lock()
+        # key is device id, value is ZoneStatus last written to the device
+        self.last_status = {}
+
     # ----- Device Start and Stop Methods ----- #
 
     def deviceStartComm(self, device):
@@ -76,6 +93,11 @@ class ZoneExtension(extensions.PluginExtension):
         if device.id in self.device_ids:
             log.debug('Stopping device "{0}"'.format(device.name))
             self.device_ids.remove(device.id)
+            self.last_status.pop(device.id, None)
+            with self.lock:
+                job = self.poll_jobs.pop(device.id, None)
+            if job is not None:
+                self.plugin.scheduler.remove(job)
 
     def update_device_version(self, device):
         """ if the device was defined in a previous version of this plugin,
@@ -191,13 +213,37 @@ class ZoneExtension(extensions.PluginExtension):
                     self.update_device_from_status(dev, status)
 
     def reconnect_notification(self, connection, omni):
-        for dev in self.devices_from_url(connection.url):
-            self.update_device_status(dev)
+        """ Bring the devices up to date after the connection comes back.
+        Fetch the zone statuses with ranged requests and only write the
+        ones which changed while disconnected. """
+        devices = list(self.devices_from_url(connection.url))
+        statuses = {}
+        try:
+            zone_info = self.zone_info(connection.url)
+            for first, last in number_ranges(
+                    dev.pluginProps["number"] for dev in devices):
+                statuses.update(zone_info.fetch_statuses(first, last))
+        except (ConnectionError, Py4JError):
+            log.debug("Failed to fetch zone statuses after reconnect",
+                      exc_info=True)
+
+        for dev in devices:
+            status = statuses.get(dev.pluginProps["number"])
+            if status is None or dev.id not in self.last_status:
+                self.update_device_status(dev, status)
+            else:
+                if status != self.last_status[dev.id]:
+                    self.update_device_from_status(dev, status)
+                dev.setErrorStateOnServer(None)
 
     def disconnect_notification(self, connection, e):
         for dev in self.devices_from_url(connection.url):
             dev.setErrorStateOnServer("disconnected")
 
+    def subscriptions(self, url):
+        return {OBJ_TYPE_ZONE: [dev.pluginProps["number"]
+                                for dev in self.devices_from_url(url)]}
+
     def devices_from_url(self, url):
         """ Produce an iteration of device objects matching the given url
         by selecting from self.device_ids """
@@ -206,11 +252,14 @@ class ZoneExtension(extensions.PluginExtension):
             if (url == dev.pluginProps["url"]):
                 yield dev
 
-    def update_device_status(self, dev):
+    def update_device_status(self, dev, status=None):
+        """ Set all the states of a device, querying the Omni controller
+        for the zone's status unless it is given. """
         try:
             zone_info = self.zone_info(dev.pluginProps["url"])
             props = zone_info.zone_props[dev.pluginProps["number"]]
-            status = zone_info.fetch_status(dev.pluginProps["number"])
+            if status is None:
+                status = zone_info.fetch_status(dev.pluginProps["number"])
         except (ConnectionError, Py4JError):
             log.debug("Failed to get status of zone {0} from Omni".format(
                 dev.pluginProps["number"]))
@@ -224,8 +273,38 @@ class ZoneExtension(extensions.PluginExtension):
             dev.updateStateOnServer("area", props.area)
             self.update_device_from_status(dev, status)
             dev.setErrorStateOnServer(None)
+            if props.needs_polling:
+                self.add_poll_job(dev, props.number)
+
+    def add_poll_job(self, dev, number):
+        """ Schedule polling for a zone device, unless that's already
+        been done. """
+        with self.lock:
+            if dev.id not in self.poll_jobs:
+                self.poll_jobs[dev.id] = self.plugin.scheduler.add(
+                    dev.pluginProps["url"], "zone", number, number,
+                    _POLL_INTERVAL, self.poll_zones,
+                    min_interval=_MIN_POLL_INTERVAL,
+                    max_interval=_MAX_POLL_INTERVAL)
+
+    def poll_zones(self, url, obj_type, first, last):
+        """ Scheduler callback for zones whose loop readings change
+        without notification. Fetch the statuses of a range of zones,
+        update the devices whose status changed, and return the numbers
+        of those zones.
+        """
+        statuses = self.zone_info(url).fetch_statuses(first, last)
+        changed = []
+        for dev in self.devices_from_url(url):
+            number = dev.pluginProps["number"]
+            if (number in statuses and
+                    statuses[number] != self.last_status.get(dev.id)):
+                self.update_device_from_status(dev, statuses[number])
+                changed.append(number)
+        return changed
 
     def update_device_from_status(self, dev, status):
+        self.last_status[dev.id] = status
         dev.updateStateOnServer("condition", status.condition)
         dev.updateStateOnServer("onOffState", status.condition == "Secure")
         dev.updateStateOnServer("alarmStatus", status.latched_alarm)
@@ -259,6 +338,7 @@ class ZoneInfo(object):
         number_and_status_from_notification: return name of zone and ZoneStatus
             object deciphered from Omni event notification method
         fetch_status: query Omni for zone status for a zone
+        fetch_statuses: query Omni for the statuses of a range of zones
         fetch_props: return a ZoneProperties object for one zone
         report: given a print method, write formatted info about all zones
     """
@@ -296,9 +376,11 @@ class ZoneInfo(object):
                 ObjectProps.FILTER_2_AREA_ALL,
                 ObjectProps.FILTER_3_ANY_LOAD)
             if m.getMessageType() != Message.MESG_TYPE_OBJ_PROP:
+                self.connection.release(m)
                 break
             objnum = m.getNumber()
             results[objnum] = ZoneProperties(m)
+            self.connection.release(m)
         return results
 
     def fetch_status(self, objnum):
@@ -311,11 +393,28 @@ class ZoneInfo(object):
             raise ConnectionError("Zone {0} is not defined on Omni system")
         jomnilinkII = self.connection.jomnilinkII
         Message = jomnilinkII.Message
-        status_msg = self.connection.omni.reqObjectStatus(
-            Message.OBJ_TYPE_ZONE, objnum, objnum)
+        status_msg = self.connection.copy_status(
+            self.connection.omni.reqObjectStatus(
+                Message.OBJ_TYPE_ZONE, objnum, objnum))
         status = status_msg.getStatuses()[0]
         return ZoneStatus(status)
 
+    def fetch_statuses(self, first, last):
+        """ Query the Omni controller for the status of a range of zones,
+        using one request, and return a dictionary of ZoneStatus objects
+        indexed by zone number. Zones which aren't defined on the Omni
+        system are left out.
+        """
+        Message = self.connection.jomnilinkII.Message
+        status_msg = self.connection.copy_status(
+            self.connection.omni.reqObjectStatus(
+                Message.OBJ_TYPE_ZONE, first, last))
+        results = {}
+        for status in status_msg.getStatuses():
+            if status is not None and status.getNumber() in self.zone_props:
+                results[status.getNumber()] = ZoneStatus(status)
+        return results
+
     def number_and_status_from_notification(self, status_msg):
         """ Given a status message from the JomniLinkII notification
         listener, determine if it is about a zone. If it is, return the
@@ -378,6 +477,7 @@ class ZoneProperties(object):
         self.name = omni_props.getName()
         self.number = omni_props.getNumber()
         zone_type = omni_props.getZoneType()
+        self.needs_polling = zone_type in self.polled_types
         self.type_name = self.type_names.get(
             zone_type, "Unknown Zone Type {0}".format(zone_type))
         self.area = omni_props.getArea()
@@ -417,10 +517,14 @@ class ZoneProperties(object):
                   83: "Temperature Alarm",
                   84: "Humidity",
                   85: "Extended Range Outdoor Temp",
-                  85: "Extended Range Temp",
-                  85: "Extended Range Temp Alarm"
+                  86: "Extended Range Temp",
+                  87: "Extended Range Temp Alarm"
                   }
 
+    # temperature and humidity zones, whose loop readings change
+    # without status notifications
+    polled_types = range(80, 88)
+
 
 class ZoneStatus(object):
     """ ZoneStatus class, represents Omni Zone status """
@@ -457,3 +561,13 @@ class ZoneStatus(object):
     arming_mask = 0b110000
 
     trouble_mask = 0b1000000
+
+    def __eq__(self, other):
+        return (isinstance(other, ZoneStatus) and
+                (self.loop, self.condition, self.latched_alarm, self.arming,
+                 self.had_trouble) ==
+                (other.loop, other.condition, other.latched_alarm,
+                 other.arming, other.had_trouble))
+
+    def __ne__(self, other):
+        return not self == other
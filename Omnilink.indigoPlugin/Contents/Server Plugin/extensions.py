@@ -88,6 +88,7 @@ class PluginExtension(object):
     Methods stubbed in the base class that subclasses may implement:
         getDeviceList
         createDevices
+        subscriptions
         update
 
     Notification callbacks that subclasses may implement if they need updates
@@ -105,6 +106,12 @@ class PluginExtension(object):
             connection -- Connection object (from plugin.py, not jomnilinkII)
             other - OtherEventNotifications object from jomnilinkII
 
+    system_status_notification(self, connection, status):
+        Called when jomnilinkII passes along the answer to one of its
+        keep-alive pings. Should catch all exceptions.
+            connection -- Connection object (from plugin.py, not jomnilinkII)
+            status -- SystemStatus object from jomnilinkII
+
     disconnect_notification(self, connection, e):
         Called when jomnilinkII sends a disconnect notification.
         Should catch all exceptions.
@@ -207,7 +214,23 @@ class PluginExtension(object):
                 name = basename + " " + str(count)
         return name
 
+    def subscriptions(self, url):
+        """ Return the notifications this extension wants from the
+        controller at url, as a dictionary whose keys are object types
+        from jomnilinkII's Message class and values are collections of
+        object numbers. Add the key "events" with a true value to get
+        other event notifications. Anything nobody subscribes to is
+        dropped before it gets to Python. This is called after devices
+        are started or stopped.
+        """
+        return {}
+
     def update(self):
         """ This is called on a clock from within RunConcurrentThread.
         Extensions should use this to update devices. """
         pass
+
+    def shutdown(self):
+        """ This is called when the plugin shuts down. Extensions should
+        use this to close files and the like. """
+        pass
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Pool of connections to the Java gateway for Leviton/HAI Omni plugin
+for IndigoServer """
+
+from collections import deque
+import logging
+import threading
+import time
+
+from py4j.java_gateway import GatewayConnection, quiet_close
+from py4j.protocol import Py4JNetworkError, ERROR
+
+from diagnostics import Counters
+
+log = logging.getLogger(__name__)
+
+
+class GatewayPool(object):
+    """ A replacement for py4j's GatewayClient, which opens a new socket
+    to the Java gateway whenever a thread finds none free, and keeps all
+    of them forever. This keeps at most max_size connections. A thread
+    which finds them all busy waits up to wait seconds for one and then
+    gets a Py4JNetworkError. Connections that have been idle for
+    idle_timeout seconds are closed, and prewarm can open some ahead of
+    time.
+
+    Public attributes:
+        counters -- a diagnostics.Counters of connections created,
+                    closed and evicted, waits, timeouts, and the peak
+                    number in use
+
+    Public methods:
+        prewarm -- open connections before they're needed
+        stats -- the counters plus current usage, as a list of lines
+    The rest is the interface py4j expects of a GatewayClient.
+    """
+    def __init__(self, address="127.0.0.1", port=25333, max_size=8,
+                 wait=5.0, idle_timeout=60.0, auto_close=True,
+                 clock=time.time):
+        self.address, self.port = address, port
+        self.auto_close = auto_close
+        self.max_size, self.wait = max_size, wait
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.is_connected = True
+        self.gateway_property = None
+        self.converters = None
+
+        self.condition = threading.Condition()
+        self.idle = deque()  # of (connection, time given back), newest last
+        self.open = 0
+        self.in_use = 0
+        self.counters = Counters()
+
+    def _get_connection(self):
+        if not self.is_connected:
+            raise Py4JNetworkError("Gateway is not connected.")
+        with self.condition:
+            self._evict_idle()
+            deadline = None
+            while not self.idle and self.open >= self.max_size:
+                now = self.clock()
+                if deadline is None:
+                    deadline = now + self.wait
+                    self.counters.add("waits")
+                elif now >= deadline:
+                    self.counters.add("timeouts")
+                    raise Py4JNetworkError(
+                        "All {0} gateway connections are busy".format(
+                            self.max_size))
+                self.condition.wait(deadline - now)
+            self.in_use += 1
+            self.counters.peak("peak in use", self.in_use)
+            if self.idle:
+                return self.idle.pop()[0]
+            self.open += 1
+
+        # Connect outside the lock, the slot is already reserved
+        try:
+            connection = self._create_connection()
+        except Exception:
+            with self.condition:
+                self.open -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+        return connection
+
+    def _create_connection(self):
+        connection = GatewayConnection(self.address, self.port,
+                                       self.auto_close, self.gateway_property)
+        connection.start()
+        with self.condition:
+            self.counters.add("created")
+        return connection
+
+    def _give_back_connection(self, connection):
+        with self.condition:
+            self.in_use -= 1
+            self.idle.append((connection, self.clock()))
+            self.condition.notify()
+
+    def _discard(self, connection):
+        """ Close a connection which failed while in use. """
+        quiet_close(connection)
+        with self.condition:
+            self.in_use -= 1
+            self.open -= 1
+            self.counters.add("closed")
+            self.condition.notify()
+
+    def _evict_idle(self):
+        """ Close the connections that have been idle too long. Call with
+        the lock held. """
+        cutoff = self.clock() - self.idle_timeout
+        while self.idle and self.idle[0][1] < cutoff:
+            quiet_close(self.idle.popleft()[0])
+            self.open -= 1
+            self.counters.add("evicted")
+
+    def prewarm(self, count):
+        """ Open up to count connections, without going over max_size,
+        and leave them idle. """
+        for i in range(count):
+            with self.condition:
+                if self.open >= self.max_size:
+                    return
+                self.open += 1
+            try:
+                connection = self._create_connection()
+            except Exception:
+                with self.condition:
+                    self.open -= 1
+                log.debug("Unable to prewarm gateway connection",
+                          exc_info=True)
+                return
+            with self.condition:
+                self.idle.append((connection, self.clock()))
+                self.condition.notify()
+
+    def send_command(self, command, retry=True):
+        """ Send a command to the JVM, as GatewayClient does. """
+        connection = self._get_connection()
+        try:
+            response = connection.send_command(command)
+        except Py4JNetworkError:
+            self._discard(connection)
+            if retry:
+                log.debug("Exception while sending command", exc_info=True)
+                return self.send_command(command)
+            log.error("Exception while sending command", exc_info=True)
+            return ERROR
+        self._give_back_connection(connection)
+        return response
+
+    def shutdown_gateway(self):
+        """ Send the shutdown command to the gateway, and close all the
+        connections. """
+        connection = self._get_connection()
+        try:
+            connection.shutdown_gateway()
+            self._discard(connection)
+        except Py4JNetworkError:
+            log.debug("Error while shutting down gateway", exc_info=True)
+            self._discard(connection)
+        self.close()
+        self.is_connected = False
+
+    def close(self):
+        """ Close the idle connections. """
+        with self.condition:
+            while self.idle:
+                quiet_close(self.idle.pop()[0])
+                self.open -= 1
+                self.counters.add("closed")
+
+    def stats(self):
+        with self.condition:
+            return (["in use: {0}".format(self.in_use),
+                     "idle: {0}".format(len(self.idle)),
+                     "limit: {0}".format(self.max_size)] +
+                    self.counters.report())
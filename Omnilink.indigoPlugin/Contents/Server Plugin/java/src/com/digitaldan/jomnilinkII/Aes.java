@@ -65,4 +65,15 @@ public class Aes {
 			throw new IOException(e.getMessage());
 		}
 	}
+
+	/*
+	 * input and output may be the same array, to encrypt in place.
+	 */
+	public int encrypt(byte[] input, int inputOffset, int inputLen, byte[] output, int outputOffset) throws IOException{
+		try {
+		    return encipher.doFinal(input,inputOffset,inputLen, output,outputOffset);
+		}catch(Exception e){
+			throw new IOException(e.getMessage());
+		}
+	}
 }
@@ -19,17 +19,14 @@ package com.digitaldan.jomnilinkII;
  */
 
 import java.io.ByteArrayInputStream;
-import java.io.ByteArrayOutputStream;
 import java.io.DataInputStream;
-import java.io.DataOutputStream;
 import java.io.IOException;
-import java.io.InputStream;
-import java.io.OutputStream;
 import java.net.InetSocketAddress;
 import java.net.Socket;
 import java.net.SocketTimeoutException;
 import java.net.UnknownHostException;
 import java.security.AccessController;
+import java.util.Arrays;
 import java.util.LinkedList;
 import java.util.Vector;
 
@@ -98,25 +95,40 @@ public class Connection extends Thread {
 	public static int PING_TO = OMNI_TO - (1000 * 60);
 	//But give up after 10 sec if no response at first connection
 	public static int OMNI_INITIAL_TO = 10 * 1000;
+	//How often the watchdog wakes up to check on the connection
+	public static int WATCHDOG_TICK = 250;
 
 	public boolean debug;
 	private boolean connected;
 	private boolean ping;
 	private long lastTXMessageTime;
+	//Liveness probe, see setKeepAlive. An interval of 0 disables it.
+	private int keepAliveInterval;
+	private int keepAliveTimeout;
+	private volatile long lastRXMessageTime;
+	private volatile long probeSentTime;
+	private volatile long silenceAtDisconnect;
+	private boolean disconnectNotified;
+	private Object disconnectLock = new Object();
 	private Socket socket;
-	private InputStream is;
-	private OutputStream os;
+	private PacketIO io;
 	private int tx;
 	private int rx;
 	private Aes aes;
 	private LinkedList<Message> notifications;
 	private OmniPacket response;
+	//reused for every packet the reader thread receives
+	private OmniPacket rxPacket = new OmniPacket(0, 0, null);
 	private Object readLock = new Object();
 	private Object writeLock = new Object();
 	private Object notifyLock = new Object();
 	private Exception lastException;
 	private Vector<NotificationListener> notificationListeners;
 	private Vector<DisconnectListener> disconnectListeners;
+	//when set, gets notifications instead of the notification listeners
+	private volatile RawNotificationListener rawNotificationListener;
+	//when set, drops the notifications nobody wants
+	private volatile NotificationFilter notificationFilter;
 	private NotificationHandler notificationHandler;
 	private ConnectionWatchdog watchdog;
 	public Connection(String address, int port, String key)
@@ -134,8 +146,7 @@ public class Connection extends Thread {
 		socket = new Socket();
 		socket.setSoTimeout(OMNI_INITIAL_TO);
 		socket.connect(new InetSocketAddress(address,port), OMNI_INITIAL_TO);
-		is = socket.getInputStream();
-		os = socket.getOutputStream();
+		io = new PacketIO(socket.getInputStream(), socket.getOutputStream());
 		tx = 1;
 		rx = 1;
 
@@ -150,8 +161,8 @@ public class Connection extends Thread {
 		byte [] data = rec.data();
 
 		int version = (int)((data[0] << 8) + (data[1] << 0));
-		if(debug)
-			System.out.println("Controller version " + version);
+		if(tracing())
+			DebugLog.log("connection", "Controller version " + version);
 
 		byte [] sessionid = new byte[5];
 		System.arraycopy(data, 2, sessionid, 0, 5);
@@ -161,6 +172,7 @@ public class Connection extends Thread {
 		}
 
 		aes = new Aes(_key);
+		io.setAes(aes);
 		sendBytesEncrypted(new OmniPacket(PACKET_TYPE_CLIENT_REQUEST_SECURE_CONNECTION,sessionid));
 
 		rec = readBytesEncrypted();
@@ -170,14 +182,15 @@ public class Connection extends Thread {
 		data = rec.data();
 
 		for(int i=0; i<5; i++){
-			if(debug)
-				System.out.println("Data " + i + " mine " + sessionid[i] + " controllers " + data[i]);
+			if(tracing())
+				DebugLog.log("connection", "Data " + i + " mine " + sessionid[i] + " controllers " + data[i]);
 			if( (int)data[i] != (int)sessionid[i]){
 				throw new IOException("Controller returned wrong sessioid");
 			}
 		}
 		connected = true;
 		lastTXMessageTime = System.currentTimeMillis();
+		lastRXMessageTime = lastTXMessageTime;
 
 		notificationListeners = new Vector<NotificationListener>();
 
@@ -188,7 +201,7 @@ public class Connection extends Thread {
 		notificationHandler.setName("NotificationHandlerThread");
 		notificationHandler.start();
 
-		ConnectionWatchdog watchdog = new ConnectionWatchdog();
+		watchdog = new ConnectionWatchdog();
 		watchdog.setName("ConnectionWatchdogThread");
 		watchdog.start();
 	}
@@ -208,14 +221,44 @@ public class Connection extends Thread {
 		return connected;
 	}
 
+        /*
+         * Debug output goes to DebugLog, which is shared by all
+         * connections, so this turns it on or off for all of them.
+         */
         public void setDebug(boolean value){
   	        debug = value;
+  	        DebugLog.setEnabled(value);
         }
 
+	private boolean tracing(){
+		return DebugLog.isEnabled();
+	}
+
 	public Exception lastError(){
 		return lastException;
 	}
 
+	/**
+	 * Actively probe the controller when nothing has been received from it
+	 * for intervalMs milliseconds, and declare the connection lost if the
+	 * probe gets no answer within timeoutMs. Any traffic from the
+	 * controller counts as a sign of life, so a busy link is never probed.
+	 * An interval of 0 turns probing off.
+	 */
+	public void setKeepAlive(int intervalMs, int timeoutMs){
+		keepAliveInterval = intervalMs;
+		keepAliveTimeout = timeoutMs;
+	}
+
+	/**
+	 * Milliseconds between the last message received from the controller
+	 * and the moment the connection was declared lost, or 0 if it
+	 * hasn't been.
+	 */
+	public long silenceAtDisconnect(){
+		return silenceAtDisconnect;
+	}
+
 	public boolean autoPingOmni(){
 		return ping;
 	}
@@ -250,6 +293,43 @@ public class Connection extends Thread {
 		}
 	}
 
+	/**
+	 * Send notifications from the controller to listener as raw message
+	 * bytes, instead of decoding them and passing them to the notification
+	 * listeners. Answers to keep-alive probes still go to the notification
+	 * listeners. Pass null to go back to decoding everything.
+	 */
+	public void setRawNotificationListener(RawNotificationListener listener){
+		rawNotificationListener = listener;
+	}
+
+	public RawNotificationListener getRawNotificationListener(){
+		return rawNotificationListener;
+	}
+
+	/**
+	 * Only pass along the notifications described by spec, see
+	 * NotificationFilter for its format. Pass null to pass along all
+	 * of them.
+	 */
+	public void setNotificationFilter(String spec){
+		notificationFilter = spec == null ? null : new NotificationFilter(spec);
+	}
+
+	/**
+	 * Forget all the notification and disconnect listeners, so that a new
+	 * owner can take over the connection.
+	 */
+	public void removeAllListeners(){
+		rawNotificationListener = null;
+		synchronized (notificationListeners) {
+			notificationListeners.clear();
+		}
+		synchronized (disconnectListeners) {
+			disconnectListeners.clear();
+		}
+	}
+
 	public Message sendAndReceive(Message message) throws IOException, OmniNotConnectedException, OmniUnknownMessageTypeException{
 
 		synchronized(writeLock){
@@ -257,32 +337,39 @@ public class Connection extends Thread {
 				throw new OmniNotConnectedException(lastError());
 
 			OmniPacket ret;
+			Message reply;
 			sendBytesEncrypted(new OmniPacket(PACKET_TYPE_OMNI_LINK_MESSAGE,
 					MessageFactory.toBytes(message)));
 			synchronized(readLock){
-				//wait for notfiy when response comes in on thread
-				while(response == null && connected) {
-					try { readLock.wait();} catch (InterruptedException ignored){}
+				try {
+					//wait for notfiy when response comes in on thread
+					while(response == null && connected) {
+						try { readLock.wait();} catch (InterruptedException ignored){}
+					}
+					ret = response;
+					//no longer need this reference
+					response = null;
+					//if an error occurs on our other thread it saves the exception
+					if(!connected)
+					    throw new OmniNotConnectedException(lastError());
+					if(ret.type() != PACKET_TYPE_OMNI_LINK_MESSAGE) {
+						System.out.println(bytesToString(ret.data()));
+						throw new IOException("RECEIEVD NON OMNI_LINK_MESG ("+ ( ret == null ? "NULL MESG" : ret.type() ) +")");
+					}
+					//the reader reuses its buffer for the next packet, so
+					//decode before letting it continue
+					reply = MessageFactory.fromBytes(ret.data());
+				} finally {
+					//notify reader it can continue;
+					readLock.notify();
 				}
-				ret = response;
-				//no longer need this reference
-				response = null;
-				//notify reader it can continue;
-				readLock.notify();
-				//if an error occurs on our other thread it saves the exception
-				if(!connected)
-				    throw new OmniNotConnectedException(lastError());
-			}
-			if(ret.type() != PACKET_TYPE_OMNI_LINK_MESSAGE) {
-				System.out.println(bytesToString(ret.data()));
-				throw new IOException("RECEIEVD NON OMNI_LINK_MESG ("+ ( ret == null ? "NULL MESG" : ret.type() ) +")");
 			}
 
 			//used to ping after a certain amount of time
 			lastTXMessageTime = System.currentTimeMillis();
 
 			writeLock.notifyAll();
-			return MessageFactory.fromBytes(ret.data());
+			return reply;
 		}
 	}
 
@@ -291,14 +378,11 @@ public class Connection extends Thread {
 		while(connected){
 			synchronized (readLock) {
 				try {
-					if((ret = readBytesEncrypted2()).seq() == 0 &&
+					ret = readBytesEncrypted2();
+					lastRXMessageTime = System.currentTimeMillis();
+					if(ret.seq() == 0 &&
 							ret.type() == PACKET_TYPE_OMNI_LINK_MESSAGE){
-						notifications.add(MessageFactory.fromBytes(ret.data()));
-						if(debug)
-							System.out.println("run: NOTIFICATION: Added message with type " + ret.type);
-						synchronized (notifyLock) {
-							notifyLock.notifyAll();
-						}
+						handleNotification(ret.data());
 					} else if(ret.type() == PACKET_TYPE_OMNI_LINK_MESSAGE) {
 						response = ret;
 						//notify calling request lock
@@ -310,9 +394,8 @@ public class Connection extends Thread {
 					}
 				} catch(OmniUnknownMessageTypeException e){
 					//ignored
-					if(debug){
-						e.printStackTrace();
-						System.out.println("run: Uknown Messgage type " + e.getUnknowMessageType() + " Continuing");
+					if(tracing()){
+						DebugLog.log("notification", "run: Uknown Messgage type " + e.getUnknowMessageType() + " Continuing");
 					}
 //				}catch(SocketTimeoutException e){
 //					//ignored
@@ -321,10 +404,7 @@ public class Connection extends Thread {
 //						System.out.println("Ignoring SocketTimeoutException, will try and send omni a ping if needed");
 //					}
 				}catch(Exception e){
-					connected = false;
-					lastException = e;
-					//tell listeners about exception
-					notifyDisconnectHandlers(lastException);
+					connectionLost(e);
 				} finally {
 					readLock.notifyAll();
 				}
@@ -338,8 +418,8 @@ public class Connection extends Thread {
 //				}
 			}
 		}
-		if(debug)
-			System.out.println("run: not connected, thread exiting");
+		if(tracing())
+			DebugLog.log("connection", "run: not connected, thread exiting");
 	}
 
 //	private void pingServer(){
@@ -368,41 +448,18 @@ public class Connection extends Thread {
 
 	 */
 	private void sendBytesEncrypted(OmniPacket p) throws IOException {
-		/* 1. */
-		if(debug)
-			System.out.println("TX: " + bytesToString(p.data()));
-		int txlength = (p.data().length + 15) & ~0xF;
-		byte [] paddedData = new byte[txlength];
-
-		System.arraycopy(p.data(), 0, paddedData, 0, p.data().length);
-		for(int i = p.data().length; i < txlength ;i++){
-			paddedData[i] = 0x00;
-		}
-		/* 2 */
-		for (int i = 0; i < (txlength / 16); i++){
-			paddedData[0 + (16 * i)] ^= (tx >> 8) & 0xFF;
-			paddedData[1 + (16 * i)] ^= (tx) & 0xFF;
-		}
-		/*3*/
-		byte []encData;
-		try {
-			encData = aes.encrypt(paddedData);
-		} catch (Exception e){
-			throw new IOException(e.getMessage());
-		}
-		sendBytes(new OmniPacket(p.type(),encData));
+		if(tracing())
+			DebugLog.log("tx", bytesToString(p.data()));
+		io.writeEncrypted(tx, p.type(), p.data());
+		nextTx();
 	}
 
 	private void sendBytes(OmniPacket p) throws IOException {
-		ByteArrayOutputStream bout = new ByteArrayOutputStream();
-		DataOutputStream dout = new DataOutputStream(bout);
-		dout.writeShort(tx);
-		dout.writeByte(p.type());
-		dout.writeByte(0);
-		if(p.data() != null)
-			dout.write(p.data());
-		os.write(bout.toByteArray());
-		os.flush();
+		io.write(tx, p.type(), p.data());
+		nextTx();
+	}
+
+	private void nextTx(){
 		tx++;
 		if(tx >= 65535)
 			tx = 1;
@@ -410,8 +467,8 @@ public class Connection extends Thread {
 
 	private OmniPacket readBytesEncrypted() throws IOException, SocketTimeoutException {
 		OmniPacket p = readBytes();
-		if(debug)
-			System.out.println("Enc Dec " + bytesToString(p.data()));
+		if(tracing())
+			DebugLog.log("rx", "Enc Dec " + bytesToString(p.data()));
 		if(p.data().length == 0)
 			return p;
 		byte [] decData = aes.decrypt(p.data());
@@ -420,8 +477,8 @@ public class Connection extends Thread {
 			decData[0 + (16 * i)] ^= (p.seq >> 8) & 0xFF;
 			decData[1 + (16 * i)] ^= (p.seq) & 0xFF;
 		}
-		if(debug)
-			System.out.println("Data Dec " + bytesToString(decData));
+		if(tracing())
+			DebugLog.log("rx", "Data Dec " + bytesToString(decData));
 		return new OmniPacket(p.seq,p.type(), decData);
 
 	}
@@ -429,82 +486,37 @@ public class Connection extends Thread {
 	private OmniPacket readBytesEncrypted2() throws IOException, SocketTimeoutException{
 		//Notifications have thrown a bit of a curve ball, its possible to have
 		//two packets on the wire, but because the length of the packet
-		//is encrypted we have to peek into the first 16 bytes, decrypt those
-		//bytes and get the length, this makes the following code tricky and
-		//unattractive,
-		DataInputStream dis = new DataInputStream(is);
-
-		if(debug)
-			if(debug)System.out.println("readBytesEncrypted2: Bytes available for reading: " + is.available());
-
-		int seq = dis.readUnsignedShort();
-		int type = dis.readUnsignedByte();
-		int reserved = dis.readUnsignedByte();
-
-		byte [] encData = new byte [16];
-		dis.readFully(encData);
-		byte [] decData = aes.decrypt(encData);
-
-		decData[0]^=(seq >> 8) & 0xFF;
-		decData[1]^=(seq) & 0xFF;
-
-
-		//not all messages are omnilink
-		if(type != PACKET_TYPE_OMNI_LINK_MESSAGE) {
-			if(debug){
-				System.out.println("RX: " + bytesToString(decData));
-				System.out.println("NON OMNI LINK PACKET: " + type);
+		//is encrypted PacketIO has to decrypt the first 16 bytes to find
+		//out how many more to read. The packet returned shares its buffer
+		//with the next one read.
+		if(tracing())
+			DebugLog.log("rx", "readBytesEncrypted2: Bytes available for reading: " + io.available());
+
+		byte [] decData = io.readEncrypted();
+		rxPacket.set(io.seq(), io.type(), decData);
+
+		if(io.type() != PACKET_TYPE_OMNI_LINK_MESSAGE) {
+			if(tracing()){
+				DebugLog.log("rx", bytesToString(decData, io.length()));
+				DebugLog.log("rx", "NON OMNI LINK PACKET: " + io.type());
 			}
-			return new OmniPacket(seq,type,decData);
+			return rxPacket;
 		}
 
-		//continue with omnilink decoding
 		int start = (int) decData[0] & 0xFF;
-		int length = (int) decData[1] & 0xFF;
-
 		if(start != Message.MESG_START)
 			System.out.println("invalid start char (" + start + ")");
-		//throw new IOException("invalid start char (" + start + ")");
-		if(length < 0)
-			throw new IOException("invalid message length (" + length + ")");
-
-
-		if(debug)
-			System.out.println("readBytesEncrypted2: Omni message Length " + length);
-		//length plus start and crc fields, round up to next 16, minus the bytes we have already read
-		int readLength = ((((length+3)/16)+1)*16) -16;
-		if(debug)
-			System.out.println("readBytesEncrypted2: Additional bytes to read " + readLength);
-
-		if(readLength > 0){
-			//buffer for existing 16 bytes of data plus any on the wire
-			byte [] decData2 = new byte[decData.length + readLength];
-			encData = new byte[readLength];
-			//copy the data we already have from decData to decData2
-			System.arraycopy(decData, 0,decData2,0,decData.length);
-			//read the rest
-			dis.readFully(encData);
-			//add decrypted data to the buffer
-			aes.decrypt(encData,0,readLength,decData2,decData.length);
-			/* XOR data */
-			for (int i = 1; i < (decData2.length / 16); i++){
-				decData2[0 + (16 * i)] ^= (seq >> 8) & 0xFF;
-				decData2[1 + (16 * i)] ^= (seq) & 0xFF;
-			}
-			decData = decData2;
+		if(tracing()){
+			DebugLog.log("rx", "readBytesEncrypted2: Omni message Length " + (decData[1] & 0xFF));
+			DebugLog.log("rx", bytesToString(decData, io.length()));
+			DebugLog.log("rx", "readBytesEncrypted2: Data still available after read " + io.available());
 		}
-		if(debug)
-			System.out.println("RX: " + bytesToString(decData));
-
-		if(debug)
-			System.out.println("readBytesEncrypted2: Data still available after read " + is.available());
-		return new OmniPacket(seq,type,decData);
-
+		return rxPacket;
 	}
 
 	private OmniPacket readBytes() throws IOException, SocketTimeoutException {
 		byte[] data = new byte[MAX_PACKET_SIZE];
-		int cnt = is.read(data);
+		int cnt = io.read(data);
 
 		DataInputStream dis = new DataInputStream(new ByteArrayInputStream(data));
 
@@ -638,9 +650,9 @@ public class Connection extends Thread {
 			break;
 		}
 		int current = startObject;
-		int next = current;
+		int next;
 		while(current <= endObject){
-			next += 25;
+			next = current + 24;
 			if(next > endObject)
 				next = endObject;
 			Message msg = null;
@@ -653,9 +665,7 @@ public class Connection extends Thread {
 					msg.getMessageType() != Message.MESG_TYPE_EXT_OBJ_STATUS)
 				throw new OmniInvalidResponseException(msg);
 			System.arraycopy(((ObjectStatus)msg).getStatuses(), 0, s,current - startObject, next - current + 1 );
-			current = next;
-			if(current == endObject) break;
-			System.out.println("Current: " + current + " end " + endObject);
+			current = next + 1;
 		}
 		return new ObjectStatus(objectType,s);
 	}
@@ -753,8 +763,12 @@ public class Connection extends Thread {
 	}
 
 	private String bytesToString(byte[] bytes){
+		return bytesToString(bytes, bytes.length);
+	}
+
+	private String bytesToString(byte[] bytes, int length){
 		StringBuffer buff = new StringBuffer();
-		for(int i=0;i<bytes.length;i++){
+		for(int i=0;i<length;i++){
 			buff.append("0x");
 			buff.append(Integer.toString( ( bytes[i] & 0xff ) + 0x100, 16).substring( 1 ));
 			buff.append(" ");
@@ -778,11 +792,100 @@ public class Connection extends Thread {
 			this.data = data;
 		}
 
+		public void set(int seq, int type, byte[] data) {
+			this.seq = seq;
+			this.type = type;
+			this.data = data;
+		}
+
 		public int seq(){return seq;}
 		public int type(){return type;}
 		public byte[] data(){return data;}
 	}
 
+	/*
+	 * Called from the reader thread when the socket fails, and from the
+	 * watchdog when a keep-alive probe goes unanswered. Only the first
+	 * caller gets to tell the listeners.
+	 */
+	private void connectionLost(Exception e){
+		synchronized (disconnectLock) {
+			if(disconnectNotified)
+				return;
+			disconnectNotified = true;
+			silenceAtDisconnect = System.currentTimeMillis() - lastRXMessageTime;
+			connected = false;
+			lastException = e;
+		}
+		if(tracing())
+			DebugLog.log("connection", "connectionLost: " + e.getMessage() +
+					" (" + silenceAtDisconnect + " ms since last message)");
+		//unblocks the reader if it is stuck on a half open socket
+		try {
+			socket.close();
+		} catch (Exception ignored){}
+		//tell listeners about exception
+		notifyDisconnectHandlers(e);
+	}
+
+	/*
+	 * Pass a notification from the controller to the raw notification
+	 * listener if there is one, otherwise to the notification listeners,
+	 * unless the notification filter says it isn't wanted.
+	 */
+	private void handleNotification(byte[] data) throws IOException, OmniUnknownMessageTypeException{
+		RawNotificationListener raw = rawNotificationListener;
+		NotificationFilter filter = notificationFilter;
+		Message message = null;
+		if(raw == null || filter != null){
+			message = MessageFactory.fromBytes(data);
+			if(filter != null && !filter.wants(message)){
+				if(tracing())
+					DebugLog.log("notification", "run: NOTIFICATION: Filtered out message with type " + message.getMessageType());
+				return;
+			}
+		}
+		if(raw != null){
+			//the packet buffer gets reused, so pass a copy
+			int length = Math.min((data[1] & 0xFF) + 4, data.length);
+			raw.rawNotification(Arrays.copyOf(data, length));
+		} else {
+			addNotification(message);
+			if(tracing())
+				DebugLog.log("notification", "run: NOTIFICATION: Added message with type " + message.getMessageType());
+		}
+	}
+
+	private void addNotification(Message m){
+		synchronized (notifications) {
+			notifications.add(m);
+		}
+		synchronized (notifyLock) {
+			notifyLock.notifyAll();
+		}
+	}
+
+	/*
+	 * Keep-alive pings ask for the system status, so rather than throw
+	 * the answer away pass it along to the notification listeners.
+	 */
+	private void ping(){
+		try {
+			addNotification(reqSystemStatus());
+		} catch (Exception ignored){
+		}
+	}
+
+	private void sendProbe(){
+		Thread p = new Thread("KeepAliveProbe"){
+			public void run(){
+				ping();
+			}
+		};
+		p.setDaemon(true);
+		p.start();
+	}
+
 	private void notifyDisconnectHandlers(Exception e){
 		synchronized (disconnectListeners) {
 			for (DisconnectListener l : disconnectListeners) {
@@ -795,17 +898,33 @@ public class Connection extends Thread {
 		public void run(){
 			this.setName("ConnectionWatchdog");
 			while(connected){
-				if(ping &&
-						System.currentTimeMillis() >= PING_TO + lastTXMessageTime){
-					if(debug){
-						System.out.println("Pinging Server");
+				long now = System.currentTimeMillis();
+				if(keepAliveInterval > 0){
+					if(probeSentTime > 0){
+						if(lastRXMessageTime >= probeSentTime){
+							probeSentTime = 0;
+						} else if(now - probeSentTime >= keepAliveTimeout){
+							connectionLost(new IOException(
+									"No response to keep-alive probe in " +
+									keepAliveTimeout + " ms"));
+							break;
+						}
+					} else if(now - lastRXMessageTime >= keepAliveInterval){
+						if(tracing()){
+							DebugLog.log("keepalive", "Probing Server");
+						}
+						probeSentTime = now;
+						sendProbe();
+					}
+				} else if(ping &&
+						now >= PING_TO + lastTXMessageTime){
+					if(tracing()){
+						DebugLog.log("keepalive", "Pinging Server");
 					}
-					try {
-					reqSystemStatus();
-					} catch(Exception ignored){};
+					ping();
 				}
 				try {
-					sleep(1000);
+					sleep(WATCHDOG_TICK);
 				} catch (InterruptedException e) {}
 			}
 		}
@@ -828,10 +947,18 @@ public class Connection extends Thread {
 					synchronized (notificationListeners) {
 						for(Message m : messages){
 							for (NotificationListener l : notificationListeners) {
-								if(m instanceof ObjectStatus){
-									l.objectStausNotification((ObjectStatus)m);
-								} else {
-									l.otherEventNotification((OtherEventNotifications)m);
+								// A listener whose owner has gone away
+								// must not stop the others getting called
+								try {
+									if(m instanceof ObjectStatus){
+										l.objectStausNotification((ObjectStatus)m);
+									} else if(m instanceof SystemStatus){
+										l.systemStatusNotification((SystemStatus)m);
+									} else {
+										l.otherEventNotification((OtherEventNotifications)m);
+									}
+								} catch (RuntimeException e){
+									DebugLog.log("notification", "Listener failed: " + e);
 								}
 							}
 						}
@@ -0,0 +1,85 @@
+package com.digitaldan.jomnilinkII;
+
+/**
+*  Copyright (C) 2009  Dan Cunningham                                         
+*                                                                             
+* This program is free software; you can redistribute it and/or
+* modify it under the terms of the GNU General Public License
+* as published by the Free Software Foundation, version 2
+* of the License, or (at your option) any later version.
+*
+* This program is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with this program; if not, write to the Free Software
+* Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+*/
+
+import java.util.concurrent.ArrayBlockingQueue;
+
+/**
+ * Debug output from the library, collected in a bounded queue for the
+ * host program to drain in batches instead of being written to stdout.
+ * Nothing is formatted while it is disabled, and when the host doesn't
+ * keep up the newest records are dropped and counted.
+ *
+ * Records are drained as one string, a record per line, with the
+ * fields time in milliseconds, thread name, category and text separated
+ * by tabs.
+ */
+public class DebugLog {
+
+	public static final int CAPACITY = 2000;
+
+	private static volatile boolean enabled = false;
+	private static ArrayBlockingQueue<String> records = new ArrayBlockingQueue<String>(CAPACITY);
+	private static int dropped = 0;
+	private static final Object droppedLock = new Object();
+
+	public static boolean isEnabled(){
+		return enabled;
+	}
+
+	public static void setEnabled(boolean value){
+		enabled = value;
+		if(!value)
+			records.clear();
+	}
+
+	public static void log(String category, String text){
+		if(!enabled)
+			return;
+		String record = System.currentTimeMillis() + "\t" +
+				Thread.currentThread().getName() + "\t" + category + "\t" +
+				text.replace('\n', ' ').replace('\t', ' ');
+		if(!records.offer(record)){
+			synchronized (droppedLock) {
+				dropped++;
+			}
+		}
+	}
+
+	/*
+	 * Remove up to max records from the queue and return them. If any
+	 * were dropped since the last call, the first line says how many.
+	 */
+	public static String drain(int max){
+		StringBuilder buff = new StringBuilder();
+		synchronized (droppedLock) {
+			if(dropped > 0){
+				buff.append(System.currentTimeMillis()).append("\t")
+					.append(Thread.currentThread().getName())
+					.append("\tdropped\t").append(dropped).append("\n");
+				dropped = 0;
+			}
+		}
+		String record;
+		for(int i = 0; i < max && (record = records.poll()) != null; i++){
+			buff.append(record).append("\n");
+		}
+		return buff.toString();
+	}
+}
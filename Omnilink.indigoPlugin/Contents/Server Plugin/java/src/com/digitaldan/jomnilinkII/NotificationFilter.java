@@ -0,0 +1,83 @@
+package com.digitaldan.jomnilinkII;
+
+/**
+*  Copyright (C) 2009  Dan Cunningham                                         
+*                                                                             
+* This program is free software; you can redistribute it and/or
+* modify it under the terms of the GNU General Public License
+* as published by the Free Software Foundation, version 2
+* of the License, or (at your option) any later version.
+*
+* This program is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with this program; if not, write to the Free Software
+* Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+*/
+
+import java.util.HashMap;
+import java.util.Map;
+
+import com.digitaldan.jomnilinkII.MessageTypes.ObjectStatus;
+import com.digitaldan.jomnilinkII.MessageTypes.OtherEventNotifications;
+import com.digitaldan.jomnilinkII.MessageTypes.statuses.Status;
+
+/**
+ * Decides which notifications from the controller are worth passing
+ * along. It is built from a specification which lists the object types
+ * and ranges of object numbers wanted, separated by semicolons, with
+ * "events" to also pass along other event notifications, for example
+ * "events;1:1-8,12-12;2:1-40". Status notifications for any other
+ * objects are dropped. Other kinds of message, such as the answers to
+ * keep-alive probes, always get through.
+ */
+public class NotificationFilter {
+
+	//object type to pairs of first and last object numbers
+	private final Map<Integer, int[]> ranges = new HashMap<Integer, int[]>();
+	private boolean events;
+
+	public NotificationFilter(String spec){
+		for(String part : spec.split(";")){
+			part = part.trim();
+			if(part.length() == 0)
+				continue;
+			if(part.equals("events")){
+				events = true;
+				continue;
+			}
+			int colon = part.indexOf(':');
+			int type = Integer.parseInt(part.substring(0, colon));
+			String[] items = part.substring(colon + 1).split(",");
+			int[] pairs = new int[items.length * 2];
+			for(int i = 0; i < items.length; i++){
+				String[] ends = items[i].split("-");
+				pairs[2 * i] = Integer.parseInt(ends[0]);
+				pairs[2 * i + 1] = Integer.parseInt(ends[ends.length - 1]);
+			}
+			ranges.put(type, pairs);
+		}
+	}
+
+	public boolean wants(Message message){
+		if(message instanceof OtherEventNotifications)
+			return events;
+		if(!(message instanceof ObjectStatus))
+			return true;
+		ObjectStatus status = (ObjectStatus)message;
+		int[] pairs = ranges.get(status.getStatusType());
+		if(pairs == null)
+			return false;
+		for(Status s : status.getStatuses()){
+			int number = s.getNumber();
+			for(int i = 0; i < pairs.length; i += 2){
+				if(number >= pairs[i] && number <= pairs[i + 1])
+					return true;
+			}
+		}
+		return false;
+	}
+}
@@ -2,9 +2,12 @@ package com.digitaldan.jomnilinkII;
 
 import com.digitaldan.jomnilinkII.MessageTypes.ObjectStatus;
 import com.digitaldan.jomnilinkII.MessageTypes.OtherEventNotifications;
+import com.digitaldan.jomnilinkII.MessageTypes.SystemStatus;
 
 public interface NotificationListener {
 
 	public void objectStausNotification(ObjectStatus status);
 	public void otherEventNotification(OtherEventNotifications other);
+	//answers to the keep-alive status requests, delivered like notifications
+	public void systemStatusNotification(SystemStatus status);
 }
@@ -0,0 +1,166 @@
+package com.digitaldan.jomnilinkII;
+
+/**
+*  Copyright (C) 2009  Dan Cunningham                                         
+*                                                                             
+* This program is free software; you can redistribute it and/or
+* modify it under the terms of the GNU General Public License
+* as published by the Free Software Foundation, version 2
+* of the License, or (at your option) any later version.
+*
+* This program is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with this program; if not, write to the Free Software
+* Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+*/
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+
+/**
+ * Reads and writes Omni-Link II packets on a socket's streams through
+ * buffered streams and reused buffers, so that a burst of notifications
+ * doesn't allocate a stream and several arrays per packet.
+ *
+ * The array returned by readEncrypted is reused by the next read, so
+ * callers must be done with it before reading again.
+ */
+public class PacketIO {
+
+	public static final int HEADER_SIZE = 4;
+	//start, length, type and up to 254 data bytes, and 2 CRC bytes,
+	//padded to whole AES blocks
+	public static final int MAX_DATA_SIZE = ((255 + 4 + 15) / 16) * 16;
+	private static final int BLOCK = 16;
+	private static final int PACKET_TYPE_OMNI_LINK_MESSAGE = 32;
+
+	private InputStream in;
+	private OutputStream out;
+	private Aes aes;
+	private byte [] header = new byte[HEADER_SIZE];
+	private byte [] rxData = new byte[MAX_DATA_SIZE];
+	private byte [] txPacket = new byte[HEADER_SIZE + MAX_DATA_SIZE];
+	private int rxSeq;
+	private int rxType;
+	private int rxLength;
+
+	public PacketIO(InputStream in, OutputStream out){
+		this.in = new BufferedInputStream(in, 4096);
+		this.out = new BufferedOutputStream(out, HEADER_SIZE + MAX_DATA_SIZE);
+	}
+
+	public void setAes(Aes aes){
+		this.aes = aes;
+	}
+
+	public int seq(){return rxSeq;}
+	public int type(){return rxType;}
+	public int length(){return rxLength;}
+
+	public int available() throws IOException{
+		return in.available();
+	}
+
+	/*
+	 * Read whatever arrives next, unframed, for the unencrypted packets
+	 * of the session handshake.
+	 */
+	public int read(byte [] data) throws IOException{
+		return in.read(data, 0, data.length);
+	}
+
+	/*
+	 * Read one encrypted packet and decrypt it in place. The length of
+	 * an Omni-Link message is in its first encrypted block, so decrypt
+	 * that first to find out how much more to read. Returns the reused
+	 * receive buffer; seq(), type() and length() describe its contents.
+	 */
+	public byte [] readEncrypted() throws IOException{
+		readFully(header, 0, HEADER_SIZE);
+		rxSeq = ((header[0] & 0xFF) << 8) | (header[1] & 0xFF);
+		rxType = header[2] & 0xFF;
+
+		readFully(rxData, 0, BLOCK);
+		decrypt(0, BLOCK);
+		rxLength = BLOCK;
+		if(rxType != PACKET_TYPE_OMNI_LINK_MESSAGE)
+			return rxData;
+
+		//length plus start, length and crc fields, rounded up to whole blocks
+		int length = rxData[1] & 0xFF;
+		int total = ((length + 4 + BLOCK - 1) / BLOCK) * BLOCK;
+		if(total > BLOCK){
+			readFully(rxData, BLOCK, total - BLOCK);
+			decrypt(BLOCK, total - BLOCK);
+			rxLength = total;
+		}
+		return rxData;
+	}
+
+	private void decrypt(int offset, int len) throws IOException{
+		aes.decrypt(rxData, offset, len, rxData, offset);
+		for(int i = offset; i < offset + len; i += BLOCK){
+			rxData[i] ^= (rxSeq >> 8) & 0xFF;
+			rxData[i + 1] ^= rxSeq & 0xFF;
+		}
+	}
+
+	private void readFully(byte [] buf, int offset, int len) throws IOException{
+		while(len > 0){
+			int count = in.read(buf, offset, len);
+			if(count < 0)
+				throw new EOFException("Connection closed by controller");
+			offset += count;
+			len -= count;
+		}
+	}
+
+	/*
+	 * Pad data with zeros to whole blocks, scramble the first two bytes
+	 * of each block with the sequence number, encrypt it in place and
+	 * send it.
+	 */
+	public void writeEncrypted(int seq, int type, byte [] data) throws IOException{
+		int length = (data.length + BLOCK - 1) & ~(BLOCK - 1);
+		if(length > MAX_DATA_SIZE)
+			throw new IOException("message too long (" + data.length + ")");
+		System.arraycopy(data, 0, txPacket, HEADER_SIZE, data.length);
+		for(int i = HEADER_SIZE + data.length; i < HEADER_SIZE + length; i++)
+			txPacket[i] = 0;
+		for(int i = HEADER_SIZE; i < HEADER_SIZE + length; i += BLOCK){
+			txPacket[i] ^= (seq >> 8) & 0xFF;
+			txPacket[i + 1] ^= seq & 0xFF;
+		}
+		aes.encrypt(txPacket, HEADER_SIZE, length, txPacket, HEADER_SIZE);
+		send(seq, type, length);
+	}
+
+	/*
+	 * Send an unencrypted packet, for the session handshake.
+	 */
+	public void write(int seq, int type, byte [] data) throws IOException{
+		int length = 0;
+		if(data != null){
+			length = data.length;
+			System.arraycopy(data, 0, txPacket, HEADER_SIZE, length);
+		}
+		send(seq, type, length);
+	}
+
+	private void send(int seq, int type, int length) throws IOException{
+		txPacket[0] = (byte)(seq >> 8);
+		txPacket[1] = (byte)seq;
+		txPacket[2] = (byte)type;
+		txPacket[3] = 0;
+		out.write(txPacket, 0, HEADER_SIZE + length);
+		out.flush();
+	}
+}
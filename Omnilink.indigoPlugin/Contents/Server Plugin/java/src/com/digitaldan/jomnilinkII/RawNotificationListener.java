@@ -0,0 +1,29 @@
+package com.digitaldan.jomnilinkII;
+
+/**
+*  Copyright (C) 2009  Dan Cunningham                                         
+*                                                                             
+* This program is free software; you can redistribute it and/or
+* modify it under the terms of the GNU General Public License
+* as published by the Free Software Foundation, version 2
+* of the License, or (at your option) any later version.
+*
+* This program is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with this program; if not, write to the Free Software
+* Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+*/
+
+/**
+ * Receives notifications from the controller as the raw message bytes,
+ * start character through CRC, without them being decoded. It is called
+ * on the connection's reader thread, so it must not block.
+ */
+public interface RawNotificationListener {
+
+	public void rawNotification(byte[] message);
+}
@@ -0,0 +1,100 @@
+/*
+    NotificationSource.java. Generate unit status notifications for
+    test/bench_notifications.py and test/bench_soak.py, to compare the
+    ways of getting them to Python and check that they don't leak,
+    without needing a controller.
+
+    Copyright (C) 2016 Gemini Lasswell
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+package me.gazally.bench;
+
+import java.io.IOException;
+import java.lang.reflect.Field;
+
+import py4j.Gateway;
+import py4j.GatewayServer;
+
+import com.digitaldan.jomnilinkII.MessageFactory;
+import com.digitaldan.jomnilinkII.NotificationListener;
+import com.digitaldan.jomnilinkII.MessageTypes.ObjectStatus;
+
+import me.gazally.main.MainEntryPoint;
+import me.gazally.main.NotificationStream;
+
+public class NotificationSource {
+
+    public NotificationSource() {
+    }
+
+    /* A status notification for one unit: start, length, message
+       type, object type, unit number, status, time, and a CRC. */
+    static byte[] unitNotification(int number) {
+        byte[] message = new byte[2 + 1 + 1 + 5 + 2];
+        message[0] = 0x21;
+        message[1] = (byte) (1 + 1 + 5);
+        message[2] = 0x23;
+        message[3] = 0x02;
+        message[4] = (byte) (number >> 8);
+        message[5] = (byte) number;
+        message[6] = 1;
+        return message;
+    }
+
+    /* Decode count notifications and call listener with each of them,
+       the way Connection's notification handler does. */
+    public void toListener(NotificationListener listener, int count)
+        throws Exception {
+        for (int i = 0; i < count; i++) {
+            listener.objectStausNotification((ObjectStatus) MessageFactory
+                .fromBytes(unitNotification(i % 511 + 1)));
+        }
+    }
+
+    /* Bytes of heap in use, after asking for a garbage collection. */
+    public long usedHeap() {
+        System.gc();
+        Runtime runtime = Runtime.getRuntime();
+        return runtime.totalMemory() - runtime.freeMemory();
+    }
+
+    /* Number of objects the gateway is holding on to for Python.
+       py4j 0.9.1's GatewayServer keeps its Gateway to itself. */
+    public int gatewayObjects() throws Exception {
+        Field field = GatewayServer.class.getDeclaredField("gateway");
+        field.setAccessible(true);
+        Gateway gateway = (Gateway) field.get(MainEntryPoint.gatewayServer);
+        return gateway.getBindings().size();
+    }
+
+    /* Open a notification stream, and send count notifications to it
+       from another thread. Returns the port to connect to. */
+    public int toStream(final int count) throws IOException {
+        final NotificationStream stream = new NotificationStream(null);
+        stream.start();
+        Thread feeder = new Thread("NotificationSource") {
+            public void run() {
+                for (int i = 0; i < count; i++) {
+                    stream.rawNotification(unitNotification(i % 511 + 1));
+                }
+                stream.close();
+            }
+        };
+        feeder.setDaemon(true);
+        feeder.start();
+        return stream.port();
+    }
+}
@@ -0,0 +1,102 @@
+/*
+    PacketIOBenchmark.java. Measure how many packets per second PacketIO
+    can encrypt and decrypt, using in-memory streams in place of a socket.
+
+    Copyright (C) 2016 Gemini Lasswell
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+package me.gazally.bench;
+
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+
+import com.digitaldan.jomnilinkII.Aes;
+import com.digitaldan.jomnilinkII.PacketIO;
+
+public class PacketIOBenchmark {
+
+    private static final int OMNI_LINK_MESSAGE = 32;
+
+    /* Discards everything written to it, like a socket nobody reads. */
+    private static class NullOutputStream extends OutputStream {
+        public void write(int b) {}
+        public void write(byte[] b, int off, int len) {}
+    }
+
+    public static void main(String[] args) throws Exception {
+        int packets = args.length > 0 ? Integer.parseInt(args[0]) : 200000;
+        Aes aes = new Aes(new byte[16]);
+
+        // A zone status notification for 8 zones: start, length,
+        // message type, 4 bytes per zone, and a CRC.
+        byte[] message = new byte[2 + 1 + 8 * 4 + 2];
+        message[0] = 0x21;
+        message[1] = (byte) (1 + 8 * 4);
+        message[2] = 0x23;
+
+        // Writing
+        PacketIO writer = new PacketIO(new ByteArrayInputStream(new byte[0]),
+                                       new NullOutputStream());
+        writer.setAes(aes);
+        report("write", packets, timeWrites(writer, message, packets));
+
+        // Reading, from a buffer of packets encrypted ahead of time
+        ByteArrayOutputStream wire = new ByteArrayOutputStream();
+        PacketIO encoder = new PacketIO(new ByteArrayInputStream(new byte[0]), wire);
+        encoder.setAes(aes);
+        for (int i = 0; i < packets; i++) {
+            encoder.writeEncrypted(0, OMNI_LINK_MESSAGE, message);
+        }
+        byte[] recorded = wire.toByteArray();
+        for (int pass = 0; pass < 2; pass++) { // the first pass warms up the JIT
+            PacketIO reader = new PacketIO(new ByteArrayInputStream(recorded),
+                                           new NullOutputStream());
+            reader.setAes(aes);
+            long elapsed = timeReads(reader, packets);
+            if (pass == 1) {
+                report("read", packets, elapsed);
+            }
+        }
+    }
+
+    private static long timeWrites(PacketIO writer, byte[] message, int packets)
+        throws IOException {
+        long start = System.nanoTime();
+        for (int i = 0; i < packets; i++) {
+            writer.writeEncrypted(i & 0xFFFF, OMNI_LINK_MESSAGE, message);
+        }
+        return System.nanoTime() - start;
+    }
+
+    private static long timeReads(PacketIO reader, int packets) throws IOException {
+        long start = System.nanoTime();
+        for (int i = 0; i < packets; i++) {
+            byte[] data = reader.readEncrypted();
+            if (data[0] != 0x21) {
+                throw new IOException("corrupt packet " + i);
+            }
+        }
+        return System.nanoTime() - start;
+    }
+
+    private static void report(String what, int packets, long nanos) {
+        System.out.println(String.format("%s: %d packets in %.3f s, %.0f packets/s",
+                                         what, packets, nanos / 1e9,
+                                         packets / (nanos / 1e9)));
+    }
+}
@@ -19,18 +19,207 @@
 
 package me.gazally.main;
 
+import java.io.File;
+import java.io.IOException;
+import java.util.Enumeration;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.jar.JarEntry;
+import java.util.jar.JarFile;
+
 import py4j.GatewayServer;
 
+import com.digitaldan.jomnilinkII.Connection;
+import com.digitaldan.jomnilinkII.DebugLog;
+import com.digitaldan.jomnilinkII.MessageTypes.CommandMessage;
+
 public class MainEntryPoint {
 
     public static GatewayServer gatewayServer;
 
+    /* When run as a sidecar, the connections Python has opened, keyed by
+       address:port, so that the next run of the plugin can take them
+       over. Each entry holds the encryption key and the connection. */
+    private static final Map<String, Object[]> connections =
+        new HashMap<String, Object[]>();
+
+    /* When run as a sidecar, the time at which to quit unless Python
+       renews the lease. */
+    private static volatile long leaseExpires = Long.MAX_VALUE;
+
     public MainEntryPoint() {
     }
 
+    /* Answered as soon as the gateway is listening, which is how
+       Python finds out that startup is finished. */
+    public boolean ping() {
+        return true;
+    }
+
+    /* Turn jomnilinkII's debug output on or off. */
+    public void setDebug(boolean enabled) {
+        DebugLog.setEnabled(enabled);
+    }
+
+    /* Return up to max lines of jomnilinkII's debug output. */
+    public String drainDebugLog(int max) {
+        return DebugLog.drain(max);
+    }
+
+    /* Have connection send its notifications over a socket of their
+       own instead of calling its notification listeners. Returns the
+       loopback port to connect to, which must be done within 10
+       seconds. */
+    public int openNotificationStream(Connection connection)
+        throws IOException {
+        NotificationStream stream = new NotificationStream(connection);
+        connection.setRawNotificationListener(stream);
+        stream.start();
+        return stream.port();
+    }
+
+    /* Send connection a batch of commands, one per line, each the name
+       of a CommandMessage constant followed by its two parameters, in
+       order. Returns a line for each command, empty if the controller
+       acknowledged it, otherwise the error. A failed command doesn't
+       stop the ones after it. */
+    public String controllerCommands(Connection connection, String batch) {
+        StringBuilder results = new StringBuilder();
+        String[] lines = batch.split("\n");
+        for (int i = 0; i < lines.length; i++) {
+            if (i > 0) {
+                results.append('\n');
+            }
+            try {
+                String[] fields = lines[i].trim().split(" ");
+                int command = CommandMessage.class.getField(fields[0])
+                    .getInt(null);
+                connection.controllerCommand(command,
+                                             Integer.parseInt(fields[1]),
+                                             Integer.parseInt(fields[2]));
+            } catch (Exception e) {
+                results.append(e.toString().replace('\n', ' '));
+            }
+        }
+        return results.toString();
+    }
+
+    /* Remember a connection so that existingConnection can hand it to
+       the next run of the plugin. Disconnects any other connection
+       registered for the same controller. */
+    public void register(String address, int port, String key,
+                         Connection connection) {
+        Object[] old;
+        synchronized (connections) {
+            old = connections.put(address + ":" + port,
+                                  new Object[] {key, connection});
+        }
+        if (old != null && old[1] != connection) {
+            ((Connection) old[1]).disconnect();
+        }
+    }
+
+    /* Return the registered connection to the controller at address:port,
+       if it is still up and uses the same key, or null. */
+    public Connection existingConnection(String address, int port,
+                                         String key) {
+        Object[] entry;
+        synchronized (connections) {
+            entry = connections.get(address + ":" + port);
+        }
+        if (entry == null || !entry[0].equals(key)) {
+            return null;
+        }
+        Connection connection = (Connection) entry[1];
+        return connection.connected() ? connection : null;
+    }
+
+    /* Python is going away, so stop calling its listeners. The
+       connections stay up for the next run of the plugin. */
+    public void detach() {
+        synchronized (connections) {
+            for (Object[] entry : connections.values()) {
+                ((Connection) entry[1]).removeAllListeners();
+            }
+        }
+    }
+
+    /* Keep running for at least another seconds seconds. */
+    public void renewLease(int seconds) {
+        leaseExpires = System.currentTimeMillis() + seconds * 1000L;
+    }
+
+    /* Quit when the lease runs out, which is what happens to a sidecar
+       once the plugin stops using it. */
+    private static void startLeaseWatchdog() {
+        Thread watchdog = new Thread("LeaseWatchdog") {
+            public void run() {
+                while (System.currentTimeMillis() < leaseExpires) {
+                    try {
+                        Thread.sleep(1000);
+                    } catch (InterruptedException ignored) {
+                    }
+                }
+                System.out.println("Lease expired, shutting down");
+                synchronized (connections) {
+                    for (Object[] entry : connections.values()) {
+                        ((Connection) entry[1]).disconnect();
+                    }
+                }
+                gatewayServer.shutdown();
+                System.exit(0);
+            }
+        };
+        watchdog.setDaemon(true);
+        watchdog.start();
+    }
+
+    /* Load the jomnilinkII classes from our jar before opening the
+       gateway, so that the first requests from Python don't wait for
+       class loading. Returns the number of classes loaded. */
+    static int preloadClasses() {
+        String prefix = "com/digitaldan/jomnilinkII/";
+        int count = 0;
+        try {
+            File location = new File(MainEntryPoint.class.getProtectionDomain()
+                                     .getCodeSource().getLocation().toURI());
+            if (!location.isFile()) {
+                return 0; // running from a classes directory
+            }
+            JarFile jar = new JarFile(location);
+            try {
+                Enumeration<JarEntry> entries = jar.entries();
+                while (entries.hasMoreElements()) {
+                    String name = entries.nextElement().getName();
+                    if (name.startsWith(prefix) && name.endsWith(".class") &&
+                        !name.startsWith(prefix + "examples/")) {
+                        try {
+                            Class.forName(name.substring(0, name.length() - 6)
+                                          .replace('/', '.'));
+                            count++;
+                        } catch (Throwable ignored) {
+                        }
+                    }
+                }
+            } finally {
+                jar.close();
+            }
+        } catch (Exception ignored) {
+        }
+        return count;
+    }
+
+    /* Arguments: --lease seconds to run as a sidecar, which quits if
+       Python doesn't renew its lease in time. */
     public static void main(String[] args) {
-        gatewayServer = new GatewayServer(new MainEntryPoint());
+        preloadClasses();
+        MainEntryPoint entryPoint = new MainEntryPoint();
+        gatewayServer = new GatewayServer(entryPoint);
         gatewayServer.start();
+        if (args.length == 2 && args[0].equals("--lease")) {
+            entryPoint.renewLease(Integer.parseInt(args[1]));
+            startLeaseWatchdog();
+        }
         System.out.println("Java Gateway Server Started");
     }
 }
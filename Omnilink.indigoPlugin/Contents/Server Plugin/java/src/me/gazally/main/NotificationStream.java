@@ -0,0 +1,129 @@
+/*
+    NotificationStream.java. Send a controller's notifications to Python
+    as raw Omni-Link messages over a socket of their own.
+
+    Copyright (C) 2016 Gemini Lasswell
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+package me.gazally.main;
+
+import java.io.BufferedOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.LinkedBlockingQueue;
+import java.util.concurrent.TimeUnit;
+
+import com.digitaldan.jomnilinkII.Connection;
+import com.digitaldan.jomnilinkII.DebugLog;
+import com.digitaldan.jomnilinkII.RawNotificationListener;
+
+/* Listens on a loopback port for one client, and writes each message
+   to it preceded by its length as two bytes, big-endian. Messages that
+   arrive while the writer is busy are sent together in one write.
+   Messages that arrive before the client connects are kept until it
+   does. The stream ends when the client goes away, the connection to
+   the controller is lost, or the connection gets a different raw
+   notification listener. */
+public class NotificationStream extends Thread
+    implements RawNotificationListener {
+
+    private static final int ACCEPT_TIMEOUT = 10000;
+    private static final int BATCH = 64;
+
+    private final Connection connection;
+    private final ServerSocket server;
+    private final LinkedBlockingQueue<byte[]> queue =
+        new LinkedBlockingQueue<byte[]>();
+    private volatile boolean closed;
+
+    /* connection may be null, for a stream that is fed by calling
+       rawNotification directly. */
+    public NotificationStream(Connection connection) throws IOException {
+        super("NotificationStream");
+        setDaemon(true);
+        this.connection = connection;
+        server = new ServerSocket(0, 1, InetAddress.getByName(null));
+        server.setSoTimeout(ACCEPT_TIMEOUT);
+    }
+
+    public int port() {
+        return server.getLocalPort();
+    }
+
+    public void rawNotification(byte[] message) {
+        if (!closed) {
+            queue.add(message);
+        }
+    }
+
+    /* Send what has been queued, then end the stream. */
+    public void close() {
+        closed = true;
+    }
+
+    private boolean finished() {
+        return closed || (connection != null &&
+                          (!connection.connected() ||
+                           connection.getRawNotificationListener() != this));
+    }
+
+    public void run() {
+        Socket client = null;
+        try {
+            client = server.accept();
+            client.setTcpNoDelay(true);
+            OutputStream out = new BufferedOutputStream(
+                client.getOutputStream(), 8192);
+            List<byte[]> batch = new ArrayList<byte[]>(BATCH);
+            while (!finished() || !queue.isEmpty()) {
+                byte[] first = queue.poll(1, TimeUnit.SECONDS);
+                if (first == null) {
+                    continue;
+                }
+                batch.add(first);
+                queue.drainTo(batch, BATCH - 1);
+                for (byte[] message : batch) {
+                    out.write(message.length >> 8);
+                    out.write(message.length);
+                    out.write(message);
+                }
+                out.flush();
+                batch.clear();
+            }
+        } catch (Exception e) {
+            DebugLog.log("notification", "NotificationStream: " + e);
+        } finally {
+            closed = true;
+            // Go back to the notification listeners
+            if (connection != null &&
+                connection.getRawNotificationListener() == this) {
+                connection.setRawNotificationListener(null);
+            }
+            try {
+                server.close();
+                if (client != null) {
+                    client.close();
+                }
+            } catch (IOException ignored) {
+            }
+        }
+    }
+}
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Background writer for the Leviton/HAI Omni plugin's log messages """
+
+import Queue as queue
+import threading
+
+# Most messages waiting to be written before new ones are dropped
+_MAXSIZE = 5000
+
+# Most messages to collect for one trip to the Indigo server
+_BATCH = 100
+
+
+class LogWriter(object):
+    """ Pass log messages to Indigo from a thread of their own.
+
+    Indigo's debugLog and errorLog are calls to the Indigo server, which
+    would otherwise be made by whichever thread is doing the logging.
+    Here that thread only puts the message on a queue, and a writer
+    thread takes them off in batches, joining runs of messages of the
+    same level into one call. If the queue fills up, new messages are
+    dropped and counted, and the count is written when there is room.
+
+    Public attributes:
+        dropped -- number of messages dropped and not yet reported
+        synchronous -- if True, write messages immediately on the calling
+                       thread instead
+
+    Public methods:
+        write -- queue a message
+        flush -- wait until everything queued has been written
+        close -- flush and stop the writer thread
+    """
+    def __init__(self, debug_log, error_log, maxsize=_MAXSIZE,
+                 batch=_BATCH):
+        self.debug_log, self.error_log = debug_log, error_log
+        self.queue = queue.Queue(maxsize)
+        self.batch = batch
+        self.dropped = 0
+        self.synchronous = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def write(self, msg, error=False):
+        """ Queue a message for Indigo's debugLog, or for its errorLog
+        if error is True. Never blocks. """
+        if self.synchronous:
+            self._write([(error, msg)])
+            return
+        self._start()
+        try:
+            self.queue.put_nowait((error, msg))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        """ Wait for the writer thread to write everything queued so far.
+        """
+        if self._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        """ Write what is left and stop the writer thread. Messages that
+        come after this are written immediately. """
+        self.synchronous = True
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    t = threading.Thread(target=self._run, name="Log Writer")
+                    t.setDaemon(True)
+                    t.start()
+                    self._thread = t
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self.queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in items:
+                stop = True
+            self._write([item for item in items if item is not None])
+            for item in items:
+                self.queue.task_done()
+
+    def _write(self, items):
+        """ Write a list of (error, msg) tuples, joining runs of the same
+        level into one call. """
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            items = [(True, "Logging fell behind, {0} messages were "
+                      "dropped".format(dropped))] + items
+
+        run, run_is_error = [], None
+        for error, msg in items + [(None, None)]:
+            if run and error != run_is_error:
+                log_func = self.error_log if run_is_error else self.debug_log
+                try:
+                    log_func("\n".join(run))
+                except Exception:
+                    pass  # nowhere left to report it
+                run = []
+            run.append(msg)
+            run_is_error = error
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Decoder for raw Omni-Link II notification messages, and copier of
+jomnilinkII's, for Leviton/HAI Omni plugin for IndigoServer """
+
+import struct
+
+# Omni-Link II message types and object types, the same as in
+# jomnilinkII's Message class
+MESG_START = 0x21
+MESG_TYPE_OBJ_STATUS = 0x23
+MESG_TYPE_OTHER_EVENT_NOTIFY = 0x37
+MESG_TYPE_EXT_OBJ_STATUS = 0x3B
+
+OBJ_TYPE_ZONE = 0x01
+OBJ_TYPE_UNIT = 0x02
+OBJ_TYPE_AREA = 0x05
+
+
+class Status(object):
+    """ A status record from an object status message. Subclasses
+    list the names of their fields and a struct format to unpack them
+    with, and have the same getters as jomnilinkII's status classes, so
+    that the extensions can't tell them apart.
+    """
+    fields = ["number"]
+    record = ">H"
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def copy(cls, status):
+        """ Make one of these out of the jomnilinkII status object of the
+        same kind, by calling its getters. """
+        return cls(*[getattr(status, getter_name(name))()
+                     for name in cls.fields])
+
+    def getNumber(self):
+        return self.number
+
+
+class ZoneStatus(Status):
+    fields = ["number", "status", "loop"]
+    record = ">HBB"
+
+    def getStatus(self):
+        return self.status
+
+    def getLoop(self):
+        return self.loop
+
+
+class UnitStatus(Status):
+    fields = ["number", "status", "time"]
+    record = ">HBH"
+
+    def getStatus(self):
+        return self.status
+
+    def getTime(self):
+        return self.time
+
+
+class AreaStatus(Status):
+    fields = ["number", "mode", "alarms", "entry_timer", "exit_timer"]
+    record = ">HBBBB"
+
+    def getMode(self):
+        return self.mode
+
+    def getAlarms(self):
+        return self.alarms
+
+    def getEntryTimer(self):
+        return self.entry_timer
+
+    def getExitTimer(self):
+        return self.exit_timer
+
+
+_STATUS_CLASSES = {OBJ_TYPE_ZONE: ZoneStatus,
+                   OBJ_TYPE_UNIT: UnitStatus,
+                   OBJ_TYPE_AREA: AreaStatus}
+
+
+class ObjectStatus(object):
+    def __init__(self, status_type, statuses):
+        self.status_type, self.statuses = status_type, statuses
+
+    def getStatusType(self):
+        return self.status_type
+
+    def getStatuses(self):
+        return self.statuses
+
+
+class OtherEventNotifications(object):
+    def __init__(self, notifications):
+        self.notifications = notifications
+
+    def getNotifications(self):
+        return self.notifications
+
+
+class SystemStatus(object):
+    """ The parts of jomnilinkII's SystemStatus that the controller
+    extension reads: the battery, the clock and the areas in alarm. """
+    fields = ["battery_reading", "year", "month", "day", "hour", "minute",
+              "second"]
+
+    def __init__(self, time_date_valid, alarms, *values):
+        self.time_date_valid, self.alarms = time_date_valid, alarms
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def isTimeDateValid(self):
+        return self.time_date_valid
+
+    def getAlarms(self):
+        return self.alarms
+
+    def getBatteryReading(self):
+        return self.battery_reading
+
+    def getYear(self):
+        return self.year
+
+    def getMonth(self):
+        return self.month
+
+    def getDay(self):
+        return self.day
+
+    def getHour(self):
+        return self.hour
+
+    def getMinute(self):
+        return self.minute
+
+    def getSecond(self):
+        return self.second
+
+
+def getter_name(field):
+    """ Return the name of the jomnilinkII getter for a field, for
+    example getEntryTimer for entry_timer. """
+    return "get" + "".join(word.capitalize() for word in field.split("_"))
+
+
+def copy_object_status(status_msg, classes):
+    """ Copy a jomnilinkII ObjectStatus, or anything with the same
+    getters, given a dictionary of Status subclasses indexed by status
+    type. The copy of a status type not in the dictionary has no
+    statuses. Return the copy and a list of the objects that were read,
+    so that the caller can release them.
+    """
+    status_type = status_msg.getStatusType()
+    cls = classes.get(status_type)
+    if cls is None:
+        return ObjectStatus(status_type, []), [status_msg]
+    records = status_msg.getStatuses()
+    read = list(records)
+    statuses = [cls.copy(r) for r in read if r is not None]
+    return (ObjectStatus(status_type, statuses),
+            [status_msg, records] + [r for r in read if r is not None])
+
+
+def copy_other_events(other):
+    """ Copy a jomnilinkII OtherEventNotifications. Return the copy
+    and a list of the objects that were read. """
+    notifications = other.getNotifications()
+    return (OtherEventNotifications(list(notifications)),
+            [other, notifications])
+
+
+def copy_system_status(status):
+    """ Copy a jomnilinkII SystemStatus. Return the copy and a list of
+    the objects that were read. """
+    alarms = status.getAlarms()
+    values = [getattr(status, getter_name(name))()
+              for name in SystemStatus.fields]
+    return (SystemStatus(status.isTimeDateValid(),
+                         dict(alarms) if alarms else {}, *values),
+            [status, alarms])
+
+
+def decode(message):
+    """ Given the bytes of an Omni-Link II message, from the start
+    character through the CRC, return a tuple of the notification event
+    type ("status" or "event") and an object that looks like the one
+    jomnilinkII would have made out of it. Return None for messages
+    that aren't notifications or are about objects that the extensions
+    don't handle. Raises struct.error or ValueError if the message is
+    garbled.
+    """
+    start, length, mesg_type = struct.unpack_from(">BBB", message)
+    if start != MESG_START or len(message) < length + 2:
+        raise ValueError("Not an Omni-Link II message")
+    data = message[3:length + 2]
+
+    if mesg_type == MESG_TYPE_OTHER_EVENT_NOTIFY:
+        count = len(data) // 2
+        return "event", OtherEventNotifications(
+            list(struct.unpack(">{0}H".format(count), data[:count * 2])))
+
+    if mesg_type == MESG_TYPE_OBJ_STATUS:
+        status_type = ord(data[0])
+        cls = _STATUS_CLASSES.get(status_type)
+        if cls is None:
+            return None
+        size = struct.calcsize(cls.record)
+        offset = 1
+    elif mesg_type == MESG_TYPE_EXT_OBJ_STATUS:
+        status_type, size = struct.unpack_from(">BB", data)
+        cls = _STATUS_CLASSES.get(status_type)
+        if cls is None:
+            return None
+        if size < struct.calcsize(cls.record):
+            raise ValueError("Extended status records too short")
+        offset = 2
+    else:
+        return None
+
+    statuses = []
+    while offset + struct.calcsize(cls.record) <= len(data):
+        statuses.append(cls(*struct.unpack_from(cls.record, data, offset)))
+        offset += size
+    return "status", ObjectStatus(status_type, statuses)
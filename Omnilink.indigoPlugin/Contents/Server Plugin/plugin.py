@@ -20,9 +20,11 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import defaultdict
 from distutils.version import StrictVersion
 import glob
 import imp
+import json
 import logging
 import os
 import re
@@ -35,11 +37,35 @@ from termapp_server import start_shell_thread
 
 import connection
 from connection import Connection, ConnectionError
+from diagnostics import LatencyStats
 from keychain import KeyChain
+from logwriter import LogWriter
+from scheduler import PollScheduler, number_ranges
 import extensions
 
 _SLEEP = 0.1
 
+# Lists what each extension_*.py module provides, see load_extensions
+_MANIFEST = "extensions.json"
+
+# Indigo callbacks which get passed along to the extension which owns
+# the device, action or event type, by selector
+_DISPATCHED = {
+    "device": ["getDeviceConfigUiValues", "validateDeviceConfigUi",
+               "closedDeviceConfigUi", "deviceStartComm", "deviceStopComm",
+               "deviceCreated", "deviceDeleted", "deviceUpdated",
+               "getDeviceStateList", "getDeviceDisplayStateId",
+               "didDeviceCommPropertyChange", "actionControlGeneral",
+               "actionControlDimmerRelay", "actionControlSensor",
+               "actionControlSpeedControl", "actionControlThermostat",
+               "actionControlIO", "actionControlSprinkler"],
+    "action": ["getActionConfigUiValues", "validateActionConfigUi",
+               "closedActionConfigUi"],
+    "event": ["getEventConfigUiValues", "validateEventConfigUi",
+              "closedEventConfigUi", "triggerStartProcessing",
+              "triggerStopProcessing", "didTriggerProcessingPropertyChange",
+              "triggerCreated", "triggerUpdated", "triggerDeleted"]}
+
 log = logging.getLogger(__name__)
 
 # TODO - Make it possible to change the ports used for Py4J
@@ -61,6 +87,7 @@ class Plugin(indigo.PluginBase):
         self.plugin_id = plugin_id
         self.debug = prefs.get("showDebugInfo", False)
         self.debug_omni = prefs.get("showJomnilinkIIDebugInfo", False)
+        self.log_writer = LogWriter(self.debugLog, self.errorLog)
         self.configure_logging()
         if (StrictVersion(prefs.get("configVersion", "0.0")) <
                 StrictVersion(version)):
@@ -69,14 +96,27 @@ class Plugin(indigo.PluginBase):
 
         self.connections = {}
         self.keychain = KeyChain(plugin_id)
+        self.set_keep_alive(prefs)
+        self.scheduler = PollScheduler()
 
         self.extensions = []
+        self.manifest = {}
+        self.loaded_extensions = {}
+        # Indigo calls back on more than one thread, so importing an
+        # extension is done under this lock
+        self.extension_lock = threading.RLock()
+        self.report_map = {}
         self.type_ids_map = {"device": {},
                              "event": {},
                              "action": {}}
+        self.dispatch_table = {}
+        self.callback_stats = None
+        # urls of controllers whose devices have started or stopped
+        self.stale_subscriptions = set()
 
         self.notifications = {"status": [],
                               "event": [],
+                              "system_status": [],
                               "disconnect": [],
                               "reconnect": []}
 
@@ -84,16 +124,55 @@ class Plugin(indigo.PluginBase):
 
     def startup(self):
         log.debug("Startup called")
-        stdout, stderr = Connection.startup(timeout=5)
+        # The Java runtime gets started when the first connection needs it
+        Connection.on_java_ready = self.java_started
+        self.set_java_options(self.pluginPrefs)
+        self.set_omni_logging_level()
+
+    def set_java_options(self, values):
+        """ Tell Connection where to keep Java's class data sharing
+        archive, or not to use one, whether to run Java as a sidecar, how
+        to get notifications from it and handle them, and how many
+        connections to make to its gateway, according to a preferences
+        dictionary. Takes effect the next time Java is started, or for
+        notifications, the next time a controller is connected. """
+        if values.get("javaClassSharing", True):
+            Connection.class_archive = self.data_path("classes.jsa")
+        else:
+            Connection.class_archive = None
+        Connection.sidecar = values.get("javaSidecar", False)
+        Connection.sidecar_log = self.data_path("java.log")
+        Connection.stream_notifications = values.get("notificationStream",
+                                                     False)
+        Connection.workers = values.get("notificationWorkers", False)
+        try:
+            Connection.pool_size = int(values.get("gatewayPoolSize",
+                                                  Connection.pool_size))
+            Connection.pool_wait = float(values.get("gatewayPoolWait",
+                                                    Connection.pool_wait))
+        except ValueError:
+            log.debug("Invalid gateway pool settings", exc_info=True)
+
+    def java_started(self, stdout, stderr):
+        """ Called on the Java startup thread when the gateway is up. """
         self.start_omni_logging(stdout, stderr)
+        self.set_omni_logging_level()
 
     def shutdown(self):
         log.debug("Shutdown called")
+        for ext in self.extensions:
+            ext.shutdown()
         Connection.shutdown()
+        self.log_writer.close()
 
     def update(self):
         for conn in self.connections.values():
             conn.update()
+        self.update_subscriptions()
+        Connection.renew_lease()
+        if self.debug_omni:
+            self.write_omni_debug_log()
+        self.scheduler.run()
         for ext in self.extensions:
             ext.update()
 
@@ -109,58 +188,106 @@ class Plugin(indigo.PluginBase):
     # ----- This plugin has its own plugins ----- #
 
     def load_extensions(self):
-        """ Look in the current directory (which Indigo sets to the
-        Server Plugin directory before starting the plugin) for python
-        files of the form extension_*.py. Import each one, and then
-        call extend_plugin (see below) with each subclass of PluginExtension
-        found during the import process.
+        """ Read the extension manifest from the current directory (which
+        Indigo sets to the Server Plugin directory before starting the
+        plugin). For each extension_*.py module it lists the name of its
+        PluginExtension subclass and the type ids, callbacks and reports
+        the class provides. Register those, so that the module gets
+        imported and its extension created by get_extension the first
+        time one of them is used, instead of at startup.
         """
         extensions.PluginExtension.plugin = self
         extensions.PluginExtensionRegistrar.clear()
 
-        directory = os.getcwd()
-        files = glob.glob("extension_*.py")
-        if files is not None:
-            for item in files:
-                log.debug("Importing " + item)
-                name, ext = os.path.splitext(item)
-                try:
-                    file, filename, data = imp.find_module(name, [directory])
-                    imp.load_module(name, file, filename, data)
-                    self.configure_logger(logging.getLogger(name),
-                                          prefix=name[len("extension_"):],
-                                          propagate=False)
-                except Exception:
-                    log.error("Error while importing {0}".format(item),
-                              exc_info=True)
-
-        for cls in extensions.PluginExtensionRegistrar.registry:
-            log.debug("Extending plugin with " + cls.__name__)
-            self.extend_plugin(cls)
+        try:
+            with open(_MANIFEST) as f:
+                self.manifest = json.load(f)
+        except (IOError, ValueError):
+            log.error("Unable to read " + _MANIFEST, exc_info=True)
+            return
+
+        for name, entry in self.manifest.items():
+            for thing, type_ids in entry["type_ids"].items():
+                for type_id in type_ids:
+                    self.type_ids_map[thing][type_id] = name
+            for report in entry["reports"]:
+                self.report_map[report] = name
+            for callback in entry["callbacks"]:
+                if hasattr(self, callback):
+                    log.error("Extension {0} redefined {1}".format(
+                        entry["class"], callback))
+                setattr(self, callback, self.lazy_callback(name, callback))
+
+    def lazy_callback(self, name, callback):
+        """ Return a function to stand in for a user interface callback
+        until its extension is loaded. """
+        def load_and_call(*args, **kwargs):
+            ext = self.get_extension(name)
+            if ext is not None:
+                return ext.callbacks[callback](*args, **kwargs)
+        return load_and_call
+
+    def get_extension(self, name):
+        """ Return the extension from the module name, importing the module
+        and creating the extension if that hasn't been done yet. Return
+        None if the import fails. """
+        if name in self.loaded_extensions:
+            return self.loaded_extensions[name]
+
+        with self.extension_lock:
+            if name in self.loaded_extensions:
+                return self.loaded_extensions[name]
+            log.debug("Importing " + name)
+            ext = None
+            try:
+                file, filename, data = imp.find_module(name, [os.getcwd()])
+                module = imp.load_module(name, file, filename, data)
+                self.configure_logger(logging.getLogger(name),
+                                      prefix=name[len("extension_"):],
+                                      propagate=False)
+                ext = self.extend_plugin(getattr(
+                    module, self.manifest[name]["class"]))
+            except Exception:
+                log.error("Error while importing {0}".format(name),
+                          exc_info=True)
+            self.loaded_extensions[name] = ext
+            return ext
+
+    def extension_for(self, selector, type_id):
+        """ Return the extension which handles a device, action or event
+        type id, loading it if necessary. """
+        return self.get_extension(self.type_ids_map[selector][type_id])
+
+    def load_all_extensions(self):
+        """ Load every extension in the manifest and return a list of
+        them. """
+        return [ext for ext in (self.get_extension(name)
+                                for name in sorted(self.manifest))
+                if ext is not None]
 
     def extend_plugin(self, cls):
         """ Given a subclass of PluginExtension, add its functionality to
-        this plugin instance.
+        this plugin instance, and return the new extension.
 
         See extensions.py for details.
         """
+        log.debug("Extending plugin with " + cls.__name__)
         ext = cls()
         self.extensions.append(ext)
         for name, func in ext.callbacks.items():
-            if hasattr(self, name):
-                log.error("Extension {0} redefined {1}".format(cls.__name__,
-                                                               name))
             setattr(self, name, func)
 
         if ext.type_ids is not None:
             for thing, type_ids in ext.type_ids.items():
                 for type_id in type_ids:
-                    self.type_ids_map[thing][type_id] = ext
+                    self.compile_dispatch(thing, type_id, ext)
 
-        for ntype in ["status", "event", "disconnect", "reconnect"]:
+        for ntype in ["status", "event", "system_status", "disconnect",
+                      "reconnect"]:
             method = ntype + "_notification"
             if hasattr(ext, method):
                 self.notifications[ntype].append(getattr(ext, method))
+        return ext
 
     # ----- Management of Connection objects ----- #
 
@@ -193,6 +320,41 @@ class Plugin(indigo.PluginBase):
         self.connections[url] = c
         return c
 
+    def update_subscriptions(self):
+        """ Collect the notifications the extensions want from each
+        controller whose devices have started or stopped since the last
+        call, and tell its connection. """
+        while self.stale_subscriptions:
+            url = self.stale_subscriptions.pop()
+            if url not in self.connections:
+                continue
+            numbers = defaultdict(set)
+            events = False
+            for ext in self.extensions:
+                for key, value in ext.subscriptions(url).items():
+                    if key == "events":
+                        events = events or bool(value)
+                    else:
+                        numbers[key].update(value)
+            subscriptions = dict((obj_type, number_ranges(nums, max_gap=0))
+                                 for obj_type, nums in numbers.items())
+            subscriptions["events"] = events
+            self.connections[url].set_subscriptions(subscriptions)
+
+    def set_keep_alive(self, values):
+        """ Read the liveness probe settings from a preferences dictionary
+        and pass them along to the Connection class and to every existing
+        connection.
+        """
+        interval = float(values.get("keepAliveInterval",
+                                    Connection.keep_alive_interval))
+        timeout = float(values.get("keepAliveTimeout",
+                                   Connection.keep_alive_timeout))
+        Connection.keep_alive_interval = interval
+        Connection.keep_alive_timeout = timeout
+        for c in self.connections.values():
+            c.set_keep_alive(interval, timeout)
+
     def did_connection_succeed(self, params):
         """ Use this to find out if the connection you just tried to make
         worked. Don't count on it to tell you if the next thing you're going
@@ -229,16 +391,18 @@ class Plugin(indigo.PluginBase):
         self.configure_logger(self.log_omni)
         self.set_omni_logging_level()
 
-        for name in ["connection", "keychain", "termapp_server"]:
+        for name in ["connection", "eventlog", "gatewaypool", "keychain",
+                     "scheduler", "termapp_server"]:
             self.configure_logger(logging.getLogger(name))
 
     def configure_logger(self, logger, level=logging.DEBUG, prefix="",
                          propagate=False):
-        """ Create a Handler subclass for the logging module that uses the
-        logging methods supplied to the plugin by Indigo. Prepend the thread
-        name to the message if not in the main thread.
+        """ Create a Handler subclass for the logging module that passes
+        messages to the plugin's LogWriter, which writes them with the
+        logging methods supplied to the plugin by Indigo. Prepend the
+        thread name to the message if not in the main thread.
         """
-        def make_handler(debugLog, errorLog, prefix=""):
+        def make_handler(log_writer, prefix=""):
             class NewHandler(logging.Handler):
                 def emit(self, record):
                     try:
@@ -250,10 +414,8 @@ class Plugin(indigo.PluginBase):
                             elif "Thread" in threadname:  # py4j callback
                                 threadname = "Notify"
                             msg = ("[{0}] {1}".format(threadname, msg))
-                        if record.levelno < logging.WARNING:
-                            debugLog(msg)
-                        else:
-                            errorLog(msg)
+                        log_writer.write(msg,
+                                         record.levelno >= logging.WARNING)
                     except Exception:
                         self.handleError(record)
             handler = NewHandler()
@@ -262,8 +424,7 @@ class Plugin(indigo.PluginBase):
             handler.setFormatter(logging.Formatter(prefix + "%(message)s"))
             return handler
 
-        logger.addHandler(make_handler(self.debugLog, self.errorLog,
-                                       prefix))
+        logger.addHandler(make_handler(self.log_writer, prefix))
         logger.setLevel(level)
         if propagate is not None:
             logger.propagate = propagate
@@ -274,6 +435,21 @@ class Plugin(indigo.PluginBase):
             self.log_omni.setLevel(logging.DEBUG)
         else:
             self.log_omni.setLevel(logging.ERROR)
+        Connection.set_debug(self.debug_omni)
+
+    def write_omni_debug_log(self):
+        """ Fetch the debug output jomnilinkII has collected since the
+        last call and log it as one message. """
+        lines = []
+        for r in Connection.drain_debug_log():
+            if r.category == "dropped":
+                text = "{0} debug records dropped".format(r.text)
+            else:
+                text = "{0}: {1}".format(r.category, r.text)
+            lines.append("{0} [{1}] {2}".format(
+                r.time.strftime("%H:%M:%S.%f")[:-3], r.thread, text))
+        if lines:
+            self.log_omni.debug("\n".join(lines))
 
     def start_omni_logging(self, stdout, stderr):
         """ Connect the output pipes of our connection subprocess to threads
@@ -300,6 +476,15 @@ class Plugin(indigo.PluginBase):
                 break
             logger.log(level, line.strip())
 
+    def data_path(self, filename):
+        """ Return the path to a file in the folder Indigo provides
+        for this plugin's data, creating the folder if necessary. """
+        folder = os.path.join(indigo.server.getInstallFolderPath(),
+                              "Preferences", "Plugins", self.plugin_id)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return os.path.join(folder, filename)
+
     # ----- Preferences UI ----- #
 
     def validatePrefsConfigUi(self, values):
@@ -313,13 +498,45 @@ class Plugin(indigo.PluginBase):
         if self.debug:
             if not debug:
                 log.debug("Turning off debug logging")
+                self.log_writer.flush()  # before debugLog stops printing
         self.debug = debug
         log.debug("Debug logging is on")  # won't print if not self.debug
 
         self.debug_omni = values.get("showJomnilinkIIDebugInfo", False)
         self.set_omni_logging_level()
+
+        for key in ["keepAliveInterval", "keepAliveTimeout",
+                    "gatewayPoolWait", "unitCommandInterval",
+                    "holdCommandsTime", "unitTimerGranularity"]:
+            if not self.is_valid_seconds(values.get(key, "0")):
+                errors[key] = "Please enter a number of seconds."
+        if ("keepAliveInterval" not in errors and
+                "keepAliveTimeout" not in errors and
+                float(values.get("keepAliveInterval", "0")) > 0 and
+                float(values.get("keepAliveTimeout", "0")) <= 0):
+            errors["keepAliveTimeout"] = ("Please allow some time for the "
+                                          "controller to answer.")
+        if not self.is_valid_pool_size(values.get("gatewayPoolSize", "8")):
+            errors["gatewayPoolSize"] = "Please enter a whole number from 1."
+        if not errors:
+            self.set_java_options(values)
+            self.set_keep_alive(values)
         return not errors, values, errors
 
+    @staticmethod
+    def is_valid_pool_size(value):
+        try:
+            return int(value) >= 1
+        except ValueError:
+            return False
+
+    @staticmethod
+    def is_valid_seconds(value):
+        try:
+            return float(value) >= 0
+        except ValueError:
+            return False
+
     # ----- Device Factory UI ----- #
 
     hidden = "\u2022" * 15
@@ -352,6 +569,7 @@ class Plugin(indigo.PluginBase):
 
         errors = self.checkConnectionParameters(values)
         if not errors:
+            Connection.wait_for_java()
             self.make_connection(self.make_url(values),
                                  values["encryptionKey1"],
                                  values["encryptionKey2"])
@@ -379,6 +597,9 @@ class Plugin(indigo.PluginBase):
 
         errors = self.checkConnectionParameters(values)
         if not errors and not values["isConnected"]:
+            # The user is waiting for an answer, so give Java a chance
+            # to start before connecting
+            Connection.wait_for_java()
             self.make_connection(self.make_url(values),
                                  values["encryptionKey1"],
                                  values["encryptionKey2"])
@@ -466,7 +687,7 @@ class Plugin(indigo.PluginBase):
         if ("isConnected" in values and values["isConnected"] and
                 self.did_connection_succeed(values)):
             url = self.make_url(values)
-            for ext in self.extensions:
+            for ext in self.load_all_extensions():
                 results.extend(ext.getDeviceList(url, dev_ids))
 
         return sorted(results, key=lambda tup: tup[1])
@@ -478,7 +699,7 @@ class Plugin(indigo.PluginBase):
         devices.
         """
         for dev_type in values["deviceGroupList"]:
-            ext = self.type_ids_map["device"][dev_type]
+            ext = self.extension_for("device", dev_type)
             props = {"url": self.make_url(values),
                      "prefix": values["prefix"]}
             ext.createDevices(dev_type, props, values["prefix"], dev_ids)
@@ -505,6 +726,7 @@ class Plugin(indigo.PluginBase):
         """ Called by the Indigo UI for the Toggle Debugging menu item. """
         if self.debug:
             log.debug("Turning off debug logging")
+            self.log_writer.flush()  # before debugLog stops printing
         self.debug = not self.debug
         log.debug("Turning on debug logging")  # won't print if !self.debug
         self.pluginPrefs["showDebugInfo"] = self.debug
@@ -570,10 +792,12 @@ class Plugin(indigo.PluginBase):
                              valuesDict, userCancelled, typeId, devId)
 
     def deviceStartComm(self, dev):
+        self.stale_subscriptions.add(dev.pluginProps.get("url"))
         return self.dispatch("deviceStartComm", "device", dev.deviceTypeId,
                              dev)
 
     def deviceStopComm(self, dev):
+        self.stale_subscriptions.add(dev.pluginProps.get("url"))
         return self.dispatch("deviceStopComm", "device", dev.deviceTypeId,
                              dev)
 
@@ -667,16 +891,107 @@ class Plugin(indigo.PluginBase):
                              trigger)
 
     def dispatch(self, name, selector, type_id, *args):
+        try:
+            func = self.dispatch_table[(name, selector, type_id)]
+        except KeyError:
+            func = self.resolve_dispatch(name, selector, type_id)
+        return func(*args)
+
+    def resolve_dispatch(self, name, selector, type_id):
+        """ Called on the first use of a type id. Load its extension,
+        which fills in its dispatch table entries. If that doesn't
+        provide one for this call, cache PluginBase's. """
         if type_id in self.type_ids_map[selector]:
-            ext = self.type_ids_map[selector][type_id]
-            if hasattr(ext, name):
-                return getattr(ext, name)(*args)
-        elif type_id:
-            log.debug("No matching plugin extension found for {0} {1} "
-                      "method {2}".format(selector, type_id, name))
+            self.extension_for(selector, type_id)
+        key = (name, selector, type_id)
+        if key not in self.dispatch_table:
+            if type_id:
+                log.debug("No matching plugin extension found for {0} {1} "
+                          "method {2}".format(selector, type_id, name))
+            self.dispatch_table[key] = self.resolve_callback(name, None)
+        return self.dispatch_table[key]
+
+    def compile_dispatch(self, selector, type_id, ext):
+        """ Fill in the dispatch table entries for one type id, so that
+        dispatch doesn't have to look anything up when Indigo calls. """
+        for name in _DISPATCHED[selector]:
+            self.dispatch_table[(name, selector, type_id)] = (
+                self.resolve_callback(name, ext))
+
+    def resolve_callback(self, name, ext):
+        """ Return the method of the extension ext which implements the
+        Indigo callback name, or if there isn't one, PluginBase's,
+        or if there isn't one of those either, a function which does
+        nothing. If callback timing is on, wrap it to be timed. """
+        if ext is not None and hasattr(ext, name):
+            func, owner = getattr(ext, name), type(ext).__name__
+        elif hasattr(indigo.PluginBase, name):
+            func, owner = getattr(super(Plugin, self), name), "PluginBase"
+        else:
+            func, owner = (lambda *args: None), "PluginBase"
+        if self.callback_stats is not None:
+            func = self.callback_stats.timed((owner, name), func)
+        return func
 
-        if hasattr(indigo.PluginBase, name):
-            return getattr(indigo.PluginBase, name)(self, *args)
+    # ----- Timing of Indigo callbacks (Menu Items) ----- #
+
+    def toggleCallbackTiming(self):
+        """ Called by the Indigo UI for the Toggle Timing of Indigo
+        Callbacks menu item. Rebuild the dispatch table with or without
+        timing wrappers, so that it costs nothing when it's off.
+        """
+        if self.callback_stats is None:
+            log.debug("Turning on timing of Indigo callbacks")
+            self.callback_stats = LatencyStats()
+        else:
+            log.debug("Turning off timing of Indigo callbacks")
+            self.callback_stats = None
+        self.dispatch_table = {}
+        for ext in self.extensions:
+            if ext.type_ids is not None:
+                for selector, type_ids in ext.type_ids.items():
+                    for type_id in type_ids:
+                        self.compile_dispatch(selector, type_id, ext)
+
+    def writeCallbackTimingToLog(self):
+        """ Called by the Indigo UI for the Write Timing of Indigo
+        Callbacks to Log menu item.
+        """
+        self.say("Timing of Indigo Callbacks", title=True)
+        if self.callback_stats is None:
+            self.say("Timing is turned off.")
+            return
+        lines = self.callback_stats.report()
+        if not lines:
+            self.say("No callbacks have been timed yet.")
+        for line in lines:
+            self.say(line)
+
+    def writeGatewayStatsToLog(self):
+        """ Called by the Indigo UI for the Write Java Gateway Statistics
+        to Log menu item.
+        """
+        self.say("Java Gateway Connections", title=True)
+        lines = Connection.gateway_stats()
+        if not lines:
+            self.say("Java is not running.")
+        for line in lines:
+            self.say(line)
+
+    def writeNotificationLagToLog(self):
+        """ Called by the Indigo UI for the Write Notification Lag to Log
+        menu item. For each controller, report how many notifications are
+        waiting and how long they have been taking to get handled.
+        """
+        self.say("Notification Lag", title=True)
+        for url, c in sorted(self.connections.items()):
+            self.say("{0}: {1} waiting".format(
+                url, c.notification_queue.qsize()))
+        lines = Connection.lag_stats.report()
+        if not lines:
+            self.say("No notifications have been handled yet.")
+        for line in lines:
+            self.say(line)
 
     # ----- Write info on connected controllers to log (Menu Item)  ----- #
 
@@ -687,12 +1002,17 @@ class Plugin(indigo.PluginBase):
         for c in self.connections.values():
             if not c.is_connected():
                 msg = "OMNI Controller at {0} is not connected ".format(c.ip)
-                if c.javaproc is None:
+                if c.javaproc is None and not c.java_is_sidecar:
                     msg = msg + ("because the Java subprocess could not be "
                                  "started.")
                 elif c.gateway is None:
                     msg = msg + ("because the gateway between Python and Java "
                                  "could not be started.")
+                elif c.javaproc is None:
+                    msg = msg + ("because it did not respond to the Java "
+                                 "subprocess left running by the last run of "
+                                 "the plugin, or because the IP address, "
+                                 "port or encryption keys are not correct.")
                 else:
                     msg = msg + ("because it did not respond, or because the "
                                  "IP address, port or encryption keys are "
@@ -732,8 +1052,9 @@ class Plugin(indigo.PluginBase):
         def not_implemented(report, c, say):
             say("Not Implemented")
 
-        for ext in self.extensions:
-            if report in ext.reports:
+        if report in self.report_map:
+            ext = self.get_extension(self.report_map[report])
+            if ext is not None and report in ext.reports:
                 return ext.reports[report]
         if report in self.standard_queries.keys():
             return self.query_and_print
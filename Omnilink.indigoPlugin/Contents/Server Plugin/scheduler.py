@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+# A plugin for Indigo Server to communicate with HAI/Leviton OMNI systems
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Polling scheduler for Leviton/HAI Omni plugin for IndigoServer """
+
+from collections import defaultdict
+import logging
+import math
+import random
+import threading
+import time
+
+from py4j.protocol import Py4JError
+
+from connection import ConnectionError
+
+log = logging.getLogger(__name__)
+
+# Adaptive intervals shrink by this factor when a poll finds a change,
+# and grow by _BACKOFF when it doesn't.
+_SPEEDUP = 0.5
+_BACKOFF = 1.5
+
+# Objects that jomnilinkII fetches in one request in a ranged status
+# query. Ranges of object numbers are split at gaps wider than this.
+_STATUS_CHUNK = 25
+
+# Largest fraction of its interval that a controller's jobs are delayed,
+# so that several controllers don't get polled in lockstep.
+_JITTER = 0.1
+
+# Seconds early a job may be polled, to join others for the same
+# controller and object type which are due now
+_MERGE_WINDOW = 2
+
+
+class PollJob(object):
+    """ A request to poll a range of objects of one type on one controller
+    at regular intervals.
+
+    Public attributes:
+        url -- address of the controller
+        obj_type -- anything hashable identifying the kind of object
+        first, last -- range of object numbers, inclusive
+        interval -- current number of seconds between polls
+        poll -- function to call, see PollScheduler.add
+    """
+    def __init__(self, url, obj_type, first, last, interval, poll,
+                 min_interval, max_interval):
+        self.url, self.obj_type = url, obj_type
+        self.first, self.last = first, last
+        self.interval, self.poll = interval, poll
+        self.min_interval, self.max_interval = min_interval, max_interval
+        self.due = None
+        self.cancelled = False
+
+
+class PollScheduler(object):
+    """ A hashed timer wheel for polling the Omni controllers for things
+    that don't send reliable notifications.
+
+    Jobs for the same controller, object type and poll function which
+    come due together, or within _MERGE_WINDOW seconds of each other, are
+    merged, so their objects get fetched with one ranged request. Jobs
+    which were merged adapt their intervals together, so they stay merged.
+
+    Jobs may be added and removed from any thread, including from a poll
+    function or a notification worker while run is in progress.
+
+    Public methods:
+        add -- schedule a new job
+        remove -- cancel a job
+        run -- poll whatever is due. Call this often, from the update loop.
+    """
+    def __init__(self, tick=1.0, slots=64, clock=time.time):
+        self.tick = tick
+        self.wheel = [[] for i in range(slots)]
+        self.clock = clock
+        self.jobs = set()
+        self.phase = {}
+        self._last_tick = self._now()
+        # Guards the wheel, jobs and phase. Polling is done without it.
+        self.lock = threading.RLock()
+
+    def add(self, url, obj_type, first, last, interval, poll,
+            min_interval=None, max_interval=None):
+        """ Schedule a job and return it. poll will be called like this:
+
+            poll(url, obj_type, first, last)
+
+        possibly with a wider range than the job asked for if it got merged
+        with other jobs. It should update the Indigo devices and return a
+        collection of the object numbers that it found had changed.
+        If min_interval and max_interval are given, the interval will
+        adjust between them depending on how often things change.
+        """
+        job = PollJob(url, obj_type, first, last, interval, poll,
+                      interval if min_interval is None else min_interval,
+                      interval if max_interval is None else max_interval)
+        with self.lock:
+            if url not in self.phase:
+                self.phase[url] = random.uniform(0, _JITTER)
+            self.jobs.add(job)
+            self._schedule(job)
+        return job
+
+    def remove(self, job):
+        """ Cancel a job. It will be dropped from the wheel when its slot
+        comes around. """
+        with self.lock:
+            job.cancelled = True
+            self.jobs.discard(job)
+
+    def _now(self):
+        return int(self.clock() / self.tick)
+
+    def _schedule(self, job):
+        """ Put a job in the wheel. Call with the lock held. """
+        delay = job.interval * (1 + self.phase[job.url])
+        job.due = self._now() + max(1, int(math.ceil(delay / self.tick)))
+        self.wheel[job.due % len(self.wheel)].append(job)
+
+    def run(self):
+        """ Advance the wheel to the current time and poll all the jobs
+        which have come due. """
+        with self.lock:
+            now = self._now()
+            ticks = min(now - self._last_tick, len(self.wheel))
+            due = []
+            for i in range(ticks):
+                slot = self.wheel[(self._last_tick + 1 + i) % len(self.wheel)]
+                due.extend(j for j in slot if j.due <= now and not j.cancelled)
+                slot[:] = [j for j in slot if j.due > now and not j.cancelled]
+            self._last_tick = now
+            if not due:
+                return
+
+            groups = defaultdict(list)
+            for job in due:
+                groups[(job.url, job.obj_type, job.poll)].append(job)
+            for (url, obj_type, poll), jobs in groups.items():
+                jobs.extend(self._take_early(url, obj_type, poll, now))
+
+        for (url, obj_type, poll), jobs in groups.items():
+            for first, last, members in merge_ranges(jobs):
+                changed = self._poll(poll, url, obj_type, first, last)
+                with self.lock:
+                    if changed is not None:
+                        adapt(members, changed)
+                    for job in members:
+                        if not job.cancelled:
+                            self._schedule(job)
+
+    def _take_early(self, url, obj_type, poll, now):
+        """ Remove the jobs for a controller, object type and poll function
+        which will come due within _MERGE_WINDOW seconds from the wheel,
+        and return them. Call with the lock held. """
+        early = []
+        window = int(_MERGE_WINDOW / self.tick)
+        for due in range(now + 1, now + 1 + min(window, len(self.wheel))):
+            slot = self.wheel[due % len(self.wheel)]
+            for job in [j for j in slot if j.due == due and not j.cancelled and
+                        (j.url, j.obj_type, j.poll) == (url, obj_type, poll)]:
+                slot.remove(job)
+                early.append(job)
+        return early
+
+    def _poll(self, poll, url, obj_type, first, last):
+        """ Call a poll function, and return what it returns, or None
+        if it fails. """
+        log.debug("Polling {0} {1}-{2} on {3}".format(obj_type, first, last,
+                                                      url))
+        try:
+            return poll(url, obj_type, first, last)
+        except (Py4JError, ConnectionError):
+            log.debug("Poll failed", exc_info=True)
+        except Exception:
+            log.error("Error while polling {0} on {1}".format(obj_type, url),
+                      exc_info=True)
+        return None
+
+
+def adapt(jobs, changed):
+    """ Given a list of jobs which were polled together and a collection
+    of the object numbers found to have changed, poll them all more often
+    if any of the numbers are theirs and less often if not. They all
+    start from the shortest of their intervals, so that they stay
+    together. """
+    if any(job.first <= n <= job.last for job in jobs for n in changed):
+        interval = min(job.interval for job in jobs) * _SPEEDUP
+    else:
+        interval = min(job.interval for job in jobs) * _BACKOFF
+    for job in jobs:
+        job.interval = min(job.max_interval, max(job.min_interval, interval))
+
+
+def merge_ranges(jobs, max_gap=0):
+    """ Given a list of jobs, sort them and combine the ones whose ranges
+    overlap or are no more than max_gap apart. Return a list of tuples
+    (first, last, list of jobs).
+    """
+    merged = []
+    for job in sorted(jobs, key=lambda j: (j.first, j.last)):
+        if merged and job.first <= merged[-1][1] + max_gap + 1:
+            first, last, members = merged[-1]
+            merged[-1] = (first, max(last, job.last), members + [job])
+        else:
+            merged.append((job.first, job.last, [job]))
+    return merged
+
+
+def number_ranges(numbers, max_gap=_STATUS_CHUNK):
+    """ Given a collection of object numbers, return a sorted list of
+    (first, last) tuples covering them, split wherever the numbers are
+    more than max_gap apart, so that they can be fetched with a few ranged
+    requests.
+    """
+    ranges = []
+    for n in sorted(set(numbers)):
+        if ranges and n <= ranges[-1][1] + max_gap + 1:
+            ranges[-1] = (ranges[-1][0], n)
+        else:
+            ranges.append((n, n))
+    return ranges
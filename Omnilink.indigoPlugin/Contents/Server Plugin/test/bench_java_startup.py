@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# Java startup benchmark for the Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Measure the time from launching the Java runtime to the answer to the
+first reqSystemInformation from a controller, with and without the
+startup tuning and class data sharing archive.
+
+Run it from the Server Plugin directory, on a machine with the bundled
+Java runtime and a controller to talk to:
+
+    python test/bench_java_startup.py ip port key [runs]
+
+Every run is a fresh Python process. The class data sharing archive is
+created in a temporary directory before the first run of the tuned mode,
+and not counted.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+_CHILD = """
+import sys
+import time
+
+import connection
+from connection import Connection
+
+mode, archive, ip, port, key = sys.argv[1:6]
+if mode == "plain":
+    connection._JAVA_TUNING = []
+else:
+    Connection.class_archive = archive
+    Connection._make_class_archive()
+
+start = time.time()
+try:
+    Connection.startup(timeout=30)
+    ready = time.time()
+    notifications = dict((k, []) for k in ["status", "event", "system_status",
+                                           "disconnect", "reconnect"])
+    c = Connection(ip, int(port), key, notifications)
+    c.omni.reqSystemInformation()
+    done = time.time()
+finally:
+    Connection.shutdown()
+print(ready - start, done - start)
+"""
+
+
+def run(mode, archive, ip, port, key):
+    output = subprocess.check_output([sys.executable, "-c", _CHILD, mode,
+                                      archive, ip, port, key])
+    ready, done = output.split()[-2:]
+    return float(ready), float(done)
+
+
+def main():
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    ip, port, key = sys.argv[1:4]
+    runs = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    folder = tempfile.mkdtemp()
+    try:
+        archive = os.path.join(folder, "classes.jsa")
+        for mode in ["plain", "tuned"]:
+            results = sorted(run(mode, archive, ip, port, key)
+                             for i in range(runs))
+            ready, done = results[len(results) // 2]
+            print("{0}: gateway ready in {1:.0f} ms, first "
+                  "reqSystemInformation answered in {2:.0f} ms "
+                  "(median of {3} runs)".format(mode, ready * 1000,
+                                               done * 1000, runs))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
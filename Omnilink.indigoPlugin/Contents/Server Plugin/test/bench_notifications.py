@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# Notification throughput benchmark for the Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Measure how many unit status notifications per second get from Java
+to Python and read the way the unit extension reads them, using py4j
+callbacks and using the notification stream.
+
+Run it from the Server Plugin directory, on a machine with the bundled
+Java runtime. No controller is needed, the notifications are made up
+by me.gazally.bench.NotificationSource:
+
+    python test/bench_notifications.py [count]
+"""
+from __future__ import print_function
+
+import Queue as queue
+import sys
+import time
+
+from connection import (Connection, NotificationListener,
+                        NotificationStream)
+import omni_messages
+
+STATUS_CLASSES = {omni_messages.OBJ_TYPE_UNIT: omni_messages.UnitStatus}
+
+
+def read(status_msg):
+    """ Get everything out of a status message that the unit extension
+    does. """
+    status_msg.getStatusType()
+    status = status_msg.getStatuses()[0]
+    return status.getNumber(), status.getStatus(), status.getTime()
+
+
+def consume(q, count):
+    for i in range(count):
+        read(q.get(timeout=30).data)
+
+
+def bench_callbacks(source, count):
+    q = queue.Queue()
+    start = time.time()
+    source.toListener(NotificationListener(q, STATUS_CLASSES), count)
+    consume(q, count)
+    return time.time() - start
+
+
+def bench_stream(source, count):
+    q = queue.Queue()
+    start = time.time()
+    stream = NotificationStream(source.toStream(count), q)
+    consume(q, count)
+    elapsed = time.time() - start
+    stream.close()
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    Connection.startup(timeout=30)
+    try:
+        source = Connection.gateway.jvm.me.gazally.bench.NotificationSource()
+        for name, bench in [("callbacks", bench_callbacks),
+                            ("stream", bench_stream)]:
+            bench(source, count // 10)  # warm up
+            elapsed = bench(source, count)
+            print("{0}: {1} notifications in {2:.2f} s, {3:.0f} per "
+                  "second".format(name, count, elapsed, count / elapsed))
+    finally:
+        Connection.shutdown()
+
+
+if __name__ == "__main__":
+    main()
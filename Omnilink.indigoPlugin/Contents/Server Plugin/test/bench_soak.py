@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# Memory soak test for the Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Push a lot of unit status notifications from Java to Python, both
+with py4j callbacks and with the notification stream, and check that
+neither side's memory grows: the Java heap after garbage collection,
+the count of objects the gateway holds for Python, Python's count of
+live objects, and py4j's count of proxy finalizers.
+
+Run it from the Server Plugin directory, on a machine with the bundled
+Java runtime. No controller is needed, the notifications are made up
+by me.gazally.bench.NotificationSource:
+
+    python test/bench_soak.py [count]
+
+The default count is a million. It exits with status 1 if anything
+grew more than it should have.
+"""
+from __future__ import print_function
+
+import gc
+import Queue as queue
+import sys
+
+from py4j.finalizer import ThreadSafeFinalizer
+
+from connection import (Connection, NotificationListener,
+                        NotificationStream)
+import omni_messages
+
+STATUS_CLASSES = {omni_messages.OBJ_TYPE_UNIT: omni_messages.UnitStatus}
+
+_BATCH = 50000
+
+# Most growth allowed between the first batch and the last
+_HEAP_SLACK = 8 * 1024 * 1024
+_OBJECT_SLACK = 1000
+
+
+def consume(q, count):
+    """ Read each notification the way the unit extension does. """
+    for i in range(count):
+        status_msg = q.get(timeout=30).data
+        status_msg.getStatusType()
+        status = status_msg.getStatuses()[0]
+        status.getNumber(), status.getStatus(), status.getTime()
+
+
+def soak_callbacks(source, count):
+    q = queue.Queue()
+    source.toListener(NotificationListener(q, STATUS_CLASSES), count)
+    consume(q, count)
+
+
+def soak_stream(source, count):
+    q = queue.Queue()
+    stream = NotificationStream(source.toStream(count), q)
+    consume(q, count)
+    stream.close()
+
+
+def measure(source):
+    gc.collect()
+    return {"Java heap": source.usedHeap(),
+            "gateway objects": source.gatewayObjects(),
+            "Python objects": len(gc.get_objects()),
+            "py4j finalizers": len(ThreadSafeFinalizer.finalizers)}
+
+
+def soak(name, run, source, count):
+    run(source, _BATCH)  # warm up
+    first = measure(source)
+    done = 0
+    while done < count:
+        batch = min(_BATCH, count - done)
+        run(source, batch)
+        done += batch
+        last = measure(source)
+        print("{0}: {1} notifications, {2}".format(
+            name, done, ", ".join("{0} {1}".format(k, v)
+                                  for k, v in sorted(last.items()))))
+    growth = dict((k, last[k] - first[k]) for k in first)
+    ok = (growth["Java heap"] <= _HEAP_SLACK and
+          growth["gateway objects"] <= 0 and
+          growth["Python objects"] <= _OBJECT_SLACK and
+          growth["py4j finalizers"] <= 0)
+    print("{0}: {1}, growth {2}".format(name, "ok" if ok else "LEAKING",
+                                        growth))
+    return ok
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    Connection.startup(timeout=30)
+    try:
+        source = Connection.gateway.jvm.me.gazally.bench.NotificationSource()
+        results = [soak(name, run, source, count)
+                   for name, run in [("callbacks", soak_callbacks),
+                                     ("stream", soak_stream)]]
+    finally:
+        Connection.shutdown()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# Startup benchmark for the Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" Compare how long the plugin takes to start when every extension is
+loaded with how long it takes when only the ones in use are.
+
+Run it from the Server Plugin directory:
+
+    python test/bench_startup.py [runs] [type id,type id...]
+
+Every run is a fresh Python process, so that module imports count. The
+type ids say which devices are in use, by default a controller and
+zones. Indigo and py4j are replaced by mocks, so what gets measured is
+the plugin's own startup work.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+_CHILD = """
+import sys
+import time
+
+from mock import MagicMock
+
+
+class PluginBase(object):
+    def __init__(self, plugin_id, display_name, version, prefs):
+        self.pluginPrefs = prefs
+
+    def debugLog(self, msg):
+        pass
+
+    def errorLog(self, msg):
+        pass
+
+
+class Py4JError(Exception):
+    pass
+
+
+indigo = MagicMock()
+indigo.PluginBase = PluginBase
+py4j = MagicMock()
+py4j.protocol.Py4JError = py4j.protocol.Py4JJavaError = Py4JError
+sys.modules.update({"indigo": indigo, "appscript": MagicMock(),
+                    "py4j": py4j, "py4j.java_gateway": py4j.java_gateway,
+                    "py4j.protocol": py4j.protocol})
+
+mode = sys.argv[1]
+start = time.time()
+import plugin
+p = plugin.Plugin("bench", "bench", "0.0.0", {})
+if mode == "all":
+    p.load_all_extensions()
+else:
+    for type_id in mode.split(","):
+        p.extension_for("device", type_id)
+elapsed = time.time() - start
+p.log_writer.close()
+print(elapsed)
+"""
+
+
+def run(mode):
+    output = subprocess.check_output([sys.executable, "-c", _CHILD, mode])
+    return float(output.split()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    in_use = (sys.argv[2] if len(sys.argv) > 2 else
+              "omniControllerDevice,omniZoneDevice")
+    for label, mode in [("all extensions", "all"),
+                        ("in use ({0})".format(in_use), in_use)]:
+        times = sorted(run(mode) for i in range(runs))
+        print("{0}: median {1:.1f} ms, best {2:.1f} ms over {3} runs".format(
+            label, times[len(times) // 2] * 1000, times[0] * 1000, runs))
+
+
+if __name__ == "__main__":
+    main()
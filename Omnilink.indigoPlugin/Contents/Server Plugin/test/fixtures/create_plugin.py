@@ -63,12 +63,18 @@ def popen(monkeypatch, security_find_func, security_add_func):
         elif command.startswith("add-internet-password"):
             return security_add_func()
 
-    def popen_imposter(command, stdin=None, stdout=None, stderr=None):
+    def popen_imposter(command, stdin=None, stdout=None, stderr=None,
+                       **kwargs):
         """ Return a Mock to stand in for the return value from
         subprocess.Popen """
-        if "java" in command[0]:
+        if "java" in command[0] and "-Xshare:dump" in command:
+            dump_mock = Mock(returncode=0)
+            dump_mock.communicate.return_value = ("", "")
+            return dump_mock
+        elif "java" in command[0]:
             # Need a stdout that a line of text can be read from
             javaproc_mock = Mock()
+            javaproc_mock.poll.return_value = None  # still running
             javaproc_mock.stdout = StringIO("Java Gateway started\n")
             javaproc_mock.stderr = StringIO("")
             return javaproc_mock
@@ -88,6 +94,7 @@ def popen(monkeypatch, security_find_func, security_add_func):
 def gateway(py4j):
     """ Mock the return value from py4j.java_gateway.JavaGateway """
     gateway = Mock()
+    gateway.entry_point.drainDebugLog.return_value = ""
     py4j.java_gateway.JavaGateway.return_value = gateway
     return gateway
 
@@ -100,6 +107,11 @@ def plugin(version, plugin_module, monkeypatch, jomnilinkII):
     props = {"showDebugInfo": False,
              "showJomnilinkIIDebugInfo": False}
     plugin = plugin_module.Plugin("", "", version, props)
+    # Write log messages straight through so that tests can check
+    # debugLog and errorLog as soon as something has been logged.
+    # test_logwriter.py tests the writer thread.
+    plugin.log_writer.flush()
+    plugin.log_writer.synchronous = True
 
     # Patch time.sleep to short circuit the plugin's wait for
     # its java subprocess to start. The java subprocess has been mocked,
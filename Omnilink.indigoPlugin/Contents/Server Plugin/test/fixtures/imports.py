@@ -31,6 +31,10 @@ class Py4JJavaError(Py4JError):
     pass
 
 
+class Py4JNetworkError(Py4JError):
+    pass
+
+
 @pytest.fixture(scope="session")
 def mock_appscript():
     """ Put a mock in sys.modules so that import appscript will work """
@@ -52,6 +56,7 @@ def mock_py4j():
     m = MagicMock()
     m.protocol.Py4JError = Py4JError
     m.protocol.Py4JJavaError = Py4JJavaError
+    m.protocol.Py4JNetworkError = Py4JNetworkError
 
     sys.modules["py4j"] = m
     sys.modules['py4j.java_gateway'] = sys.modules['py4j'].java_gateway
@@ -45,9 +45,11 @@ def xmls(plugin_path):
 
 
 @pytest.fixture(autouse=True)
-def indigo(plugin_module):
+def indigo(plugin_module, tmpdir):
     """ Reset the indigo mockup and return it """
     plugin_module.indigo._reset()
+    plugin_module.indigo.server.getInstallFolderPath.return_value = str(
+        tmpdir)
     return plugin_module.indigo
 
 
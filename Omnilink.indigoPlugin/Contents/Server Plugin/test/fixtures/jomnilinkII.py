@@ -69,6 +69,14 @@ SystemInformation = build_java_class_mimic(
 
 SystemTroubles = build_java_class_mimic("SystemTroubles", ["Troubles"])
 
+SystemFormats = build_java_class_mimic(
+    "SystemFormats", ["TempFormat", "Timeformat", "DateFormat"])
+
+SystemFeatures = build_java_class_mimic("SystemFeatures", ["Features"])
+
+ObjectTypeCapacities = build_java_class_mimic(
+    "ObjectTypeCapacities", ["ObjectType", "Capacity"])
+
 SystemStatus = build_java_class_mimic(
     "SystemStatus",
     ["BatteryReading", "Year", "Month", "Day", "Hour", "Minute", "Second",
@@ -67,10 +67,12 @@ def connection_mock(messages):
         setattr(cm, name, m)
 
     cm._notify = CallerBacker(["objectStausNotification",
-                               "otherEventNotification"])
+                               "otherEventNotification",
+                               "systemStatusNotification"])
     cm._disconnect = CallerBacker(["notConnectedEvent"])
     cm.addNotificationListener.side_effect = cm._notify.add
     cm.addDisconnectListener.side_effect = cm._disconnect.add
+    cm.silenceAtDisconnect.return_value = 0
     return cm
 
 
@@ -190,6 +192,12 @@ def omni_messages(req_object_properties, req_object_status):
             ("reqSystemTroubles", "return_value",
             # Freeze, Battery Low, AC Power, Phone Line
              jomni_mimic.SystemTroubles([1, 2, 3, 4])),
+            ("reqSystemFormats", "return_value",
+             jomni_mimic.SystemFormats(1, 1, 1)),  # F, 12 hour, MMDD
+            ("reqSystemFeatures", "return_value",
+             jomni_mimic.SystemFeatures([])),
+            ("reqObjectTypeCapacities", "return_value",
+             jomni_mimic.ObjectTypeCapacities(0, 8)),
             ("reqObjectProperties", "side_effect",
              req_object_properties),
             ("reqObjectStatus", "side_effect",
@@ -236,6 +244,12 @@ def omni_messages_2(req_object_properties, req_object_status):
             ("reqSystemTroubles", "return_value",
             # digital communicator, fuse
              jomni_mimic.SystemTroubles([5, 6])),
+            ("reqSystemFormats", "return_value",
+             jomni_mimic.SystemFormats(2, 2, 2)),  # C, 24 hour, DDMM
+            ("reqSystemFeatures", "return_value",
+             jomni_mimic.SystemFeatures([4, 5])),
+            ("reqObjectTypeCapacities", "return_value",
+             jomni_mimic.ObjectTypeCapacities(0, 16)),
             ("reqObjectProperties", "side_effect",
              req_object_properties),
             ("reqObjectStatus", "side_effect",
@@ -17,7 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import print_function
 from __future__ import unicode_literals
-from time import sleep
+from time import sleep, time
 
 from mock import Mock
 import pytest
@@ -178,6 +178,7 @@ def test_reconnect_notification_clears_device_error_state(
     # make sure controller device is running and updated
     omni1_system_messages_asserts(started_controller_device)
     helpers.run_concurrent_thread(plugin, 1)
+    omni1.setNotificationFilter.assert_called_once_with("events")
 
     # make the mock jomnilinkII.Connection disconnect
     omni1.connected.return_value = False
@@ -203,6 +204,8 @@ def test_reconnect_notification_clears_device_error_state(
 
     assert started_controller_device.error_state is None
     omni2_system_messages_asserts(started_controller_device)
+    # and the new connection filters notifications the same way
+    omni2.setNotificationFilter.assert_called_once_with("events")
 
 
 def test_validate_action_config_ui_uses_substitute_check(
@@ -314,6 +317,66 @@ def test_other_event_notification_updates_device_state(
     assert not started_controller_device.states["batteryLowTrouble"]
 
 
+def test_other_event_notification_updates_states_without_queries(
+        plugin, started_controller_device, omni1):
+    omni1.reqSystemInformation.reset_mock()
+    omni1.reqSystemStatus.reset_mock()
+    omni1.reqSystemTroubles.reset_mock()
+    event_msg = jomni_mimic.OtherEventNotifications([0x0305, 0x0301,
+                                                     0x030C])
+
+    omni1._notify("otherEventNotification", event_msg)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    dev = started_controller_device
+    assert not dev.states["ACPowerTrouble"]
+    assert not dev.states["phoneLineTrouble"]
+    assert dev.states["phoneLine"] == "Ringing"
+    assert dev.states["energyCost"] == "High"
+    assert not omni1.reqSystemInformation.called
+    assert not omni1.reqSystemStatus.called
+    assert not omni1.reqSystemTroubles.called
+
+
+def test_other_event_notification_refreshes_on_unknown_event(
+        plugin, started_controller_device, omni1):
+    omni1.reqSystemTroubles.return_value = jomni_mimic.SystemTroubles([])
+    event_msg = jomni_mimic.OtherEventNotifications([0x0340])
+
+    omni1._notify("otherEventNotification", event_msg)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    assert not started_controller_device.states["freezeTrouble"]
+
+
+def test_ac_power_on_event_executes_trigger(
+        plugin, omni1, indigo, started_controller_device):
+    trigger = Mock()
+    trigger.id = 2
+    trigger.pluginTypeId = "ACPowerOn"
+    trigger.pluginProps = {"controllerId": unicode(
+        started_controller_device.id)}
+    plugin.triggerStartProcessing(trigger)
+
+    omni1._notify("otherEventNotification",
+                  jomni_mimic.OtherEventNotifications([0x0305]))
+    helpers.run_concurrent_thread(plugin, 1)
+
+    indigo.trigger.execute.assert_called_with(2)
+
+
+def test_controller_device_refreshed_on_schedule(
+        plugin, started_controller_device, omni1):
+    omni1.reqSystemTroubles.return_value = jomni_mimic.SystemTroubles([])
+
+    helpers.run_concurrent_thread(plugin, 1)
+    assert started_controller_device.states["freezeTrouble"]
+
+    plugin.scheduler.clock = lambda: time() + 2 * 3600
+    helpers.run_concurrent_thread(plugin, 1)
+    assert not started_controller_device.states["freezeTrouble"]
+
+
 def test_other_event_notification_ignores_unknown_message(
         plugin, omni1, indigo, started_controller_device, trigger,
         trigger_non_event):
@@ -335,10 +398,46 @@ def test_other_event_notification_ignores_message_for_stopped_device(
     assert not indigo.trigger.execute.called
 
 
+def test_device_start_comm_sets_system_status_states(
+        started_controller_device):
+    assert started_controller_device.states["areasInAlarm"] == "2"
+    assert (started_controller_device.states["systemTime"] ==
+            "2016-02-14 11:13:14")
+
+
+def test_system_status_notification_updates_device_state(
+        plugin, started_controller_device, omni1):
+    omni1.reqSystemStatus.reset_mock()
+    status = jomni_mimic.SystemStatus(180, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                      {}, False, False)
+
+    omni1._notify("systemStatusNotification", status)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    assert started_controller_device.states["batteryReading"] == 180
+    assert started_controller_device.states["areasInAlarm"] == "None"
+    assert started_controller_device.states["systemTime"] == "not set"
+    assert not omni1.reqSystemStatus.called
+
+
+def test_system_status_notification_ignores_stopped_device(
+        plugin, started_controller_device, omni1):
+    plugin.deviceStopComm(started_controller_device)
+    status = jomni_mimic.SystemStatus(180, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                                      {}, False, False)
+
+    omni1._notify("systemStatusNotification", status)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    assert started_controller_device.states["batteryReading"] == 200
+
+
 def test_generate_keypad_list_checks_keypad_count(
         plugin, omni1, started_controller_device, jomnilinkII):
 
-    omni1.reqObjectTypeCapacities.return_value.getCapacity.return_value = 8
+    omni1.reqObjectTypeCapacities.assert_any_call(
+        jomnilinkII.Message.OBJ_TYPE_CONSOLE)
+    omni1.reqObjectTypeCapacities.reset_mock()
 
     values = {}
     plugin.getActionConfigUiValues(values, "checkSecurityCode",
@@ -346,10 +445,37 @@ def test_generate_keypad_list_checks_keypad_count(
     tups = plugin.generateConsoleList(None, values,
                                       "enableConsoleBeeper",
                                       started_controller_device.id)
-    assert omni1.reqObjectTypeCapacities.called_with(
-        jomnilinkII.Message.OBJ_TYPE_CONSOLE)
 
     assert len(tups) == 9
+    assert not omni1.reqObjectTypeCapacities.called
+
+
+def test_controller_profile_is_fetched_once_per_firmware(
+        plugin, omni1, started_controller_device):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    connection = plugin.make_connection(
+        started_controller_device.pluginProps["url"])
+    assert omni1.reqSystemFormats.call_count == 1
+    assert "controllerProfiles" in plugin.pluginPrefs
+
+    ext.profile(connection)
+    assert omni1.reqSystemInformation.call_count == 1
+
+    # a new session revalidates the saved profile against the firmware
+    connection.session += 1
+    ext._profiles.clear()
+    profile = ext.profile(connection)
+    assert omni1.reqSystemInformation.call_count == 2
+    assert omni1.reqSystemFormats.call_count == 1
+    assert profile.capacities["consoles"] == 8
+    assert profile.formats["temperature"] == "F"
+
+    omni1.reqSystemInformation.return_value = jomni_mimic.SystemInformation(
+        30, 2, 17, 0, "")
+    connection.session += 1
+    profile = ext.profile(connection)
+    assert omni1.reqSystemFormats.call_count == 2
+    assert profile.firmware == "2.17"
 
 
 def test_enable_disable_keypad_beeper_sends_command(
@@ -462,3 +588,72 @@ def test_send_keypad_beep_handles_unconfigured_action(
 
     assert plugin.errorLog.called
     plugin.errorLog.reset_mock()
+
+
+def test_reconnect_reports_events_missed_while_disconnected(
+        plugin, indigo, started_controller_device, omni1, jomnilinkII):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    connection = plugin.make_connection(
+        started_controller_device.pluginProps["url"])
+    mtype = jomnilinkII.Message.MESG_TYPE_EVENT_LOG_DATA = 99
+    events = [jomni_mimic.EventLogData(mtype, n, 3, 28, 10, 30, 48, 1, 0,
+                                       True) for n in range(1, 4)]
+
+    def upload(number, direction):
+        if number == 0:
+            number = len(events) + 1
+        if number > 1:
+            return events[number - 2]
+        return jomni_mimic.EndOfData(0)
+
+    omni1.uploadEventLogData.side_effect = lambda n, d: events[0]
+    ext.sync_event_log(connection.url)
+    assert ext.event_log.high_water_mark(connection.url) == 1
+
+    omni1.uploadEventLogData.side_effect = upload
+    indigo.server.log.reset_mock()
+    ext.reconnect_notification(connection, omni1)
+    ext.sync_threads[connection.url].join()
+
+    assert ext.event_log.high_water_mark(connection.url) == 3
+    messages = [args[0] for args, kwargs in indigo.server.log.call_args_list]
+    assert "logged 2 events" in messages[0]
+    assert len(messages) == 3
+
+
+def test_first_event_log_sync_runs_in_background(
+        plugin, indigo, started_controller_device, omni1):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    url = started_controller_device.pluginProps["url"]
+    thread = ext.sync_threads[url]
+    thread.join()
+    assert thread.name == "Event log " + url
+
+    event_log = ext.event_log
+    plugin.shutdown()
+    assert ext._event_log is None
+    from eventlog import EventLogClosed
+    with pytest.raises(EventLogClosed):
+        event_log.high_water_mark(url)
+
+
+def test_event_log_sync_after_shutdown_does_not_reopen_log(
+        plugin, indigo, started_controller_device, omni1, jomnilinkII):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    url = started_controller_device.pluginProps["url"]
+    ext.sync_threads[url].join()
+    mtype = jomnilinkII.Message.MESG_TYPE_EVENT_LOG_DATA = 99
+
+    # shut down while a sync is reading from the controller
+    def upload(number, direction):
+        plugin.shutdown()
+        return jomni_mimic.EventLogData(mtype, 1, 3, 28, 10, 30, 48, 1, 0,
+                                        True)
+
+    omni1.uploadEventLogData.side_effect = upload
+    assert ext.sync_event_log(url) == 0
+    assert ext._event_log is None
+
+    ext.start_event_log_sync(url, report=True)
+    ext.sync_threads[url].join()
+    assert ext._event_log is None
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# Unit Tests for the timing statistics of Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from mock import Mock
+import pytest
+
+
+@pytest.fixture
+def diagnostics_module(plugin_module):
+    import diagnostics
+    return diagnostics
+
+
+def test_latency_stats_percentiles(diagnostics_module):
+    stats = diagnostics_module.LatencyStats(samples=100)
+    for i in range(200):
+        stats.record("key", i / 1000.0)
+
+    assert stats.counts["key"] == 200
+    assert stats.percentiles("key") == [0.150, 0.190, 0.199]
+    assert stats.percentiles("other") == [None, None, None]
+
+
+def test_latency_stats_times_functions_that_raise(diagnostics_module):
+    now = [0.0]
+
+    def clock():
+        now[0] += 0.5
+        return now[0]
+
+    def fail():
+        raise ValueError
+
+    stats = diagnostics_module.LatencyStats(clock=clock)
+    with pytest.raises(ValueError):
+        stats.timed(("Ext", "fail"), fail)()
+
+    assert stats.report() == ["Ext.fail: 1 calls, 500.0 ms total, "
+                              "500.0/500.0/500.0 ms at 50/90/99%"]
+
+
+def test_counters_report(diagnostics_module):
+    counters = diagnostics_module.Counters()
+    counters.add("waits")
+    counters.add("created", 3)
+    counters.peak("peak", 2)
+    counters.peak("peak", 1)
+
+    assert counters["waits"] == 1
+    assert counters["missing"] == 0
+    assert counters.report() == ["created: 3", "peak: 2", "waits: 1"]
@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+# Unit Tests for the event log copy of Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+from datetime import datetime
+
+from mock import Mock
+import pytest
+
+import fixtures.jomnilinkII as jomni_mimic
+
+_EVENT_LOG_DATA = 99
+_END_OF_DATA = 3
+
+
+class FakeEventLog(object):
+    """ Stands in for jomnilinkII.Connection.uploadEventLogData, with
+    a list of (event_type, parameter1, parameter2) oldest first """
+    def __init__(self, events):
+        self.events = list(events)
+        self.calls = 0
+
+    def __call__(self, number, direction):
+        self.calls += 1
+        assert direction == -1
+        if number == 0:
+            number = len(self.events) + 1
+        if number <= 1:
+            return jomni_mimic.EndOfData(_END_OF_DATA)
+        event_type, p1, p2 = self.events[number - 2]
+        return jomni_mimic.EventLogData(_EVENT_LOG_DATA, number - 1,
+                                        3, 28, 10, 30, event_type, p1, p2,
+                                        True)
+
+
+@pytest.fixture
+def event_log(plugin_module, tmpdir):
+    from eventlog import EventLog
+    log = EventLog(str(tmpdir.join("eventlog.sqlite")))
+    yield log
+    log.close()
+
+
+@pytest.fixture
+def M():
+    return Mock(MESG_TYPE_EVENT_LOG_DATA=_EVENT_LOG_DATA)
+
+
+def test_sync_copies_whole_log_then_only_new_events(event_log, M):
+    omni = Mock()
+    omni.uploadEventLogData = FakeEventLog([(128, 0, 1), (48, 1, 0)])
+
+    assert event_log.sync("url", omni, M) == 2
+    assert event_log.high_water_mark("url") == 2
+    assert omni.uploadEventLogData.calls == 3
+
+    omni.uploadEventLogData.events.append((49, 2, 0))
+    omni.uploadEventLogData.calls = 0
+    assert event_log.sync("url", omni, M) == 1
+    assert omni.uploadEventLogData.calls == 2
+
+    records = event_log.last_events("url", 10)
+    assert [r.number for r in records] == [3, 2, 1]
+    assert records[0].event_type == 49
+    assert records[0].parameter1 == 2
+    assert (records[0].time.month, records[0].time.day) == (3, 28)
+
+
+def test_queries_read_local_copy(event_log, M, tmpdir):
+    omni = Mock()
+    omni.uploadEventLogData = FakeEventLog(
+        [(128, 0, 1), (48, 1, 0), (4, 1, 1), (129, 0, 2), (51, 1, 0)])
+    event_log.sync("url", omni, M)
+    event_log.sync("url2", omni, M)
+    omni.uploadEventLogData = None
+
+    assert [r.number for r in event_log.zone_events("url", 1)] == [3, 1]
+    assert [r.event_type for r in event_log.arming_history("url")] == [
+        51, 48]
+    assert len(event_log.last_events("url", 2)) == 2
+
+    # history survives reopening the file
+    from eventlog import EventLog
+    event_log.close()
+    reopened = EventLog(str(tmpdir.join("eventlog.sqlite")))
+    assert len(reopened.last_events("url2", 10)) == 5
+    assert reopened.high_water_mark("url2") == 5
+    reopened.close()
+
+
+def test_event_time_is_not_in_the_future(event_log):
+    m = jomni_mimic.EventLogData(_EVENT_LOG_DATA, 1, 12, 31, 23, 59, 128,
+                                 0, 1, True)
+    record = event_log.record_from_message(m, datetime(2017, 1, 1, 8, 0))
+    assert record.time == datetime(2016, 12, 31, 23, 59)
+
+    m.TimeDataValid = False
+    assert event_log.record_from_message(m, datetime.now()).time is None
+
+
+def test_event_log_report_reads_local_copy(plugin, indigo, omni1,
+                                           device_factory_fields):
+    omni1.uploadEventLogData = FakeEventLog([(128, 0, 1), (48, 1, 0)])
+    plugin.makeConnection(device_factory_fields, [])
+    omni1.connected.return_value = True
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    connection = list(plugin.connections.values())[0]
+    connection.jomnilinkII.Message.MESG_TYPE_EVENT_LOG_DATA = _EVENT_LOG_DATA
+
+    say = Mock()
+    ext.say_event_log("Event Log", connection, say)
+    assert say.call_count == 2
+    assert "Disarm" in say.call_args_list[0][0][0]
+    assert "Zone Tripped" in say.call_args_list[1][0][0]
+    assert ext.event_log.high_water_mark(connection.url) == 2
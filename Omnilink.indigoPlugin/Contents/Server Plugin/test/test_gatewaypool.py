@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# Unit Tests for the gateway connection pool of Omnilink Plugin for Indigo
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+
+from mock import Mock
+import pytest
+
+from fixtures.imports import Py4JNetworkError
+
+
+@pytest.fixture
+def gatewaypool_module(plugin_module, monkeypatch):
+    import gatewaypool
+    monkeypatch.setattr(gatewaypool, "GatewayConnection",
+                        Mock(side_effect=lambda *args: Mock()))
+    monkeypatch.setattr(gatewaypool, "quiet_close", Mock())
+    return gatewaypool
+
+
+@pytest.fixture
+def now():
+    return [0.0]
+
+
+@pytest.fixture
+def pool(gatewaypool_module, now):
+    return gatewaypool_module.GatewayPool(max_size=2, wait=0.05,
+                                          idle_timeout=60,
+                                          clock=lambda: now[0])
+
+
+def test_pool_reuses_connections(gatewaypool_module, pool):
+    for i in range(5):
+        assert pool.send_command("c\n") is not None
+
+    assert gatewaypool_module.GatewayConnection.call_count == 1
+    assert pool.counters["created"] == 1
+    assert pool.counters["peak in use"] == 1
+
+
+def test_pool_times_out_when_full(pool, now):
+    def tick():
+        now[0] += 1
+        return now[0]
+    pool.clock = tick
+    first = pool._get_connection()
+    second = pool._get_connection()
+    with pytest.raises(Py4JNetworkError):
+        pool._get_connection()
+
+    assert pool.counters["waits"] == 1
+    assert pool.counters["timeouts"] == 1
+    pool._give_back_connection(first)
+    assert pool._get_connection() is first
+    assert pool.open == 2
+
+
+def test_pool_waiter_gets_returned_connection(pool):
+    first = pool._get_connection()
+    pool._get_connection()
+    pool.wait = 5
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool._get_connection()))
+    t.start()
+    pool._give_back_connection(first)
+    t.join(5)
+
+    assert got == [first]
+    assert pool.counters["timeouts"] == 0
+
+
+def test_pool_evicts_idle_connections(gatewaypool_module, pool, now):
+    pool.prewarm(5)
+    assert pool.open == 2
+    assert pool.counters["created"] == 2
+
+    now[0] = 61
+    pool.send_command("c\n")
+
+    assert gatewaypool_module.quiet_close.call_count == 2
+    assert pool.counters["evicted"] == 2
+    assert pool.open == 1
+
+
+def test_pool_discards_broken_connections(gatewaypool_module, pool):
+    broken = Mock()
+    broken.send_command.side_effect = Py4JNetworkError
+    pool.idle.append((broken, 0))
+    pool.open = 1
+
+    assert pool.send_command("c\n") is not None
+
+    gatewaypool_module.quiet_close.assert_called_once_with(broken)
+    assert pool.counters["closed"] == 1
+    assert pool.open == 1
+    assert pool.in_use == 0
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+# Unit Tests for the log writer of Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from mock import Mock
+import threading
+
+from mock import Mock
+import pytest
+
+
+@pytest.fixture
+def logwriter_module(plugin_module):
+    import logwriter
+    return logwriter
+
+
+@pytest.fixture
+def writer(logwriter_module):
+    w = logwriter_module.LogWriter(Mock(), Mock(), maxsize=10)
+    yield w
+    w.close()
+
+
+def test_log_writer_joins_messages_of_the_same_level(writer):
+    for msg in ["one", "two", "three"]:
+        writer.write(msg)
+    writer.write("oops", error=True)
+    writer.write("four")
+    writer.flush()
+
+    messages = ([c[0][0] for c in writer.debug_log.call_args_list] +
+                [c[0][0] for c in writer.error_log.call_args_list])
+    assert "\n".join(messages).split("\n") == ["one", "two", "three",
+                                               "four", "oops"]
+    assert writer.error_log.call_count == 1
+    assert writer.debug_log.call_count <= 4
+
+
+def test_log_writer_drops_and_counts_when_full(writer):
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def slow_debug_log(msg):
+        blocked.set()
+        release.wait()
+    writer.debug_log.side_effect = slow_debug_log
+
+    writer.write("first")
+    blocked.wait()
+    for i in range(15):
+        writer.write(str(i))
+    assert writer.dropped == 5
+
+    release.set()
+    writer.flush()
+    writer.write("last")
+    writer.flush()
+
+    writer.error_log.assert_called_once_with(
+        "Logging fell behind, 5 messages were dropped")
+    assert writer.dropped == 0
+
+
+def test_log_writer_writes_everything_on_close(writer):
+    for i in range(4):
+        writer.write(str(i))
+    writer.close()
+
+    assert writer.debug_log.called
+    writer.write("late")
+    writer.debug_log.assert_called_with("late")
+
+
+def test_log_writer_is_used_by_plugin_loggers(plugin, logging):
+    plugin.log_writer.synchronous = False
+    plugin.debugLog.reset_mock()
+    threadname = []
+
+    def debug_log(msg):
+        threadname.append(threading.current_thread().name)
+    plugin.debugLog.side_effect = debug_log
+
+    logging.getLogger("plugin").debug("hello")
+    plugin.log_writer.flush()
+
+    plugin.debugLog.assert_called_once_with("hello")
+    assert threadname == ["Log Writer"]
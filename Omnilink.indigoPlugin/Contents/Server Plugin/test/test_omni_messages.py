@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+# Unit Tests for the notification message decoder of Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from mock import Mock
+
+import Queue as queue
+import socket
+import struct
+
+import pytest
+
+from fixtures.imports import Py4JNetworkError
+
+
+@pytest.fixture
+def decoder(plugin_module):
+    import omni_messages
+    return omni_messages
+
+
+def message(mesg_type, data):
+    """ Build an Omni-Link II message, with a CRC that nobody checks """
+    return (struct.pack(b">BBB", 0x21, len(data) + 1, mesg_type) + data +
+            b"\0\0")
+
+
+def test_zone_status_is_decoded(decoder):
+    event_type, status_msg = decoder.decode(
+        message(0x23, struct.pack(b">BHBBHBB", 1, 3, 0x01, 120, 4, 0, 90)))
+
+    assert event_type == "status"
+    assert status_msg.getStatusType() == 1
+    statuses = status_msg.getStatuses()
+    assert [s.getNumber() for s in statuses] == [3, 4]
+    assert statuses[0].getStatus() == 0x01
+    assert statuses[0].getLoop() == 120
+
+
+def test_unit_status_is_decoded(decoder):
+    event_type, status_msg = decoder.decode(
+        message(0x23, struct.pack(b">BHBH", 2, 300, 1, 600)))
+
+    status = status_msg.getStatuses()[0]
+    assert (status.getNumber(), status.getStatus(),
+            status.getTime()) == (300, 1, 600)
+
+
+def test_extended_status_records_are_decoded(decoder):
+    records = (struct.pack(b">HBHBB", 5, 1, 0, 7, 7) +
+               struct.pack(b">HBHBB", 6, 0, 0, 7, 7))
+    event_type, status_msg = decoder.decode(
+        message(0x3B, struct.pack(b">BB", 2, 7) + records))
+
+    assert [s.getNumber() for s in status_msg.getStatuses()] == [5, 6]
+
+
+def test_other_events_are_decoded(decoder):
+    event_type, other = decoder.decode(
+        message(0x37, struct.pack(b">HH", 0x0300, 0x0800)))
+
+    assert event_type == "event"
+    assert other.getNotifications() == [0x0300, 0x0800]
+
+
+def test_unhandled_messages_are_ignored(decoder):
+    thermostat = message(0x23, struct.pack(b">BHBBBBBBB", 6, 1, 0, 0, 0, 0,
+                                           0, 0, 0))
+    assert decoder.decode(thermostat) is None
+    assert decoder.decode(message(0x05, b"")) is None
+
+    with pytest.raises(ValueError):
+        decoder.decode(b"\x22\x01\x23")
+
+
+def test_notification_stream_queues_decoded_messages(connection):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    q = queue.Queue()
+    stream = connection.NotificationStream(server.getsockname()[1], q)
+    client, _ = server.accept()
+
+    frames = [message(0x23, struct.pack(b">BHBH", 2, n, 1, 0))
+              for n in range(1, 4)]
+    frames.insert(1, b"garbage")
+    client.sendall(b"".join(struct.pack(b">H", len(f)) + f for f in frames))
+    client.close()
+    stream.thread.join(5)
+    server.close()
+
+    events = [q.get_nowait() for i in range(q.qsize())]
+    assert [e.event_type for e in events] == ["status"] * 3
+    assert [e.data.getStatuses()[0].getNumber() for e in events] == [1, 2, 3]
+
+
+def test_connection_gets_notifications_from_stream(connection, gateway,
+                                                   jomnilinkII, py4j):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    gateway.entry_point.openNotificationStream.return_value = (
+        server.getsockname()[1])
+    connection.Connection.stream_notifications = True
+    notifications = {"status": [], "event": [], "system_status": [],
+                     "disconnect": [], "reconnect": []}
+    received = []
+    notifications["status"].append(lambda c, msg: received.append(msg))
+
+    assert connection.Connection.wait_for_java()
+    conn = connection.Connection("10.0.0.2", 4369, "key", notifications)
+    client, _ = server.accept()
+    frame = message(0x23, struct.pack(b">BHBBHBB", 1, 3, 0x01, 120, 4, 0, 90))
+    client.sendall(struct.pack(b">H", len(frame)) + frame)
+    client.close()
+    conn.stream.thread.join(5)
+    server.close()
+    conn.update()
+
+    assert gateway.entry_point.openNotificationStream.called
+    assert [s.getNumber() for s in received[0].getStatuses()] == [3, 4]
+
+    gateway.entry_point.openNotificationStream.side_effect = (
+        py4j.protocol.Py4JError)
+    conn._open_stream(conn._omni)
+    assert conn.stream is None
+
+
+def test_object_status_is_copied(decoder):
+    records = [Mock(**{"getNumber.return_value": 5,
+                       "getMode.return_value": 1,
+                       "getAlarms.return_value": 0,
+                       "getEntryTimer.return_value": 30,
+                       "getExitTimer.return_value": 60}), None]
+    status_msg = Mock(**{"getStatusType.return_value": "area",
+                         "getStatuses.return_value": records})
+
+    copy, read = decoder.copy_object_status(
+        status_msg, {"area": decoder.AreaStatus})
+
+    status = copy.getStatuses()[0]
+    assert copy.getStatusType() == "area"
+    assert len(copy.getStatuses()) == 1
+    assert (status.getNumber(), status.getMode(), status.getEntryTimer(),
+            status.getExitTimer()) == (5, 1, 30, 60)
+    assert read == [status_msg, records, records[0]]
+
+
+def test_unknown_object_status_is_copied_empty(decoder):
+    status_msg = Mock(**{"getStatusType.return_value": "thermostat"})
+
+    copy, read = decoder.copy_object_status(status_msg, {})
+
+    assert copy.getStatuses() == []
+    assert not status_msg.getStatuses.called
+    assert read == [status_msg]
+
+
+def test_system_status_is_copied(decoder):
+    alarms = {1: 2}
+    status = Mock(**{"isTimeDateValid.return_value": True,
+                     "getAlarms.return_value": alarms,
+                     "getBatteryReading.return_value": 200,
+                     "getYear.return_value": 16,
+                     "getSecond.return_value": 59})
+
+    copy, read = decoder.copy_system_status(status)
+
+    assert copy.isTimeDateValid()
+    assert copy.getAlarms() == alarms and copy.getAlarms() is not alarms
+    assert (copy.getBatteryReading(), copy.getYear(),
+            copy.getSecond()) == (200, 16, 59)
+    assert read == [status, alarms]
+
+
+def test_notification_lost_to_busy_gateway_is_an_error(plugin, connection,
+                                                       decoder, monkeypatch):
+    monkeypatch.setattr(decoder, "copy_system_status", Mock(
+        side_effect=Py4JNetworkError("All 8 gateway connections are busy")))
+    q = queue.Queue()
+    listener = connection.NotificationListener(q, {})
+
+    listener.systemStatusNotification(Mock())
+
+    assert q.empty()
+    assert plugin.errorLog.called
+    plugin.errorLog.reset_mock()
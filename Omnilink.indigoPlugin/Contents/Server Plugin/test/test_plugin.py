@@ -18,27 +18,181 @@
 
 from __future__ import print_function
 from __future__ import unicode_literals
+import sys
+import threading
+from time import sleep
 
 from mock import Mock
+import pytest
 
 import fixtures.jomnilinkII as jomni_mimic
 import fixtures.helpers as helpers
 
 
 def test_error_reported_on_failure_to_start_java(plugin_module, version, popen,
-                                                 jomnilinkII):
+                                                 jomnilinkII, connection):
     popen.side_effect = OSError
 
     props = {"showDebugInfo": False,
              "showJomnilinkIIDebugInfo": False}
     plugin = plugin_module.Plugin("", "", version, props)
     plugin.startup()
+    assert not popen.called
+
+    plugin.make_connection("192.168.1.42:4369", "01-02", "03-04")
+    assert not connection.Connection.wait_for_java()
+    plugin.shutdown()
+    plugin.log_writer.flush()
 
     assert plugin.errorLog.called
     plugin.errorLog.reset_mock()
+    plugin.log_writer.close()
+
+
+def test_connection_does_not_wait_for_java(plugin, gateway, connection):
+    started = threading.Event()
+    gateway.entry_point.ping.side_effect = lambda: started.wait(5)
+
+    conn = plugin.make_connection("192.168.1.42:4369", "01-02", "03-04")
+    assert not connection.Connection.java_ready.is_set()
+    assert not conn.is_connected()
+
+    started.set()
+    assert connection.Connection.wait_for_java()
+    [t.join(5) for t in connection.Connection.threads]
+    plugin.update()
+    assert conn.is_connected()
+
+
+def test_shutdown_does_not_wait_for_java_startup(plugin, gateway,
+                                                 connection):
+    started = threading.Event()
+    gateway.entry_point.ping.side_effect = lambda: started.wait(5)
+
+    plugin.make_connection("192.168.1.42:4369", "01-02", "03-04")
+    first = [t for t in connection.Connection.threads
+             if t.name.startswith("Connect ")][0]
+    quitter = threading.Thread(target=connection.Connection.shutdown)
+    quitter.start()
+    first.join(2)
+    assert not first.is_alive()
+    assert not connection.Connection.wait_for_java()
+
+    started.set()
+    quitter.join(5)
+    assert not quitter.is_alive()
+
+
+def test_java_start_is_retried_after_failure(plugin, popen, connection):
+    launch = popen.side_effect
+    failures = []
+
+    def fail_once(command, **kwargs):
+        if ("java" in command[0] and "-Xshare:dump" not in command and
+                not failures):
+            failures.append(command)
+            raise OSError
+        return launch(command, **kwargs)
+    popen.side_effect = fail_once
+
+    assert not connection.Connection.wait_for_java()
+    assert connection.Connection.java_thread is None
+    plugin.errorLog.reset_mock()
+
+    conn = plugin.make_connection("192.168.1.42:4369", "01-02", "03-04")
+    assert connection.Connection.wait_for_java()
+    [t.join(5) for t in connection.Connection.threads]
+    plugin.update()
+    assert conn.is_connected()
 
 
-def test_shutdown_handles_exceptions(plugin, gateway, py4j):
+def java_commands(popen):
+    return [c[0][0] for c in popen.call_args_list if "java" in c[0][0][0]]
+
+
+def test_java_uses_class_archive(plugin, popen, connection):
+    archive = plugin.data_path("classes.jsa")
+    open(archive, "w").close()
+
+    assert connection.Connection.wait_for_java()
+
+    commands = java_commands(popen)
+    assert len(commands) == 1
+    assert "-XX:SharedArchiveFile=" + archive in commands[0]
+    assert "-XX:+UseSerialGC" in commands[0]
+
+
+def test_java_class_archive_is_created_when_missing(plugin, popen,
+                                                    connection):
+    assert connection.Connection.wait_for_java()
+
+    commands = java_commands(popen)
+    assert "-Xshare:dump" in commands[0]
+    assert not any(c.startswith("-XX:SharedArchiveFile")
+                   for c in commands[1])
+
+
+def test_java_readiness_is_polled_over_gateway(plugin, gateway, py4j,
+                                               connection):
+    gateway.entry_point.ping.side_effect = [py4j.protocol.Py4JNetworkError,
+                                            py4j.protocol.Py4JNetworkError,
+                                            True]
+    assert connection.Connection.wait_for_java()
+    assert gateway.entry_point.ping.call_count == 3
+
+
+def test_gateway_without_ping_counts_as_ready(plugin, gateway, py4j,
+                                              connection):
+    gateway.entry_point.ping.side_effect = [
+        py4j.protocol.Py4JNetworkError,
+        py4j.protocol.Py4JError("Method ping([]) does not exist")]
+    assert connection.Connection.wait_for_java()
+    assert gateway.entry_point.ping.call_count == 2
+
+
+def test_sidecar_java_is_left_running(plugin, popen, gateway, py4j,
+                                      connection):
+    plugin.set_java_options({"javaSidecar": True})
+    gateway.entry_point.ping.side_effect = [py4j.protocol.Py4JNetworkError,
+                                            True]
+
+    assert connection.Connection.wait_for_java()
+    commands = java_commands(popen)
+    assert "--lease" in commands[-1]
+    assert popen.call_args[1]["preexec_fn"] is not None
+    plugin.update()
+    gateway.entry_point.renewLease.assert_called_once_with(120)
+
+    javaproc = connection.Connection.javaproc
+    plugin.shutdown()
+    assert gateway.entry_point.detach.called
+    assert gateway.close.called
+    assert not gateway.shutdown.called
+    assert not javaproc.terminate.called
+
+
+def test_sidecar_connections_are_taken_over(plugin, popen, gateway,
+                                            jomnilinkII, connection):
+    plugin.set_java_options({"javaSidecar": True})
+    omni = Mock()
+    omni.connected.return_value = True
+    gateway.entry_point.existingConnection.return_value = omni
+    notifications = {"status": [], "event": [], "system_status": [],
+                     "disconnect": [], "reconnect": [Mock()]}
+
+    assert connection.Connection.wait_for_java()
+    conn = connection.Connection("10.0.0.2", 4369, "key", notifications)
+    conn.update()
+
+    assert not java_commands(popen)
+    assert not jomnilinkII.Connection.called
+    assert omni.removeAllListeners.called
+    assert omni.addNotificationListener.called
+    notifications["reconnect"][0].assert_called_once_with(conn, omni)
+
+
+def test_shutdown_handles_exceptions(plugin, gateway, py4j, connection):
+    assert connection.Connection.wait_for_java()
     gateway.shutdown.side_effect = py4j.protocol.Py4JError
 
     plugin.shutdown()
@@ -54,6 +208,51 @@ def test_plugin_dispatches_to_pluginbase(plugin, indigo, monkeypatch):
     assert indigo.PluginBase.actionControlSprinkler.called
 
 
+def test_dispatch_table_is_built_when_extensions_load(plugin):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    func = plugin.dispatch_table[("deviceStartComm", "device",
+                                  "omniControllerDevice")]
+    assert func == ext.deviceStartComm
+
+    plugin.getDeviceDisplayStateId(Mock(deviceTypeId="unknownDevice"))
+    assert ("getDeviceDisplayStateId", "device",
+            "unknownDevice") in plugin.dispatch_table
+
+
+def test_callback_timing_menu_items(plugin, indigo):
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    ext.getDeviceDisplayStateId = Mock(return_value="state")
+    plugin.toggleCallbackTiming()
+
+    dev = Mock(deviceTypeId="omniControllerDevice")
+    assert plugin.getDeviceDisplayStateId(dev) == "state"
+    assert plugin.getDeviceDisplayStateId(dev) == "state"
+    plugin.writeCallbackTimingToLog()
+
+    lines = [c[0][0] for c in indigo.server.log.call_args_list]
+    assert any("ControllerExtension.getDeviceDisplayStateId: 2 calls" in line
+               for line in lines)
+
+    plugin.toggleCallbackTiming()
+    assert plugin.callback_stats is None
+    func = plugin.dispatch_table[("getDeviceDisplayStateId", "device",
+                                  "omniControllerDevice")]
+    assert func is ext.getDeviceDisplayStateId
+
+
+def test_callback_timing_skips_extensions_without_type_ids(plugin):
+    import extensions
+
+    class Bare(extensions.PluginExtension):
+        def __init__(self):
+            self.callbacks = {}
+            self.reports = {}
+
+    plugin.extend_plugin(Bare)
+    plugin.toggleCallbackTiming()
+    assert plugin.callback_stats is not None
+
+
 def test_debug_menu_item_toggles(plugin):
     assert not plugin.debug
     plugin.debugLog.reset_mock()
@@ -86,6 +285,32 @@ def test_jomnilinkii_debug_menu_item_toggles(plugin):
     assert not plugin.errorLog.called
 
 
+def test_jomnilinkii_debug_output_is_gated_and_batched(plugin, gateway,
+                                                       connection):
+    entry_point = gateway.entry_point
+    assert not entry_point.setDebug.called
+    assert connection.Connection.wait_for_java()
+    entry_point.setDebug.assert_called_with(False)
+    plugin.update()
+    assert not entry_point.drainDebugLog.called
+
+    plugin.toggleJomnilinkIIDebugging()
+    entry_point.setDebug.assert_called_with(True)
+
+    entry_point.drainDebugLog.return_value = (
+        "1475000000000\tOmniReaderThread\ttx\t0x21 0x01\n"
+        "1475000000010\tOmniReaderThread\trx\t0x21 0x02\n"
+        "1475000000020\tThread-3\tdropped\t7\n")
+    plugin.debugLog.reset_mock()
+    plugin.update()
+
+    assert plugin.debugLog.call_count == 1
+    message = plugin.debugLog.call_args[0][0]
+    assert "[OmniReaderThread] tx: 0x21 0x01" in message
+    assert "[OmniReaderThread] rx: 0x21 0x02" in message
+    assert "7 debug records dropped" in message
+
+
 def test_run_concurrent_thread(plugin):
     helpers.run_concurrent_thread(plugin, 5)
 
@@ -109,6 +334,162 @@ def test_prefs_ui_validation_succeeds_on_valid_input(plugin):
     assert ok
 
 
+def test_prefs_ui_validation_fails_on_invalid_keep_alive(plugin):
+    values = {"showDebugInfo": False,
+              "showJomnilinkIIDebugInfo": False,
+              "keepAliveInterval": "soon",
+              "keepAliveTimeout": "-1"}
+
+    ok, d, e = plugin.validatePrefsConfigUi(values)
+    assert not ok
+    assert "keepAliveInterval" in e
+    assert "keepAliveTimeout" in e
+
+
+def test_prefs_ui_validation_needs_keep_alive_timeout(plugin):
+    values = {"showDebugInfo": False,
+              "showJomnilinkIIDebugInfo": False,
+              "keepAliveInterval": "10",
+              "keepAliveTimeout": "0"}
+    ok, d, e = plugin.validatePrefsConfigUi(values)
+    assert not ok
+    assert "keepAliveTimeout" in e
+
+    values["keepAliveInterval"] = "0"
+    ok, d, e = plugin.validatePrefsConfigUi(values)
+    assert ok
+
+
+def test_prefs_ui_validation_keeps_pool_settings_on_error(plugin,
+                                                         connection):
+    pool_size = connection.Connection.pool_size
+    for size in ["0", "-3"]:
+        values = {"showDebugInfo": False,
+                  "showJomnilinkIIDebugInfo": False,
+                  "gatewayPoolSize": size}
+        ok, d, e = plugin.validatePrefsConfigUi(values)
+        assert not ok
+        assert "gatewayPoolSize" in e
+        assert connection.Connection.pool_size == pool_size
+
+    values["gatewayPoolSize"] = "4"
+    ok, d, e = plugin.validatePrefsConfigUi(values)
+    assert ok
+    assert connection.Connection.pool_size == 4
+
+
+def test_keep_alive_settings_passed_to_connections(plugin, omni1,
+                                                   device_factory_fields):
+    plugin.makeConnection(device_factory_fields, [])
+    omni1.setKeepAlive.assert_called_with(10000, 5000)
+
+    values = {"showDebugInfo": False,
+              "showJomnilinkIIDebugInfo": False,
+              "keepAliveInterval": "2",
+              "keepAliveTimeout": "1.5"}
+    ok, d, e = plugin.validatePrefsConfigUi(values)
+    assert ok
+    omni1.setKeepAlive.assert_called_with(2000, 1500)
+
+
+def test_disconnect_records_time_to_detect(plugin, omni1,
+                                           device_factory_fields):
+    plugin.makeConnection(device_factory_fields, [])
+    c = plugin.connections.values()[0]
+    assert c.time_to_detect is None
+
+    omni1.silenceAtDisconnect.return_value = 7500
+    omni1.connected.return_value = False
+    omni1._disconnect("notConnectedEvent", Mock())
+    helpers.run_concurrent_thread(plugin, 1)
+
+    assert c.time_to_detect == 7.5
+    assert plugin.errorLog.called
+    plugin.errorLog.reset_mock()
+
+
+def test_notification_workers_handle_notifications_in_order(
+        plugin, plugin_module, omni1, device_factory_fields):
+    plugin_module.Connection.workers = True
+    plugin.makeConnection(device_factory_fields, [])
+    c = plugin.connections.values()[0]
+    assert c.worker.is_alive()
+
+    handled = []
+
+    def handler(connection, status):
+        handled.append(status.getBatteryReading())
+        if len(handled) == 1:
+            raise ValueError
+
+    plugin.notifications["system_status"].append(handler)
+    for reading in [1, 2, 3]:
+        omni1._notify("systemStatusNotification", jomni_mimic.SystemStatus(
+            reading, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, {}, False, False))
+    c.notification_queue.join()
+
+    assert handled == [1, 2, 3]
+    assert plugin.errorLog.called
+    plugin.errorLog.reset_mock()
+    assert plugin_module.Connection.lag_stats.counts[c.url] == 3
+
+    plugin.writeNotificationLagToLog()
+    assert not plugin.errorLog.called
+
+
+@pytest.yield_fixture
+def switch_often():
+    """ Switch threads as often as possible, to give races a chance """
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    yield
+    sys.setcheckinterval(interval)
+
+
+def test_notification_workers_run_alongside_scheduler(
+        plugin, plugin_module, omni1, omni2, device_factory_fields,
+        device_factory_fields_2, switch_often):
+    plugin_module.Connection.workers = True
+    # With one slot, every job added lands in the slot that run rewrites
+    plugin.scheduler = plugin_module.PollScheduler(tick=0.001, slots=1)
+    plugin.makeConnection(device_factory_fields, [])
+    plugin.makeConnection(device_factory_fields_2, [])
+    assert len(plugin.connections) == 2
+
+    jobs = []
+
+    def handler(connection, status):
+        n = status.getBatteryReading() * 2
+        jobs.append(plugin.scheduler.add(connection.url, "test", n, n, 0.002,
+                                         lambda *args: []))
+
+    plugin.notifications["system_status"].append(handler)
+    stop = threading.Event()
+
+    def update_loop():
+        while not stop.is_set():
+            plugin.scheduler.run()
+    update_thread = threading.Thread(target=update_loop)
+    update_thread.start()
+
+    count = 200
+    for omni in [omni1, omni2]:
+        for reading in range(count):
+            omni._notify("systemStatusNotification",
+                         jomni_mimic.SystemStatus(reading, 0, 0, 0, 0, 0, 0,
+                                                  0, 0, 0, 0, 0, {}, False,
+                                                  False))
+    [c.notification_queue.join() for c in plugin.connections.values()]
+    stop.set()
+    update_thread.join()
+
+    scheduled = [j for slot in plugin.scheduler.wheel for j in slot]
+    assert len(jobs) == count * 2
+    assert set(scheduled) == set(jobs)
+    for c in plugin.connections.values():
+        assert plugin_module.Connection.lag_stats.counts[c.url] == count
+
+
 def test_device_factory_uivalidation_succeeds_on_valid_input(
         plugin, device_factory_fields):
 
@@ -264,6 +645,55 @@ def test_plugin_extensions_match_xml_ids(plugin, xmls):
         assert e in plugin.type_ids_map["event"].keys()
 
 
+def test_extension_manifest_matches_extensions(plugin):
+    for ext in plugin.load_all_extensions():
+        name = type(ext).__module__
+        entry = plugin.manifest[name]
+        assert entry["class"] == type(ext).__name__
+        for thing in ["device", "action", "event"]:
+            assert (sorted(entry["type_ids"][thing]) ==
+                    sorted(ext.type_ids[thing]))
+        assert sorted(entry["callbacks"]) == sorted(ext.callbacks)
+        assert sorted(entry["reports"]) == sorted(ext.reports)
+    assert len(plugin.extensions) == len(plugin.manifest)
+
+
+def test_extensions_load_on_first_use(plugin, indigo,
+                                      device_connection_props):
+    assert not plugin.extensions
+
+    dev = indigo.device.create(Mock(), "omniControllerDevice",
+                               device_connection_props)
+    plugin.deviceStartComm(dev)
+
+    assert list(plugin.loaded_extensions) == ["extension_controller"]
+    ext = plugin.extension_for("device", "omniControllerDevice")
+    assert plugin.extensions == [ext]
+    assert plugin.generateConsoleList == ext.generateConsoleList
+
+
+def test_extension_loaded_once_from_concurrent_callbacks(plugin,
+                                                        monkeypatch):
+    extend_plugin = plugin.extend_plugin
+
+    def slow_extend_plugin(cls):
+        sleep(0.05)
+        return extend_plugin(cls)
+    monkeypatch.setattr(plugin, "extend_plugin", slow_extend_plugin)
+
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(plugin.get_extension("extension_zone")))
+        for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(plugin.extensions) == 1
+    assert results == [plugin.extensions[0]] * 4
+
+
 def test_write_controller_info_to_log_succeeds(plugin, omnis, jomnilinkII,
                                                device_factory_fields,
                                                device_factory_fields_2):
@@ -300,6 +730,24 @@ def test_write_controller_info_to_log_handles_failed_startup(
     assert "is not connected" in args[0]
 
 
+def test_write_controller_info_to_log_when_attached_to_sidecar(
+        indigo, plugin, omni1, omni2, connection, monkeypatch,
+        device_factory_fields):
+    plugin.makeConnection(device_factory_fields, [])
+    omni1.connected.return_value = False
+    omni2.connected.return_value = False
+    monkeypatch.setattr(connection.Connection, "javaproc", None)
+    monkeypatch.setattr(connection.Connection, "java_is_sidecar", True)
+    indigo.server.log.reset_mock()
+
+    plugin.writeControllerInfoToLog()
+
+    args, kwargs = indigo.server.log.call_args
+    assert "is not connected" in args[0]
+    assert "could not be started" not in args[0]
+    assert "left running" in args[0]
+
+
 def create_uploadEventLogData(jomnilinkII):
     mtype = jomnilinkII.Message.MESG_TYPE_EVENT_LOG_DATA = 99
 
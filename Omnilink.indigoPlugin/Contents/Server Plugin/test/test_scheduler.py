@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# Unit Tests for the polling scheduler of Omnilink Plugin for Indigo Server
+#
+# Copyright (C) 2016 Gemini Lasswell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+
+from mock import Mock
+import pytest
+
+from fixtures.imports import Py4JError
+
+
+class Clock(object):
+    """ A clock for the scheduler which only moves when told to """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, scheduler, seconds):
+        """ advance the clock one second at a time, running the
+        scheduler at each step """
+        for i in range(int(seconds)):
+            self.now += 1
+            scheduler.run()
+
+
+@pytest.fixture
+def scheduler_module(plugin_module):
+    import scheduler
+    return scheduler
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def scheduler(scheduler_module, clock):
+    s = scheduler_module.PollScheduler(clock=clock)
+    s.phase["url"] = 0.0
+    s.phase["url2"] = 0.0
+    return s
+
+
+def test_job_is_polled_at_interval(scheduler, clock):
+    poll = Mock(return_value=[])
+    scheduler.add("url", "zone", 1, 1, 10, poll)
+
+    clock.advance(scheduler, 9)
+    assert not poll.called
+    clock.advance(scheduler, 1)
+    poll.assert_called_once_with("url", "zone", 1, 1)
+    clock.advance(scheduler, 10)
+    assert poll.call_count == 2
+
+
+def test_job_longer_than_wheel_is_polled_on_time(scheduler, clock):
+    poll = Mock(return_value=[])
+    scheduler.add("url", "zone", 1, 1, 100, poll)
+
+    clock.advance(scheduler, 99)
+    assert not poll.called
+    clock.advance(scheduler, 1)
+    assert poll.call_count == 1
+
+
+def test_removed_job_is_not_polled(scheduler, clock):
+    poll = Mock(return_value=[])
+    job = scheduler.add("url", "zone", 1, 1, 10, poll)
+    scheduler.remove(job)
+
+    clock.advance(scheduler, 30)
+    assert not poll.called
+    assert not scheduler.jobs
+
+
+def test_due_jobs_are_merged_into_ranges(scheduler, clock):
+    poll = Mock(return_value=[])
+    other_poll = Mock(return_value=[])
+    scheduler.add("url", "zone", 1, 1, 10, poll)
+    scheduler.add("url", "zone", 2, 3, 10, poll)
+    scheduler.add("url", "zone", 7, 7, 10, poll)
+    scheduler.add("url2", "zone", 4, 4, 10, poll)
+    scheduler.add("url", "zone", 4, 4, 10, other_poll)
+
+    clock.advance(scheduler, 10)
+    assert sorted(c[0] for c in poll.call_args_list) == [
+        ("url", "zone", 1, 3),
+        ("url", "zone", 7, 7),
+        ("url2", "zone", 4, 4)]
+    other_poll.assert_called_once_with("url", "zone", 4, 4)
+
+
+def test_interval_adapts_to_changes(scheduler, clock):
+    poll = Mock(return_value=[])
+    job = scheduler.add("url", "zone", 5, 5, 10, poll,
+                        min_interval=5, max_interval=20)
+
+    clock.advance(scheduler, 10)
+    assert job.interval == 15
+    clock.advance(scheduler, 15)
+    assert job.interval == 20
+
+    poll.return_value = [5]
+    clock.advance(scheduler, 20)
+    assert job.interval == 10
+    clock.advance(scheduler, 10)
+    assert job.interval == 5
+    assert poll.call_count == 4
+
+
+def test_merged_jobs_adapt_together(scheduler, clock):
+    poll = Mock(return_value=[1])
+    job1 = scheduler.add("url", "zone", 1, 1, 10, poll,
+                         min_interval=5, max_interval=20)
+    job2 = scheduler.add("url", "zone", 2, 2, 10, poll,
+                         min_interval=5, max_interval=20)
+
+    clock.advance(scheduler, 10)
+    assert job1.interval == job2.interval == 5
+    poll.return_value = []
+    clock.advance(scheduler, 5)
+    assert job1.interval == job2.interval == 7.5
+    assert [c[0] for c in poll.call_args_list] == [("url", "zone", 1, 2)] * 2
+
+
+def test_jobs_due_soon_join_jobs_due_now(scheduler, clock):
+    poll = Mock(return_value=[])
+    scheduler.add("url", "zone", 1, 1, 10, poll)
+    clock.advance(scheduler, 1)
+    scheduler.add("url", "zone", 2, 2, 10, poll)
+
+    clock.advance(scheduler, 9)
+    poll.assert_called_once_with("url", "zone", 1, 2)
+    clock.advance(scheduler, 20)
+    assert [c[0] for c in poll.call_args_list] == [("url", "zone", 1, 2)] * 3
+
+
+def test_fixed_interval_does_not_adapt(scheduler, clock):
+    poll = Mock(return_value=[1])
+    job = scheduler.add("url", "controller", 1, 1, 10, poll)
+    clock.advance(scheduler, 30)
+    assert job.interval == 10
+    assert poll.call_count == 3
+
+
+def test_failed_poll_is_retried(scheduler, clock, plugin):
+    poll = Mock(side_effect=[Py4JError, ValueError, []])
+    scheduler.add("url", "zone", 1, 1, 10, poll)
+
+    clock.advance(scheduler, 30)
+    assert poll.call_count == 3
+    assert plugin.errorLog.call_count == 1
+    plugin.errorLog.reset_mock()
+
+
+def test_controllers_are_given_different_phases(scheduler_module, clock):
+    s = scheduler_module.PollScheduler(clock=clock)
+    jobs = [s.add("url{0}".format(i), "zone", 1, 1, 100, Mock())
+            for i in range(10)]
+    assert len(set(job.due for job in jobs)) > 1
+    assert all(100 <= job.due - 1000 <= 110 for job in jobs)
+
+
+def test_merge_ranges_allows_gap(scheduler_module):
+    jobs = [Mock(first=1, last=2), Mock(first=5, last=5),
+            Mock(first=12, last=12)]
+    merged = scheduler_module.merge_ranges(jobs, max_gap=2)
+    assert [(first, last) for first, last, members in merged] == [
+        (1, 5), (12, 12)]
+    assert merged[0][2] == jobs[:2]
+
+
+def test_number_ranges_splits_at_wide_gaps(scheduler_module):
+    assert scheduler_module.number_ranges([]) == []
+    assert scheduler_module.number_ranges([5, 1, 3, 3]) == [(1, 5)]
+    assert scheduler_module.number_ranges([1, 2, 40, 41, 200]) == [
+        (1, 2), (40, 41), (200, 200)]
+
+
+def test_jobs_can_be_added_from_another_thread_while_polling(scheduler,
+                                                             clock):
+    added = []
+
+    def add_elsewhere():
+        added.append(scheduler.add("url2", "unit", 1, 1, 10, later))
+
+    def poll(*args):
+        t = threading.Thread(target=add_elsewhere)
+        t.start()
+        t.join(5)
+        return []
+    later = Mock(return_value=[])
+    scheduler.add("url", "zone", 1, 1, 10, poll)
+
+    clock.advance(scheduler, 10)
+    assert added
+    clock.advance(scheduler, 10)
+    later.assert_called_once_with("url2", "unit", 1, 1)
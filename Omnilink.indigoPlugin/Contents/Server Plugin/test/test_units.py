@@ -19,7 +19,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from time import sleep
 
-from mock import Mock
+from mock import ANY, Mock
 import pytest
 
 import fixtures.jomnilinkII as jomni_mimic
@@ -140,14 +140,15 @@ def test_notification_changes_device_state(
     assert dev.states["brightnessLevel"] == 0
     assert not plugin.errorLog.called
 
+    # The controller reports a level of N% as 100 + N
     status_msg = jomni_mimic.ObjectStatus(jomnilinkII_message.OBJ_TYPE_UNIT,
-                                          [jomni_mimic.UnitStatus(2, 1, 100)])
+                                          [jomni_mimic.UnitStatus(2, 140, 100)])
 
     omni1._notify("objectStausNotification", status_msg)
     helpers.run_concurrent_thread(plugin, 1)
 
     assert dev.states["onOffState"]
-    assert dev.states["brightnessLevel"] == 1
+    assert dev.states["brightnessLevel"] == 40
     assert dev.states["timeLeftSeconds"] == 100
     assert dev.error_state is None
 
@@ -248,3 +249,357 @@ def test_action_request_logs_network_error(
     plugin.actionControlDimmerRelay(action, dev)
     assert plugin.errorLog.called
     plugin.errorLog.reset_mock()
+
+
+def test_reconnect_resync_fetches_range_and_writes_changes(
+        plugin, indigo, unit_devices, jomnilinkII, omni1, monkeypatch):
+    for dev in unit_devices:
+        plugin.deviceStartComm(dev)
+        dev.setErrorStateOnServer("disconnected")
+    ext = plugin.extension_for("device", "omniRadioRAUnit")
+    connection = plugin.make_connection(unit_devices[0].pluginProps["url"])
+    old_statuses = dict((n, ext.last_status[dev.id])
+                        for dev in unit_devices
+                        for n in [dev.pluginProps["number"]])
+
+    omni1.reqObjectStatus.reset_mock()
+    omni1.reqObjectStatus.side_effect = None
+    omni1.reqObjectStatus.return_value = jomni_mimic.ObjectStatus(
+        jomnilinkII.Message.OBJ_TYPE_UNIT,
+        [jomni_mimic.UnitStatus(n, old_statuses[n].status,
+                                old_statuses[n].time) for n in (1, 3)] +
+        [jomni_mimic.UnitStatus(2, 175, 0)])
+    update = Mock(wraps=ext.update_device_from_status)
+    monkeypatch.setattr(ext, "update_device_from_status", update)
+
+    ext.reconnect_notification(connection, omni1)
+
+    omni1.reqObjectStatus.assert_called_once_with(
+        jomnilinkII.Message.OBJ_TYPE_UNIT, 1, 3)
+    assert update.call_count == 1
+    assert indigo.devices["test Radio RA"].states["brightnessLevel"] == 75
+    for dev in unit_devices:
+        assert dev.error_state is None
+
+
+def dimmer_action(indigo, name, value=0):
+    k = indigo.kDimmerRelayAction
+    for i, a in enumerate(["TurnOn", "TurnOff", "Toggle", "SetBrightness",
+                           "BrightenBy", "DimBy"]):
+        setattr(k, a, i)
+    return Mock(deviceAction=getattr(k, name), actionValue=value)
+
+
+@pytest.fixture
+def optimistic_unit(plugin, indigo, unit_devices):
+    plugin.pluginPrefs["optimisticUnits"] = True
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+    ext = plugin.extension_for("device", "omniRadioRAUnit")
+    now = [0.0]
+    ext.clock = lambda: now[0]
+    return dev, ext, now
+
+
+def test_optimistic_commands_show_at_once_and_compose(
+        plugin, indigo, omni1, jomnilinkII_message, optimistic_unit):
+    dev, ext, now = optimistic_unit
+
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "BrightenBy", 20),
+                                    dev)
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "BrightenBy", 20),
+                                    dev)
+    levels = [c[0][1] for c in omni1.controllerCommand.call_args_list]
+    assert levels == [20, 40]
+    assert dev.states["brightnessLevel"] == 40
+
+    # The controller reports a level of N% as 100 + N
+    for status, pending in [(0, 2), (120, 1), (140, 0)]:
+        omni1._notify("objectStausNotification", jomni_mimic.ObjectStatus(
+            jomnilinkII_message.OBJ_TYPE_UNIT,
+            [jomni_mimic.UnitStatus(2, status, 0)]))
+        helpers.run_concurrent_thread(plugin, 1)
+        assert len(ext.pending.get(dev.id, [])) == pending
+    assert dev.states["onOffState"]
+    assert dev.states["brightnessLevel"] == 40
+
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "BrightenBy", 20),
+                                    dev)
+    assert omni1.controllerCommand.call_args[0][1] == 60
+
+
+def test_optimistic_state_rolls_back_when_not_confirmed(
+        plugin, indigo, omni1, optimistic_unit):
+    dev, ext, now = optimistic_unit
+
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "Toggle"), dev)
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "Toggle"), dev)
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "Toggle"), dev)
+    assert omni1.controllerCommand.call_count == 3
+    assert dev.states["onOffState"]
+    assert len(ext.pending[dev.id]) == 3
+
+    ext.update()
+    assert dev.states["onOffState"]
+
+    now[0] = 10
+    ext.update()
+    assert not dev.states["onOffState"]
+    assert dev.id not in ext.pending
+
+
+def test_rollback_while_disconnected_is_done_once(
+        plugin, indigo, omni1, optimistic_unit, monkeypatch):
+    dev, ext, now = optimistic_unit
+    plugin.actionControlDimmerRelay(dimmer_action(indigo, "Toggle"), dev)
+    ext.last_status.pop(dev.id)
+    omni1.connected.return_value = False
+    update = Mock(wraps=ext.update_device_status)
+    monkeypatch.setattr(ext, "update_device_status", update)
+
+    now[0] = 10
+    for i in range(3):
+        ext.update()
+
+    assert update.call_count == 1
+    assert dev.id not in ext.pending
+    assert dev.error_state == "disconnected"
+
+
+def test_coalescer_collapses_levels_and_keeps_on_off(plugin):
+    import extension_unit
+    now = [0.0]
+    sent = []
+    coalescer = extension_unit.CommandCoalescer(
+        lambda key, name, param: sent.append((name, param)), interval=1,
+        clock=lambda: now[0])
+    key = ("url", 2)
+    for name, param, level in [("PERCENT", 10, True), ("PERCENT", 20, True),
+                               ("PERCENT", 30, True), ("OFF", 0, False),
+                               ("PERCENT", 40, True), ("PERCENT", 50, True)]:
+        coalescer.add(key, name, param, level)
+        coalescer.run()
+    assert sent == [("PERCENT", 10)]
+
+    for i in range(5):
+        now[0] += 1
+        coalescer.run()
+
+    assert sent == [("PERCENT", 10), ("PERCENT", 30), ("OFF", 0),
+                    ("PERCENT", 50)]
+    assert coalescer.counters["url"]["collapsed"] == 2
+    assert coalescer.latency.percentiles("url", [100]) == [3.0]
+    assert not coalescer.queues
+
+
+def test_brightness_actions_are_coalesced(plugin, indigo, omni1,
+                                          unit_devices):
+    plugin.pluginPrefs["unitCommandInterval"] = "0.5"
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+    ext = plugin.extension_for("device", "omniRadioRAUnit")
+    now = [0.0]
+    ext.coalescer.clock = lambda: now[0]
+
+    for level in range(10, 60, 10):
+        plugin.actionControlDimmerRelay(
+            dimmer_action(indigo, "SetBrightness", level), dev)
+    now[0] = 1
+    ext.update()
+
+    levels = [c[0][1] for c in omni1.controllerCommand.call_args_list]
+    assert levels == [10, 50]
+
+
+def test_failed_queued_command_is_reported_and_rolled_back(
+        plugin, indigo, py4j, omni1, jomnilinkII_message, optimistic_unit):
+    dev, ext, now = optimistic_unit
+    plugin.pluginPrefs["unitCommandInterval"] = "0.5"
+    ext.coalescer.clock = lambda: now[0]
+    omni1._notify("objectStausNotification", jomni_mimic.ObjectStatus(
+        jomnilinkII_message.OBJ_TYPE_UNIT,
+        [jomni_mimic.UnitStatus(2, 120, 0)]))
+    helpers.run_concurrent_thread(plugin, 1)
+
+    for level in [30, 60]:
+        plugin.actionControlDimmerRelay(
+            dimmer_action(indigo, "SetBrightness", level), dev)
+    assert dev.states["brightnessLevel"] == 60
+    assert not plugin.errorLog.called
+
+    omni1.controllerCommand.side_effect = py4j.protocol.Py4JError
+    now[0] = 1
+    ext.update()
+
+    assert plugin.errorLog.called
+    assert dev.name in plugin.errorLog.call_args[0][0]
+    plugin.errorLog.reset_mock()
+    assert dev.id not in ext.pending
+    assert dev.states["brightnessLevel"] == 20
+
+
+def test_parse_unit_commands(plugin):
+    import extension_unit
+    assert extension_unit.parse_unit_commands(
+        "1 on, 2 OFF\n3 40%,4 0,\narea 2 off") == [
+            (1, "CMD_UNIT_ON", 0), (2, "CMD_UNIT_OFF", 0),
+            (3, "CMD_UNIT_PERCENT", 40), (4, "CMD_UNIT_PERCENT", 0),
+            (2, "CMD_UNIT_AREA_ALL_OFF", 0)]
+    for bad in ["1", "1 dim", "x on", "1 101", "area on"]:
+        with pytest.raises(ValueError):
+            extension_unit.parse_unit_commands(bad)
+
+
+def test_pending_commands_match_unit_status_bytes(plugin):
+    import extension_unit
+    import omni_messages
+    on = extension_unit.PendingCommand(True, None, 0)
+    off = extension_unit.PendingCommand(False, 0, 0)
+    dim = extension_unit.PendingCommand(True, 40, 0)
+
+    def status(value):
+        return omni_messages.UnitStatus(2, value, 0)
+
+    assert on.matches(status(1)) and on.matches(status(175))
+    assert not on.matches(status(0)) and not on.matches(status(100))
+    assert off.matches(status(0)) and off.matches(status(100))
+    assert not off.matches(status(1))
+    assert dim.matches(status(140))
+    assert not dim.matches(status(120)) and not dim.matches(status(0))
+
+
+def test_unit_commands_are_sent_as_one_batch(plugin, indigo, gateway,
+                                             omni1, unit_devices):
+    plugin.pluginPrefs["optimisticUnits"] = True
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+    gateway.entry_point.controllerCommands.return_value = (
+        "\nOmniInvalidResponseException")
+    tup = plugin.validateActionConfigUi({"commands": "2 60, 5 off"},
+                                        "sendUnitCommands", 1)
+    assert tup[0]
+
+    plugin.sendUnitCommands(Mock(deviceId=dev.id,
+                                 props={"commands": "2 60, 5 off"}))
+
+    gateway.entry_point.controllerCommands.assert_called_once_with(
+        omni1, "CMD_UNIT_PERCENT 60 2\nCMD_UNIT_OFF 0 5")
+    assert not omni1.controllerCommand.called
+    assert dev.states["brightnessLevel"] == 60
+    assert plugin.errorLog.called
+    plugin.errorLog.reset_mock()
+
+
+def test_unit_commands_replace_queued_commands(plugin, indigo, gateway,
+                                               omni1, unit_devices):
+    plugin.pluginPrefs["unitCommandInterval"] = "0.5"
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+    ext = plugin.extension_for("device", "omniRadioRAUnit")
+    now = [0.0]
+    ext.coalescer.clock = lambda: now[0]
+    gateway.entry_point.controllerCommands.return_value = ""
+
+    for level in [10, 20]:
+        plugin.actionControlDimmerRelay(
+            dimmer_action(indigo, "SetBrightness", level), dev)
+    plugin.sendUnitCommands(Mock(deviceId=dev.id,
+                                 props={"commands": "2 60"}))
+    now[0] = 1
+    ext.update()
+
+    levels = [c[0][1] for c in omni1.controllerCommand.call_args_list]
+    assert levels == [10]
+    gateway.entry_point.controllerCommands.assert_called_once_with(
+        omni1, "CMD_UNIT_PERCENT 60 2")
+
+
+def test_unit_commands_with_substitutions_are_validated(plugin,
+                                                        monkeypatch):
+    monkeypatch.setattr(plugin, "substitute",
+                        Mock(return_value=(False, "no such variable")))
+    ok, values, errors = plugin.validateActionConfigUi(
+        {"commands": "2 %%v:1234%%"}, "sendUnitCommands", 1)
+
+    assert not ok
+    assert errors["commands"] == "no such variable"
+    plugin.substitute.assert_called_once_with("2 %%v:1234%%",
+                                              validateOnly=True)
+
+
+def test_commands_are_held_while_disconnected(
+        plugin, indigo, gateway, omni1, unit_devices, patched_datetime):
+    plugin.pluginPrefs["holdCommandsTime"] = "60"
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+
+    omni1.connected.return_value = False
+    omni1._disconnect("notConnectedEvent", Mock())
+    helpers.run_concurrent_thread(plugin, 1)
+    assert plugin.errorLog.called
+    plugin.errorLog.reset_mock()
+
+    for level in [10, 30]:
+        plugin.actionControlDimmerRelay(
+            dimmer_action(indigo, "SetBrightness", level), dev)
+    assert not omni1.controllerCommand.called
+    assert not plugin.errorLog.called
+
+    gateway.entry_point.controllerCommands.return_value = ""
+    patched_datetime.fast_forward(minutes=2)
+    sleep(0.1)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    gateway.entry_point.controllerCommands.assert_called_once_with(
+        ANY, "CMD_UNIT_PERCENT 30 2")
+
+
+def test_held_commands_are_sent_singly_without_batch_call(
+        plugin, indigo, gateway, py4j, omni1, omni2, unit_devices,
+        patched_datetime):
+    plugin.pluginPrefs["holdCommandsTime"] = "60"
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+
+    omni1.connected.return_value = False
+    omni1._disconnect("notConnectedEvent", Mock())
+    helpers.run_concurrent_thread(plugin, 1)
+    plugin.errorLog.reset_mock()
+
+    plugin.actionControlDimmerRelay(
+        dimmer_action(indigo, "SetBrightness", 30), dev)
+
+    gateway.entry_point.controllerCommands.side_effect = (
+        py4j.protocol.Py4JError("Method controllerCommands does not exist"))
+    patched_datetime.fast_forward(minutes=2)
+    sleep(0.1)
+    helpers.run_concurrent_thread(plugin, 1)
+
+    # The reconnection gets the next jomnilinkII Connection
+    assert [c[0][1:] for c in omni2.controllerCommand.call_args_list] == [
+        (30, 2)]
+    assert not plugin.errorLog.called
+
+
+def test_unit_timer_counts_down_locally(
+        plugin, indigo, omni1, jomnilinkII_message, unit_devices):
+    plugin.pluginPrefs["unitTimerGranularity"] = "10"
+    dev = indigo.devices["test Radio RA"]
+    plugin.deviceStartComm(dev)
+    ext = plugin.extension_for("device", "omniRadioRAUnit")
+    now = [0.0]
+    ext.clock = lambda: now[0]
+    requests = omni1.reqObjectStatus.call_count
+
+    omni1._notify("objectStausNotification", jomni_mimic.ObjectStatus(
+        jomnilinkII_message.OBJ_TYPE_UNIT,
+        [jomni_mimic.UnitStatus(2, 1, 100)]))
+    helpers.run_concurrent_thread(plugin, 1)
+    assert dev.states["timeLeftSeconds"] == 100
+
+    for t, left in [(12.5, 88), (15, 88), (22.5, 78), (200, 0)]:
+        now[0] = t
+        ext.update()
+        assert dev.states["timeLeftSeconds"] == left
+    assert dev.id not in ext.deadlines
+    assert omni1.reqObjectStatus.call_count == requests
@@ -47,6 +47,14 @@ def zone_devices(plugin, indigo, device_factory_fields,
                                device_connection_props)
 
 
+@pytest.fixture
+def temperature_zone(omni_zone_props):
+    """ Make the "Motion" zone a temperature zone. Must be requested
+    before zone_devices. """
+    omni_zone_props[1].ZoneType = 82
+    return omni_zone_props[1]
+
+
 @pytest.fixture
 def zone_devices_2(plugin, indigo, device_factory_fields_2, zone_devices,
                    device_connection_props_2):
@@ -148,6 +156,22 @@ def test_notification_changes_device_state(plugin, indigo, zone_devices,
     assert dev.error_state is None
 
 
+def test_notification_releases_java_objects(plugin, indigo, zone_devices,
+                                            jomnilinkII, omni1, gateway):
+    dev = indigo.devices["Front Door"]
+    plugin.deviceStartComm(dev)
+    record = jomni_mimic.ZoneStatus(1, 1, 100)
+    status_msg = jomni_mimic.ObjectStatus(jomnilinkII.Message.OBJ_TYPE_ZONE,
+                                          [record])
+
+    omni1._notify("objectStausNotification", status_msg)
+
+    gateway.detach.assert_any_call(status_msg)
+    gateway.detach.assert_any_call(record)
+    helpers.run_concurrent_thread(plugin, 1)
+    assert dev.states["condition"] == "Not Ready"
+
+
 def test_notification_ignores_non_zone_notifications(plugin, indigo, omni1,
                                                      zone_devices):
     status_msg = jomni_mimic.ObjectStatus(Mock(),
@@ -273,3 +297,68 @@ def test_device_stop_comm_succeeds(indigo, plugin, zone_devices):
     dev = indigo.devices["Motion"]
     plugin.deviceStartComm(dev)
     plugin.deviceStopComm(dev)
+
+
+def test_notification_filter_follows_started_devices(plugin, indigo,
+                                                     zone_devices, omni1):
+    for dev in zone_devices:
+        plugin.deviceStartComm(dev)
+    plugin.update()
+    omni1.setNotificationFilter.assert_called_once_with("1:1-3")
+
+    plugin.deviceStopComm(indigo.devices["Motion"])
+    plugin.update()
+    numbers = [d.pluginProps["number"] for d in zone_devices
+               if d.name != "Motion"]
+    omni1.setNotificationFilter.assert_called_with(
+        "1:" + ",".join("{0}-{0}".format(n) for n in sorted(numbers)))
+
+
+def test_temperature_zone_is_polled(plugin, indigo, temperature_zone,
+                                    zone_devices, jomnilinkII, omni1):
+    for dev in zone_devices:
+        plugin.deviceStartComm(dev)
+    ext = plugin.extension_for("device", "omniZoneDevice")
+    dev = indigo.devices["Motion"]
+    assert list(ext.poll_jobs.keys()) == [dev.id]
+
+    omni1.reqObjectStatus.side_effect = None
+    omni1.reqObjectStatus.return_value = jomni_mimic.ObjectStatus(
+        jomnilinkII.Message.OBJ_TYPE_ZONE,
+        [jomni_mimic.ZoneStatus(n, 0, 100 if n != 2 else 72)
+         for n in range(1, 4)])
+
+    assert ext.poll_zones(dev.pluginProps["url"], "zone", 1, 3) == [2]
+    assert dev.states["sensorValue"] == 72
+    assert ext.poll_zones(dev.pluginProps["url"], "zone", 1, 3) == []
+
+    plugin.deviceStopComm(dev)
+    assert not ext.poll_jobs
+    assert not plugin.scheduler.jobs
+
+
+def test_reconnect_resync_fetches_range_and_writes_changes(
+        plugin, indigo, zone_devices, jomnilinkII, omni1, monkeypatch):
+    for dev in zone_devices:
+        plugin.deviceStartComm(dev)
+        dev.setErrorStateOnServer("disconnected")
+    ext = plugin.extension_for("device", "omniZoneDevice")
+    connection = plugin.make_connection(zone_devices[0].pluginProps["url"])
+
+    omni1.reqObjectStatus.reset_mock()
+    omni1.reqObjectStatus.side_effect = None
+    omni1.reqObjectStatus.return_value = jomni_mimic.ObjectStatus(
+        jomnilinkII.Message.OBJ_TYPE_ZONE,
+        [jomni_mimic.ZoneStatus(n, 1 if n == 3 else 0, 100)
+         for n in range(1, 4)])
+    update = Mock(wraps=ext.update_device_from_status)
+    monkeypatch.setattr(ext, "update_device_from_status", update)
+
+    ext.reconnect_notification(connection, omni1)
+
+    omni1.reqObjectStatus.assert_called_once_with(
+        jomnilinkII.Message.OBJ_TYPE_ZONE, 1, 3)
+    assert update.call_count == 1
+    assert indigo.devices["Smoke Det"].states["condition"] == "Not Ready"
+    for dev in zone_devices:
+        assert dev.error_state is None